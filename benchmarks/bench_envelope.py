@@ -0,0 +1,81 @@
+# -*- coding: utf-8 *-*
+
+"""Compara el armado del envelope de PayOnLine_3p con suds (factory +
+marshalling) contra el template precompilado de nps.envelope. No se
+envia nada por la red.
+
+    PYTHONPATH=. python benchmarks/bench_envelope.py [-n 10000]
+"""
+
+import argparse
+import time
+
+from suds.cache import NoCache
+from suds.client import Client
+
+from nps import transactions
+from nps.envelope import EnvelopeTemplate
+from nps.pool import PooledClient
+from nps.simulator import WSDL
+from nps.wsdl import parse_wsdl
+
+
+def build_transaction(i):
+    transaction = transactions.PayOnlineTransactionThreeSteps(
+        'file://' + WSDL, 'merchant', 'secret')
+    request = transaction.request
+    request.psp_MerchantId = 'merchant'
+    request.psp_MerchTxRef = 'ref-%s' % i
+    request.psp_MerchOrderId = 'order-%s' % i
+    request.psp_Amount = '150.32'
+    request.psp_Currency = '032'
+    request.psp_Product = '14'
+    request.psp_NumPayments = '1'
+    request.psp_ReturnURL = 'http://shop.example.com/return?tx=%s&a=1' % i
+    request.psp_CustomerMail = 'customer@example.com'
+    request.psp_SecureHash = '0' * 32
+    return transaction
+
+
+def bench_suds(transaction, n):
+    client = Client('file://' + WSDL, nosend=True, cache=NoCache())
+    pooled = PooledClient(WSDL, client)
+    request = transaction.request
+    start = time.perf_counter()
+    for i in range(n):
+        ws_factory = pooled.create(transaction.factory)
+        for key, value in zip(request.schema.names, request.values_tuple()):
+            if value:
+                ws_factory[key] = value
+        pooled.method(transaction.method)(ws_factory).envelope
+    return time.perf_counter() - start
+
+
+def bench_template(transaction, n):
+    with open(WSDL, 'rb') as fh:
+        description = parse_wsdl(fh.read())
+    operation = description.operations[transaction.method]
+    template = EnvelopeTemplate.for_request(
+        operation, transaction.request.__class__,
+        description.types[operation.input_type])
+    request = transaction.request
+    start = time.perf_counter()
+    for i in range(n):
+        template.render_request(request)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    transaction = build_transaction(1)
+    for label, bench in (('suds', bench_suds), ('template', bench_template)):
+        seconds = bench(transaction, args.n)
+        print('%-10s %10.3f s %10.1f us/envelope' % (
+            label, seconds, seconds * 1e6 / args.n))
+
+
+if __name__ == '__main__':
+    main()
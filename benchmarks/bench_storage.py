@@ -0,0 +1,91 @@
+# -*- coding: utf-8 *-*
+
+"""Compara el almacenamiento de valores de los fields: el modelo anterior
+(un WeakKeyDictionary por field) contra el actual (__slots__ y una lista
+de valores por instancia).
+
+    PYTHONPATH=. python benchmarks/bench_storage.py [-n 1000000]
+
+Para cada modelo se reporta el tiempo de crear N requests y asignar y
+leer sus campos Text, y la memoria asignada para mantener vivos
+`--keep` de ellos.
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from weakref import WeakKeyDictionary
+
+from nps import fields
+from nps.transactions import BaseRequestResponse
+
+
+FIELDS = ['psp_Field%02d' % i for i in range(20)]
+
+
+class WeakText(fields.Text):
+    """Text con el almacenamiento anterior."""
+
+    def __init__(self, *args, **kwargs):
+        super(WeakText, self).__init__(*args, **kwargs)
+        self.data = WeakKeyDictionary()
+
+    def __get__(self, instance, owner):
+        return self.data.get(instance)
+
+    def __set__(self, instance, value):
+        self.data[instance] = self._validate(value)
+
+
+LegacyRequest = type('LegacyRequest', (object,), dict(
+    (name, WeakText(max_length=64)) for name in FIELDS))
+
+SlotsRequest = type('SlotsRequest', (BaseRequestResponse,), dict(
+    (name, fields.Text(max_length=64)) for name in FIELDS))
+
+
+def run(cls, n):
+    start = time.perf_counter()
+    for i in range(n):
+        request = cls()
+        for name in FIELDS:
+            setattr(request, name, 'value')
+        for name in FIELDS:
+            getattr(request, name)
+    return time.perf_counter() - start
+
+
+def allocated(cls, keep):
+    gc.collect()
+    tracemalloc.start()
+    requests = []
+    for i in range(keep):
+        request = cls()
+        for name in FIELDS:
+            setattr(request, name, 'value')
+        requests.append(request)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1000000)
+    parser.add_argument('--keep', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    print('%-8s %12s %14s %14s' % ('model', 'seconds', 'ns/attr op',
+                                   'bytes/request'))
+    for label, cls in (('weakref', LegacyRequest), ('slots', SlotsRequest)):
+        seconds = run(cls, args.n)
+        size = allocated(cls, args.keep)
+        print('%-8s %12.2f %14.1f %14.1f' % (
+            label, seconds, seconds * 1e9 / (args.n * len(FIELDS) * 2),
+            float(size) / args.keep))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 *-*
+
+"""Suite de benchmarks: fields, items y secure hash, y process() contra el
+simulador local de nps.simulator (modos 'echo' y 'realistic').
+
+    PYTHONPATH=. python benchmarks/suite.py -o results.json
+    PYTHONPATH=. python benchmarks/suite.py --baseline benchmarks/baseline.json
+    PYTHONPATH=. python benchmarks/suite.py --save-baseline benchmarks/baseline.json
+
+Cada caso se corre `--repeat` veces y se toma la mejor. Los resultados se
+escriben como JSON ({nombre: {us_per_op, ops_per_sec, n}}). Con
+`--baseline`, el script termina con error si algun caso tardo mas que el
+baseline mas la tolerancia (`--tolerance`, 0.25 = 25%).
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from nps import fields
+from nps import hashing
+from nps import transactions
+from nps.gateway import NPSGateway
+from nps.simulator import FakeNPS
+from nps.transactions import BaseRequestResponse
+
+
+# (nombre, field, valor valido)
+FIELDS = [
+    ('Text', fields.Text(max_length=64), 'Compra online'),
+    ('Email', fields.Email(), 'customer@example.com'),
+    ('Version', fields.Version(validate=True), '2.2'),
+    ('Url', fields.Url(), 'http://shop.example.com/return?tx=1'),
+    ('Date', fields.Date(), '2013-05-21'),
+    ('DateTime', fields.DateTime(), '2013-05-21 12:30:00'),
+    ('Time', fields.Time(), '12:30:00'),
+    ('MD5', fields.MD5(), '0123456789abcdef0123456789abcdef'),
+    ('Numeric', fields.Numeric(max_length=12), '15032'),
+    ('Amount', fields.Amount(max_length=12), '150.32'),
+    ('Alfa', fields.Alfa(max_length=15), 'Compra'),
+    ('Alfanumeric', fields.Alfanumeric(max_length=64), 'ref123'),
+    ('Order', fields.Order(max_length=64), 'order-123'),
+    ('MerchantId', fields.MerchantId(max_length=14), 'merchant_1'),
+    ('Country', fields.Country(length=3, in_=('ARG', 'URY')), 'ARG'),
+]
+
+COLUMN = 1000
+
+
+def measure(fn, n, repeat):
+    """Mejor tiempo, en segundos por operacion, de llamar `n` veces a
+    `fn` en `repeat` corridas."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        elapsed = (time.perf_counter() - start) / n
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def field_cases():
+    for name, field, value in FIELDS:
+        cls = type('Bench' + name, (BaseRequestResponse,),
+                   dict(psp_Field=field))
+        instance = cls()
+
+        def assign(instance=instance, value=value):
+            instance.psp_Field = value
+
+        column = [value] * COLUMN
+        yield 'fields.%s.assign' % name, assign, 1
+        yield ('fields.%s.validate_many' % name,
+               lambda field=field, column=column: field.validate_many(column),
+               COLUMN)
+
+
+def payment(url, i=1):
+    transaction = transactions.PayOnlineTransactionThreeSteps(
+        url, 'merchant', 'secret')
+    request = transaction.request
+    request.psp_MerchantId = 'merchant'
+    request.psp_MerchTxRef = 'ref-%s' % i
+    request.psp_MerchOrderId = 'order-%s' % i
+    request.psp_Amount = '150.32'
+    request.psp_Currency = '032'
+    request.psp_Product = '14'
+    request.psp_NumPayments = '1'
+    request.psp_ReturnURL = 'http://shop.example.com/return?tx=%s&a=1' % i
+    request.psp_CustomerMail = 'customer@example.com'
+    return transaction
+
+
+def query(url, i=1):
+    return transactions.SimpleQueryTx(url, 'merchant', 'secret', None,
+                                      'ref%s' % i)
+
+
+def hash_cases():
+    transaction = payment('http://nps.test/ws.php?wsdl')
+    yield 'transaction.items', lambda: transaction.request.items, 1
+    for name, backend in (('md5', hashing.MD5()),
+                          ('sha256', hashing.SHA256()),
+                          ('hmac_sha256', hashing.HMAC('sha256'))):
+        gateway = NPSGateway(hash_backend=backend)
+        yield ('secure_hash.%s' % name,
+               lambda gateway=gateway: gateway.create_secure_hash_for(
+                   transaction), 1)
+
+
+def process_cases(servers):
+    for mode, server in servers:
+        for engine in ('suds', 'template'):
+            gateway = NPSGateway(engine=engine)
+            for label, build in (('payment', payment), ('query', query)):
+                gateway.process(build(server.url))  # carga el WSDL
+
+                def call(gateway=gateway, build=build, url=server.url):
+                    gateway.process(build(url))
+
+                yield 'process.%s.%s.%s' % (engine, label, mode), call, 1
+
+
+def run(only=None, scale=1.0, repeat=5):
+    servers = [(mode, FakeNPS(mode).start())
+               for mode in ('echo', 'realistic')]
+    results = dict()
+    try:
+        groups = [(field_cases(), 20000), (hash_cases(), 20000),
+                  (process_cases(servers), 200)]
+        for cases, n in groups:
+            for name, fn, ops in cases:
+                if only and not any(name.startswith(o) for o in only):
+                    continue
+                loops = max(1, int(n * scale / ops))
+                seconds = measure(fn, loops, repeat) / ops
+                results[name] = dict(us_per_op=seconds * 1e6,
+                                     ops_per_sec=1.0 / seconds,
+                                     n=loops * ops)
+    finally:
+        for _, server in servers:
+            server.stop()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Retorna los casos que empeoraron mas que `tolerance` respecto de
+    `baseline`, como tuplas (nombre, baseline, actual)."""
+    regressions = []
+    for name, current in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if current['us_per_op'] > reference['us_per_op'] * (1 + tolerance):
+            regressions.append((name, reference['us_per_op'],
+                                current['us_per_op']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', help='JSON con los resultados')
+    parser.add_argument('--baseline', help='JSON contra el cual comparar')
+    parser.add_argument('--save-baseline', help='Guarda los resultados '
+                        'como baseline en este path')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--only', action='append',
+                        help='Prefijo de los casos a correr')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplica la cantidad de iteraciones')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run(args.only, args.scale, args.repeat)
+    report = dict(python=platform.python_version(),
+                  platform=platform.platform(), results=results)
+    for name, result in sorted(results.items()):
+        print('%-42s %12.3f us %14.0f ops/s' % (
+            name, result['us_per_op'], result['ops_per_sec']))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'wt') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'rt') as fh:
+            baseline = json.load(fh)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print('REGRESSION %s: %.3f us -> %.3f us (%+.0f%%)' % (
+                name, before, after, (after / before - 1) * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,7 @@
 __version__ = '0.1'
 
+# NPSGateway es liviano de construir: suds, yaml y la configuracion se
+# cargan recien cuando se usan por primera vez.
 from nps.gateway import NPSGateway
 gateway = NPSGateway()
 
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 *-*
+
+"""Gateway asincronico: envia los mismos envelopes que el camino con suds
+sobre un pool de conexiones HTTP keep-alive, sin bloquear el event loop."""
+
+import asyncio
+import copy
+import random
+import time
+
+from urllib.parse import urlsplit
+
+from nps import envelope
+from nps import wsdl
+from nps.envelope import HTTPError
+from nps.gateway import NPSGateway
+
+
+class Connection(object):
+
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool(object):
+    """Pool de conexiones HTTP/1.1 keep-alive por (scheme, host, port).
+
+    Parametros del constructor:
+        max_idle(int) = Conexiones libres que se conservan por host.
+    """
+
+    def __init__(self, max_idle=32):
+        self.max_idle = max_idle
+        self._idle = dict()
+
+    async def post(self, url, body, headers, parser=None, idempotent=False):
+        """Envia un POST y retorna (status, body). Con `parser` (un
+        envelope.ResponseParser), el cuerpo de una respuesta 200 se le
+        entrega a medida que llega y el body retornado es None. Solo un
+        POST `idempotent` se repite si el servidor corta la conexion
+        despues de recibir el pedido."""
+
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        port = parts.port or (443 if secure else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        head = ['POST %s HTTP/1.1' % path,
+                'Host: %s' % parts.netloc,
+                'Content-Length: %d' % len(body),
+                'Connection: keep-alive']
+        head.extend('%s: %s' % item for item in headers.items())
+        message = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+        # Una conexion libre puede haber sido cerrada por el servidor; en
+        # ese caso se reintenta una sola vez con una conexion nueva, salvo
+        # que el pedido ya haya salido y no sea idempotente: NPS pudo
+        # haberlo procesado.
+        for reused in (True, False):
+            conn = self._get(key) if reused else None
+            if reused and conn is None:
+                continue
+            if conn is None:
+                reader, writer = await asyncio.open_connection(
+                    parts.hostname, port, ssl=secure or None)
+                conn = Connection(key, reader, writer)
+            sent = False
+            try:
+                conn.writer.write(message)
+                await conn.writer.drain()
+                sent = True
+                status, keep_alive, data = await self._read_response(
+                    conn.reader, parser)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                # si ya se le entrego parte de la respuesta al parser no
+                # se puede reintentar.
+                if reused and (idempotent or not sent) and \
+                        (parser is None or not parser.received):
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if keep_alive:
+                self._put(conn)
+            else:
+                conn.close()
+            return status, data
+
+    def _get(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            conn = idle.pop()
+            if not conn.reader.at_eof():
+                return conn
+            conn.close()
+        return None
+
+    def _put(self, conn):
+        idle = self._idle.setdefault(conn.key, [])
+        if len(idle) < self.max_idle:
+            idle.append(conn)
+        else:
+            conn.close()
+
+    async def _read_response(self, reader, parser=None):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by peer')
+        version, status = status_line.split(None, 2)[:2]
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and \
+            version != b'HTTP/1.0'
+        chunks = []
+        streaming = parser is not None and int(status) == 200
+        feed = parser.feed if streaming else chunks.append
+        if 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining:
+                chunk = await reader.readexactly(
+                    min(remaining, envelope.CHUNK_SIZE))
+                feed(chunk)
+                remaining -= len(chunk)
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                feed(await reader.readexactly(size))
+                await reader.readline()
+        else:
+            while True:
+                chunk = await reader.read(envelope.CHUNK_SIZE)
+                if not chunk:
+                    break
+                feed(chunk)
+            keep_alive = False
+        data = None if streaming else b''.join(chunks)
+        return int(status), keep_alive, data
+
+    def close(self):
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
+
+
+class AsyncNPSGateway(NPSGateway):
+    """Version asincronica de NPSGateway.
+
+    Parametros del constructor:
+        concurrency(int) = Llamadas a NPS en vuelo como maximo.
+        timeout(float) = Segundos de espera maxima por llamada.
+        artifacts = Paths de WSDL compilados con nps-compile-wsdl.
+        transaction_data(bool) = Guardar psp_Transaction en
+                                 response.user_data.
+        cache = cache.QueryCache para las respuestas de SimpleQueryTx.
+        instrumentation = instrumentation.Instrumentation que recibe los
+                          tiempos de cada fase de `process`.
+        merchants = merchants.MerchantRegistry. Cada merchant registrado
+                    tiene su rate limit y a lo sumo `pool_size` llamadas
+                    en vuelo, dentro del total de `concurrency`.
+        rate_limiter = ratelimit.TokenBucket con las llamadas por segundo
+                       a NPS de todo el gateway.
+        limiter = ratelimit.AdaptiveLimiter que ajusta las llamadas en
+                  vuelo, dentro de `concurrency`, segun la latencia y los
+                  errores.
+        max_wait(float) = Segundos que una llamada espera lugar en el
+                          rate_limiter y en el limiter.
+        breaker = breaker.CircuitBreaker. Mientras esta abierto las
+                  llamadas fallan con breaker.CircuitOpen.
+        hedging = hedging.Hedging. Las transacciones idempotentes que
+                  tardan mas que el percentil configurado se envian de
+                  nuevo; se usa la primera respuesta y se cancela la otra.
+    """
+
+    def __init__(self, concurrency=100, timeout=30, artifacts=(),
+                 connections=None, transaction_data=False, cache=None,
+                 instrumentation=None, merchants=None, rate_limiter=None,
+                 limiter=None, max_wait=None, breaker=None, hedging=None):
+        super(AsyncNPSGateway, self).__init__(
+            artifacts=artifacts, transaction_data=transaction_data,
+            cache=cache, instrumentation=instrumentation,
+            merchants=merchants, rate_limiter=rate_limiter,
+            limiter=limiter, max_wait=max_wait, breaker=breaker,
+            hedging=hedging)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.connections = connections or ConnectionPool(concurrency)
+        self._semaphore = None
+        self._merchant_semaphores = dict()
+        self._describing = dict()
+
+    def _semaphore_for(self, merchant):
+        if merchant is None:
+            return None
+        # como en pools_for, un merchant que cambio con
+        # MerchantRegistry.reload recibe un semaforo nuevo.
+        entry = self._merchant_semaphores.get(merchant.merchant_id)
+        if entry is None or entry[0] is not merchant:
+            entry = (merchant, asyncio.Semaphore(merchant.pool_size))
+            self._merchant_semaphores[merchant.merchant_id] = entry
+        return entry[1]
+
+    async def describe(self, url):
+        """Retorna el ServiceDescription del WSDL de `url`. Las llamadas
+        que llegan mientras se descarga el WSDL esperan esa misma
+        descarga."""
+        description = self.descriptions.get(url)
+        if description is not None:
+            return description
+        artifact = self.artifacts.get(url)
+        if artifact is not None:
+            description = self.descriptions[url] = artifact.description
+            return description
+        future = self._describing.get(url)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch_description(url))
+            self._describing[url] = future
+            future.add_done_callback(
+                lambda _: self._describing.pop(url, None))
+        # shield: si se cancela una de las llamadas que espera, la
+        # descarga sigue para las demas.
+        return await asyncio.shield(future)
+
+    async def _fetch_description(self, url):
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, wsdl.fetch, url)
+        description = self.descriptions[url] = wsdl.parse_wsdl(data)
+        return description
+
+    def warmup(self, urls, size=1):
+        raise TypeError('AsyncNPSGateway does not use suds clients, '
+                        'there is nothing to warm up')
+
+    def process_batch(self, transactions, workers=None, concurrency=8,
+                      chunksize=500, max_pending=None):
+        raise TypeError('AsyncNPSGateway.process_batch is not supported, '
+                        'await process() for each transaction instead')
+
+    async def query_many(self, refs, url, merchant_id, secret,
+                         concurrency=8, checkpoint=None, retries=3,
+                         backoff=0.5):
+        """Version asincronica de NPSGateway.query_many: un generador
+        asincronico de pares (ref, transaccion o excepcion), en orden de
+        finalizacion, con a lo sumo `concurrency` consultas en vuelo.
+
+            async for ref, result in gateway.query_many(refs, url,
+                                                        merchant_id, secret):
+                ...
+        """
+        from nps import reconcile
+        from nps.transactions import SimpleQueryTx
+
+        if isinstance(checkpoint, str):
+            checkpoint = reconcile.Checkpoint(checkpoint)
+        refs = iter(refs)
+        if checkpoint is not None:
+            refs = (ref for ref in refs if ref not in checkpoint)
+
+        async def query(ref):
+            for attempt in range(retries + 1):
+                try:
+                    return await self.process(
+                        SimpleQueryTx(url, merchant_id, secret, None, ref))
+                except reconcile.TRANSIENT_ERRORS:
+                    if attempt == retries:
+                        raise
+                    await asyncio.sleep(backoff * (2 ** attempt) *
+                                        random.uniform(0.5, 1.5))
+
+        pending = dict()
+        try:
+            for ref in refs:
+                pending[asyncio.ensure_future(query(ref))] = ref
+                if len(pending) >= concurrency:
+                    break
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    ref = pending.pop(task)
+                    result = task.exception()
+                    if result is None:
+                        result = task.result()
+                        if checkpoint is not None:
+                            checkpoint.add(ref)
+                    yield ref, result
+                    for next_ref in refs:
+                        pending[asyncio.ensure_future(
+                            query(next_ref))] = next_ref
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+            if checkpoint is not None:
+                checkpoint.close()
+
+    async def process(self, transaction, timeout=None):
+        """Procesa la transaccion dada contra NPS.
+        Retorna el objeto transaccion pasado.
+        """
+
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return await self._process_async(transaction, timeout, None)
+        timer = instrumentation.start(transaction)
+        try:
+            await self._process_async(transaction, timeout, timer)
+        except BaseException as exc:
+            instrumentation.finish(transaction, timer, exc)
+            raise
+        instrumentation.finish(transaction, timer)
+        return transaction
+
+    async def _process_async(self, transaction, timeout, timer):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if timeout is None:
+            timeout = self.timeout
+        merchant = None
+        if self.merchants is not None:
+            merchant = self.merchants.route(transaction)
+        cache = None
+        if getattr(transaction, 'idempotent', False):
+            cache = self.cache
+        if cache is not None:
+            hit = cache.fetch(transaction)
+            if timer is not None:
+                timer.mark('cache')
+                timer.count('cache_hit' if hit else 'cache_miss')
+            if hit:
+                return transaction
+
+        breaker = self.breaker
+        if breaker is None:
+            await self._send_async(transaction, timeout, timer, merchant)
+        else:
+            breaker.allow()
+            try:
+                await self._send_async(transaction, timeout, timer, merchant)
+            except BaseException as exc:
+                breaker.failure(exc)
+                raise
+            breaker.success()
+        if cache is not None:
+            cache.update(transaction)
+            if timer is not None:
+                timer.mark('cache_store')
+        return transaction
+
+    async def _send_async(self, transaction, timeout, timer, merchant):
+        limited = False
+        if merchant is not None and merchant.limiter is not None:
+            delay = merchant.limiter.reserve(merchant.max_wait)
+            if delay:
+                await asyncio.sleep(delay)
+            limited = True
+        if self.rate_limiter is not None:
+            delay = self.rate_limiter.reserve(self.max_wait)
+            if delay:
+                await asyncio.sleep(delay)
+            limited = True
+        if limited and timer is not None:
+            timer.mark('ratelimit')
+
+        request = transaction.request
+        description = await self.describe(transaction.url)
+        operation = description.operations[transaction.method]
+        template = self.template_for(transaction, description)
+        if timer is not None:
+            timer.mark('wsdl')
+
+        request.psp_SecureHash = self.create_secure_hash_for(transaction)
+        if timer is not None:
+            timer.mark('hash')
+        body = template.render_request(request)
+        if timer is not None:
+            timer.mark('serialize')
+
+        call = self._call_async
+        if self.hedging is not None and \
+                getattr(transaction, 'idempotent', False):
+            call = self._call_hedged_async
+        limiter = self.limiter
+        if limiter is None:
+            await call(transaction, description.location, body, operation,
+                       merchant, timeout, timer)
+        else:
+            ticket = await limiter.acquire_async(self.max_wait)
+            started = time.monotonic()
+            error = True
+            try:
+                await call(transaction, description.location, body,
+                           operation, merchant, timeout, timer)
+                error = limiter.failed(transaction)
+            except asyncio.CancelledError:
+                limiter.release(ticket, None)
+                ticket = None
+                raise
+            except Exception as exc:
+                error = limiter.overloaded(exc)
+                raise
+            finally:
+                if ticket is not None:
+                    limiter.release(ticket, time.monotonic() - started,
+                                    error)
+
+    async def _call_hedged_async(self, transaction, location, body,
+                                 operation, merchant, timeout, timer):
+        """Como _call_async, mandando un duplicado si la llamada tarda mas
+        de lo que indica self.hedging. La primera respuesta que llega bien
+        reemplaza a transaction.response y el otro intento se cancela."""
+        hedging = self.hedging
+
+        async def attempt():
+            shadow = copy.copy(transaction)
+            shadow.response = type(transaction.response)()
+            started = time.monotonic()
+            await self._call_async(shadow, location, body, operation,
+                                   merchant, timeout, None)
+            hedging.record(time.monotonic() - started)
+            return shadow
+
+        attempts = [asyncio.ensure_future(attempt())]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=hedging.delay())
+            if not done:
+                hedging.hedged()
+                if timer is not None:
+                    timer.count('hedged')
+                attempts.append(asyncio.ensure_future(attempt()))
+            pending = set(attempts)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is not None:
+                        continue
+                    if task is not attempts[0]:
+                        hedging.won()
+                    transaction.response = task.result().response
+                    if timer is not None:
+                        timer.mark('network')
+                    return transaction
+            raise error
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    async def _call_async(self, transaction, location, body, operation,
+                          merchant, timeout, timer):
+        parser = envelope.ResponseParser(transaction.response,
+                                         self.transaction_data)
+        # primero se espera lugar entre las llamadas del merchant, asi las
+        # que estan encoladas no ocupan lugares del total.
+        merchant_semaphore = self._semaphore_for(merchant)
+        if merchant_semaphore is not None:
+            await merchant_semaphore.acquire()
+        try:
+            async with self._semaphore:
+                if timer is not None:
+                    timer.mark('queue')
+                status, data = await asyncio.wait_for(
+                    self.connections.post(
+                        location, body, envelope.headers(operation), parser,
+                        getattr(transaction, 'idempotent', False)),
+                    timeout)
+        finally:
+            if merchant_semaphore is not None:
+                merchant_semaphore.release()
+        if timer is not None:
+            timer.mark('network')
+        if status != 200:
+            if b'Fault' not in data:
+                raise HTTPError(status, data)
+            parser.feed(data)
+        parser.close()
+        if timer is not None:
+            timer.mark('mapping')
+
+    def close(self):
+        self.connections.close()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 *-*
+
+"""Circuit breaker: mientras NPS no responde, las llamadas fallan en el
+momento en lugar de esperar cada una su timeout."""
+
+import threading
+import time
+
+
+class CircuitOpen(Exception):
+    """NPS fallo seguido y no se le estan enviando llamadas."""
+
+
+class CircuitBreaker(object):
+    """Circuit breaker thread-safe.
+
+    Cerrado, deja pasar todas las llamadas. Despues de
+    `failure_threshold` fallas seguidas se abre: las llamadas fallan con
+    CircuitOpen durante `reset_timeout` segundos. Pasado ese tiempo deja
+    pasar una sola llamada de prueba (medio abierto); si anda se cierra y
+    si falla se vuelve a abrir.
+
+    Solo cuentan como fallas las excepciones de `failures` (por defecto
+    errores de red y HTTP, como en reconcile.retry); un SOAP Fault o un
+    error de validacion no dicen nada de la salud de NPS.
+
+    Parametros del constructor:
+        failure_threshold(int) = Fallas seguidas que abren el circuito.
+        reset_timeout(float) = Segundos que el circuito queda abierto.
+        failures = Tupla de las excepciones que cuentan como falla.
+        clock(callable) = Reloj en segundos.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, failures=None,
+                 clock=time.monotonic):
+        if failures is None:
+            from nps.reconcile import TRANSIENT_ERRORS as failures
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = failures
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened = None
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Levanta CircuitOpen si la llamada no debe hacerse."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and \
+                    self.clock() - self.opened >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpen('NPS is failing, retry in %.1fs' % max(
+                0, self.opened + self.reset_timeout - self.clock()))
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive = 0
+            self._probing = False
+
+    def failure(self, exc):
+        """Registra el resultado de una llamada que levanto `exc`."""
+        with self._lock:
+            self._probing = False
+            if not isinstance(exc, self.failures):
+                # no dice nada de NPS: si era la llamada de prueba, se
+                # deja pasar otra
+                return
+            self.consecutive += 1
+            if self.state == self.HALF_OPEN or \
+                    self.consecutive >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened = self.clock()
+
+    def stats(self):
+        with self._lock:
+            return dict(state=self.state, consecutive=self.consecutive,
+                        rejected=self.rejected)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 *-*
+
+"""Carga masiva de requests a partir de columnas (CSV o lotes estilo
+Arrow).
+
+Las filas se leen de a `batch_size`, se pasan a columnas y cada columna
+se valida entera con el validate_many de su field: los chequeos de
+longitud, caracteres e in_ se hacen una vez por columna y no una vez por
+valor. Las filas con errores se saltean y quedan en un ErrorTable; con el
+resto se arman los requests a medida que se piden, de modo que un archivo
+de millones de filas se procesa con memoria constante:
+
+    loader = BulkLoader(PayOnlineTransactionThreeStepsRequest,
+                        columns={'email': 'psp_CustomerMail'})
+    with open('orders.csv', newline='') as fh:
+        for row, request in loader.load(csv.reader(fh)):
+            ...
+    for row, field, message in loader.errors:
+        ...
+"""
+
+import array
+import itertools
+
+
+class ErrorTable(object):
+    """Errores de una carga, guardados como columnas: la fila, el campo
+    y el mensaje (los campos y mensajes repetidos se guardan una vez).
+
+    Al iterarlo se obtienen tuplas (fila, campo, mensaje) en el orden en
+    que se encontraron.
+    """
+
+    def __init__(self):
+        self.rows = array.array('q')
+        self._field_ids = array.array('l')
+        self._message_ids = array.array('l')
+        self._fields = []
+        self._messages = []
+        self._ids = (dict(), dict())
+
+    @staticmethod
+    def _intern(value, table, ids):
+        position = ids.get(value)
+        if position is None:
+            position = ids[value] = len(table)
+            table.append(value)
+        return position
+
+    def add(self, row, field, message):
+        self.rows.append(row)
+        self._field_ids.append(
+            self._intern(field, self._fields, self._ids[0]))
+        self._message_ids.append(
+            self._intern(message, self._messages, self._ids[1]))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        fields, messages = self._fields, self._messages
+        for row, field, message in zip(self.rows, self._field_ids,
+                                       self._message_ids):
+            yield row, fields[field], messages[message]
+
+    def by_row(self):
+        """dict fila -> lista de (campo, mensaje)."""
+        result = dict()
+        for row, field, message in self:
+            result.setdefault(row, []).append((field, message))
+        return result
+
+    def counts(self):
+        """dict campo -> cantidad de errores."""
+        result = dict()
+        for field in self._field_ids:
+            name = self._fields[field]
+            result[name] = result.get(name, 0) + 1
+        return result
+
+
+class BulkLoader(object):
+    """Arma requests validando columnas enteras.
+
+    Parametros del constructor:
+        request_class(class) = Clase del request, por ejemplo
+                               PayOnlineTransactionThreeStepsRequest.
+        columns(dict) = Columna -> campo psp_*. Por defecto se usan las
+                        columnas que se llaman como un campo del request.
+        batch_size(int) = Cantidad de filas que se validan juntas.
+
+    Las celdas vacias ('' o None) no se validan y dejan el campo con su
+    valor por defecto (psp_Country='ARG', etc). Los importes de los campos
+    Amount se normalizan como en Amount.clean ('150.32' -> '15032').
+    """
+
+    def __init__(self, request_class, columns=None, batch_size=10000):
+        schema = request_class.schema
+        if columns is not None:
+            unknown = set(columns.values()) - schema.name_set
+            if unknown:
+                raise ValueError('Unknown fields %s' % ', '.join(
+                    sorted(unknown)))
+        self.request_class = request_class
+        self.columns = columns
+        self.batch_size = batch_size
+        self.errors = ErrorTable()
+        self.loaded = 0
+
+    def _mapping(self, names):
+        """[(posicion de la columna, campo)] para los nombres de columna
+        `names`."""
+        columns = self.columns
+        if columns is None:
+            columns = dict((name, name) for name in names
+                           if name in self.request_class.schema.name_set)
+        mapping = [(position, columns[name])
+                   for position, name in enumerate(names)
+                   if name in columns]
+        missing = set(columns) - set(names)
+        if missing:
+            raise ValueError('Missing columns %s' % ', '.join(
+                sorted(missing)))
+        return mapping
+
+    def load(self, rows, header=None):
+        """Genera pares (fila, request) para las filas validas de `rows`,
+        un iterable de secuencias como el de csv.reader. Si no se pasa
+        `header`, la primera fila tiene los nombres de las columnas. Las
+        filas se numeran desde 0 sin contar el encabezado."""
+        rows = iter(rows)
+        if header is None:
+            header = next(rows, None)
+            if header is None:
+                return
+        mapping = self._mapping(header)
+        width = len(header)
+        start = 0
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return
+            invalid = set()
+            for position, row in enumerate(batch):
+                if len(row) != width:
+                    invalid.add(start + position)
+                    self.errors.add(start + position, None,
+                                    'Expected %s columns, got %s' %
+                                    (width, len(row)))
+                    batch[position] = [''] * width
+            length = len(batch)
+            columns = list(zip(*batch))
+            del batch
+            for item in self._load(dict((field, columns[position])
+                                        for position, field in mapping),
+                                   start, length, invalid):
+                yield item
+            start += length
+
+    def load_columns(self, columns, start=0):
+        """Como load, para un lote ya en columnas: un dict campo psp_* ->
+        secuencia de valores (por ejemplo RecordBatch.to_pydict() de
+        Arrow). `start` es el numero de la primera fila del lote."""
+        length = len(next(iter(columns.values()))) if columns else 0
+        return self._load(columns, start, length, set())
+
+    def _load(self, columns, start, length, invalid):
+        schema = self.request_class.schema
+        names = schema.names
+        descriptors = schema.descriptors
+
+        cleaned = []
+        for field, values in columns.items():
+            descriptor = descriptors[names.index(field)]
+            if '' not in values and None not in values:
+                values, errors = descriptor.validate_many(values)
+            else:
+                present = [i for i, value in enumerate(values)
+                           if value is not None and value != '']
+                result, errors = descriptor.validate_many(
+                    [values[i] for i in present])
+                errors = [(present[i], message) for i, message in errors]
+                values = [None] * length
+                for i, value in zip(present, result):
+                    values[i] = value
+            for position, message in errors:
+                invalid.add(start + position)
+                self.errors.add(start + position, field, message)
+            cleaned.append((descriptor.index, values))
+
+        defaults = list(schema.defaults)
+        request_class = self.request_class
+        for position in range(length):
+            row = start + position
+            if row in invalid:
+                continue
+            values = defaults[:]
+            for index, column in cleaned:
+                value = column[position]
+                if value is not None:
+                    values[index] = value
+            request = request_class()
+            request._values = values
+            self.loaded += 1
+            yield row, request
+
+    def transactions(self, rows, factory, header=None):
+        """Como load, generando pares (fila, transaccion). `factory()`
+        arma una transaccion nueva, por ejemplo
+        lambda: PayOnlineTransactionThreeSteps(url, merchant_id, secret),
+        y su request se reemplaza por el cargado."""
+        for row, request in self.load(rows, header):
+            transaction = factory()
+            transaction.request = request
+            yield row, transaction
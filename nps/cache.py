@@ -0,0 +1,228 @@
+# -*- coding: utf-8 *-*
+
+"""Cache de respuestas de las transacciones idempotentes (SimpleQueryTx).
+
+Una consulta por la misma referencia retorna siempre lo mismo mientras la
+transaccion no cambie de estado; una vez que llega a un estado final, no
+cambia mas. El cache guarda las respuestas en un LRU en memoria y,
+opcionalmente, en una base SQLite compartida por varios procesos.
+"""
+
+import collections
+import json
+import threading
+import time
+
+
+# Campos del request que, junto con la url, identifican una consulta.
+KEY_FIELDS = ('psp_MerchantId', 'psp_QueryCriteria', 'psp_QueryCriteriaId')
+
+# psp_ResponseCod de una consulta exitosa; las demas respuestas (por
+# ejemplo 'Transaccion inexistente') no se guardan.
+QUERY_OK = '2'
+
+
+def plain(value):
+    """Copia de `value` con los objetos de suds (el psp_Transaction que
+    deja el engine 'suds') pasados a dicts, y los valores que no son de
+    JSON pasados a str, para poder guardarla en el store."""
+    if hasattr(value, '__keylist__'):
+        from suds.sudsobject import asdict
+
+        value = asdict(value)
+    if isinstance(value, dict):
+        return dict((str(name), plain(item)) for name, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return str(value)
+
+
+def approved(response):
+    """is_final por defecto: la transaccion consultada fue aprobada
+    (psp_ResponseCod '0' en psp_Transaction). Sin psp_Transaction (el
+    engine 'template' sin transaction_data) no se puede saber."""
+    data = plain(getattr(response, 'user_data', None))
+    return isinstance(data, dict) and data.get('psp_ResponseCod') == '0'
+
+
+class QueryCache(object):
+    """LRU en memoria con vencimiento por entrada.
+
+    Parametros del constructor:
+        max_size(int) = Respuestas que se conservan en memoria.
+        ttl(float) = Segundos que vale la respuesta de una transaccion que
+                     todavia puede cambiar de estado.
+        final_ttl(float) = Segundos que vale la respuesta de una
+                           transaccion en estado final.
+        is_final(callable) = Recibe la response y retorna True si la
+                             transaccion consultada esta en un estado
+                             final. Por defecto, si fue aprobada (ver
+                             approved). None para no tratar ninguna
+                             como final.
+        store = Segundo nivel del cache (ver SQLiteStore). Opcional.
+        clock(callable) = Retorna la hora actual en segundos. Como las
+                          entradas del store se comparten entre procesos,
+                          por defecto es time.time.
+    """
+
+    def __init__(self, max_size=1024, ttl=30, final_ttl=86400,
+                 is_final=approved, store=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.final_ttl = final_ttl
+        self.is_final = is_final
+        self.store = store
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.store_hits = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def key_for(self, transaction):
+        request = transaction.request
+        return (transaction.url,) + tuple(request[name] or ''
+                                          for name in KEY_FIELDS)
+
+    def get(self, key):
+        """Retorna la entrada (expires, values, user_data) de `key`, o
+        None si no esta o ya vencio."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+                self.expirations += 1
+        if self.store is not None:
+            entry = self.store.get(key, now)
+            if entry is not None:
+                with self._lock:
+                    self._insert(key, entry)
+                    self.hits += 1
+                    self.store_hits += 1
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, response):
+        """Guarda `response` con el vencimiento que le corresponde segun
+        su estado. Las respuestas de error no se guardan. Retorna True si
+        se guardo."""
+        if response.psp_ResponseCod != QUERY_OK:
+            return False
+        final = self.is_final is not None and self.is_final(response)
+        user_data = plain(getattr(response, 'user_data', None))
+        if not isinstance(user_data, dict):
+            user_data = None
+        entry = (self.clock() + (self.final_ttl if final else self.ttl),
+                 response.values_tuple(), user_data)
+        with self._lock:
+            self._insert(key, entry)
+        if self.store is not None:
+            self.store.set(key, entry)
+        return True
+
+    def fetch(self, transaction):
+        """Completa la response de `transaction` desde el cache. Retorna
+        True si estaba. El psp_Transaction se entrega en
+        response.user_data como dict, aun con el engine 'suds'."""
+        entry = self.get(self.key_for(transaction))
+        if entry is None:
+            return False
+        response = transaction.response
+        for name, value in zip(response.schema.names, entry[1]):
+            if value is not None:
+                response[name] = value
+        if entry[2] is not None:
+            response.user_data = entry[2]
+        return True
+
+    def update(self, transaction):
+        """Guarda la response de `transaction`."""
+        return self.put(self.key_for(transaction), transaction.response)
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """Contadores del cache."""
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions,
+                        expirations=self.expirations,
+                        store_hits=self.store_hits, size=len(self._entries))
+
+    def clear(self):
+        """Vacia el nivel en memoria; el store no se toca."""
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteStore(object):
+    """Segundo nivel de QueryCache en una base SQLite. Los procesos que
+    usan el mismo `path` comparten las respuestas.
+
+    Parametros del constructor:
+        path(str) = Archivo de la base.
+        timeout(float) = Segundos de espera cuando otro proceso tiene la
+                         base bloqueada.
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS query_cache ('
+                         'key TEXT PRIMARY KEY, expires REAL, value TEXT)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, now):
+        row = self._connection().execute(
+            'SELECT expires, value FROM query_cache WHERE key = ?',
+            (json.dumps(key),)).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        values, user_data = json.loads(row[1])
+        return row[0], tuple(values), user_data
+
+    def set(self, key, entry):
+        expires, values, user_data = entry
+        self._connection().execute(
+            'INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?)',
+            (json.dumps(key), expires, json.dumps([values, user_data])))
+
+    def purge(self, now=None):
+        """Borra las entradas vencidas."""
+        if now is None:
+            now = time.time()
+        self._connection().execute(
+            'DELETE FROM query_cache WHERE expires <= ?', (now,))
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
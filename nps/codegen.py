@@ -0,0 +1,216 @@
+# -*- coding: utf-8 *-*
+
+"""Generador de las clases de transaccion a partir del WSDL de NPS.
+
+Por cada operacion del WSDL se generan la clase del request, la de la
+respuesta y la de la transaccion, como las de nps.transactions. El modulo
+generado es codigo Python comun: el Schema de cada clase (orden del hash,
+defaults, validadores) se arma una sola vez al importarlo, y en cada
+llamada no se recorre el WSDL. Uso desde la linea de comandos:
+
+    nps-generate-transactions https://sandbox.nps.com.ar/ws.php?wsdl \\
+        -o myshop/nps_operations.py
+
+El WSDL declara todos los campos como xsd:string, asi que el tipo de cada
+field sale de su nombre: los campos conocidos usan la misma definicion
+que nps.transactions y el resto se infiere del sufijo (URL, Mail, Amount)
+o queda como Text.
+"""
+
+import argparse
+import keyword
+import os
+import sys
+
+from nps import wsdl
+
+
+# Definiciones de nps.transactions, para request y respuesta. Si cambia
+# un field alla hay que cambiarlo aca: test_codegen compara las clases
+# generadas con las escritas a mano.
+REQUEST_FIELDS = {
+    'psp_Version': "fields.Version()",
+    'psp_MerchantId': "fields.MerchantId(max_length=14)",
+    'psp_TxSource': "fields.Alfa(max_length=13,\n"
+                    "        in_=config.Setting('ALLOWED_TX_SOURCES'), "
+                    "default='WEB')",
+    'psp_MerchTxRef': "fields.Order(max_length=64)",
+    'psp_MerchOrderId': "fields.Order(max_length=64)",
+    'psp_Amount': "fields.Amount(max_length=12)",
+    'psp_NumPayments': "fields.Numeric(max_length=2)",
+    'psp_Currency': "fields.Alfanumeric(length=3)",
+    'psp_Country': "fields.Country(length=3,\n"
+                   "        in_=config.Setting('ALLOWED_COUNTRIES'), "
+                   "default='ARG')",
+    'psp_Product': "fields.Numeric(max_length=3)",
+    'psp_CustomerMail': "fields.Email()",
+    'psp_MerchantMail': "fields.Email()",
+    'psp_ReturnURL': "fields.Url()",
+    'psp_FrmLanguage': "fields.Order(min_length=2, max_length=5)",
+    'psp_FrmBackButtonURL': "fields.Url()",
+    'psp_PurchaseDescription': "fields.Alfa(max_length=15)",
+    'psp_PosDateTime': "fields.DateTime()",
+    'psp_SecureHash': "fields.SecureHash()",
+    'psp_QueryCriteria': "fields.Alfanumeric(length=1)",
+    'psp_QueryCriteriaId': "fields.Order(max_length=64)",
+    'psp_TransactionId': "fields.Numeric(max_length=19)",
+}
+
+RESPONSE_FIELDS = {
+    'psp_ResponseCod': "fields.Numeric(max_length=3)",
+    'psp_ResponseMsg': "fields.Text(max_length=255)",
+    'psp_ResponseExtended': "fields.Text(max_length=255)",
+    'psp_TransactionId': "fields.Numeric(max_length=19)",
+    'psp_Session3p': "fields.Alfanumeric(max_length=64)",
+    'psp_FrontPSP_URL': "fields.Url()",
+    'psp_MerchantId': "fields.MerchantId(max_length=14)",
+    'psp_MerchTxRef': "fields.Order(max_length=64)",
+    'psp_MerchOrderId': "fields.Order(max_length=64)",
+    'psp_CustomerMail': "fields.Email()",
+    'psp_MerchantMail': "fields.Email()",
+    'psp_PosDateTime': "fields.Text(max_length=255)",
+    'psp_QueryCriteria': "fields.Alfanumeric(length=1)",
+    'psp_QueryCriteriaId': "fields.Order(max_length=64)",
+}
+
+# Campos que en una operacion se definen distinto que en REQUEST_FIELDS.
+OPERATION_REQUEST_FIELDS = {
+    'SimpleQueryTx': {
+        'psp_Version': "fields.Order(max_length=12, default='2.2')",
+    },
+}
+
+# Operaciones que no cambian nada en NPS: sus transacciones se generan con
+# idempotent = True, asi el gateway las puede cachear y repetir.
+IDEMPOTENT_OPERATIONS = frozenset(['SimpleQueryTx'])
+
+# (sufijo, field) para los campos que no estan en las tablas.
+SUFFIX_FIELDS = (
+    ('URL', "fields.Url()"),
+    ('Mail', "fields.Email()"),
+    ('Amount', "fields.Amount(max_length=12)"),
+)
+
+DEFAULT_FIELD = "fields.Text(max_length=255)"
+
+HEADER = '''# -*- coding: utf-8 *-*
+
+"""Transacciones de NPS generadas con nps-generate-transactions a partir
+de %(source)s. No editar: volver a generar.
+"""
+
+from nps import config
+from nps import fields
+from nps.transactions import BaseRequestResponse
+from nps.transactions import Transaction
+'''
+
+REQUEST_RESPONSE = '''
+
+class %(name)s(BaseRequestResponse):
+    """%(doc)s"""
+
+%(body)s'''
+
+TRANSACTION = '''
+
+class %(name)s(Transaction):
+    """Transaccion %(method)s."""
+
+    method = %(method)r
+    factory = %(factory)r
+    request_class = %(request)s
+    response_class = %(response)s
+'''
+
+
+def field_for(name, table):
+    """Codigo del field para el campo `name`."""
+    if name in table:
+        return table[name]
+    for suffix, field in SUFFIX_FIELDS:
+        if name.endswith(suffix):
+            return field
+    return DEFAULT_FIELD
+
+
+def class_name(operation):
+    """Nombre de clase valido para una operacion ('PayOnLine_3p')."""
+    name = ''.join(c if c.isalnum() or c == '_' else '_' for c in operation)
+    if not name or name[0].isdigit() or keyword.iskeyword(name):
+        name = 'Op_' + name
+    return name
+
+
+def _fields(names, table, nested):
+    lines = []
+    for name in names:
+        if name in nested:
+            # los tipos complejos (psp_Transaction) quedan en user_data
+            continue
+        lines.append('    %s = %s' % (name, field_for(name, table)))
+    return '\n'.join(lines) + '\n' if lines else '    pass\n'
+
+
+def generate(description, source='el WSDL', operations=None):
+    """Retorna el codigo del modulo con las clases de las operaciones de
+    `description` (un wsdl.ServiceDescription), o solo de `operations`."""
+
+    names = sorted(operations or description.operations)
+    # los artefactos de nps-compile-wsdl anteriores no tienen `nested`
+    nested = getattr(description, 'nested', {})
+    chunks = [HEADER % dict(source=source)]
+    for method in names:
+        operation = description.operations[method]
+        name = class_name(method)
+        request_fields = dict(REQUEST_FIELDS)
+        request_fields.update(OPERATION_REQUEST_FIELDS.get(method, {}))
+        for suffix, type_name, table, doc in (
+                ('Request', operation.input_type, request_fields,
+                 'Campos del request de %s.' % method),
+                ('Response', operation.output_type, RESPONSE_FIELDS,
+                 'Campos de la respuesta de %s.' % method)):
+            chunks.append(REQUEST_RESPONSE % dict(
+                name=name + suffix, doc=doc, body=_fields(
+                    description.types.get(type_name, ()), table,
+                    nested.get(type_name, ()))))
+        chunks.append(TRANSACTION % dict(
+            name=name, method=method, factory=operation.input_type,
+            request=name + 'Request', response=name + 'Response'))
+        if method in IDEMPOTENT_OPERATIONS:
+            chunks.append('    # las consultas no cambian nada en NPS: se '
+                          'pueden cachear\n    # y repetir.\n'
+                          '    idempotent = True\n')
+    return ''.join(chunks)
+
+
+def read(source):
+    """Contenido del WSDL de `source`, una url o un archivo local."""
+    if os.path.exists(source):
+        with open(source, 'rb') as fh:
+            return fh.read()
+    return wsdl.fetch(source)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate NPS transaction classes from the WSDL.')
+    parser.add_argument('wsdl', help='WSDL url or path')
+    parser.add_argument('-o', '--output', help='module path (default: '
+                        'standard output)')
+    parser.add_argument('--operation', action='append',
+                        help='generate only this operation (repeatable)')
+    args = parser.parse_args(argv)
+
+    description = wsdl.parse_wsdl(read(args.wsdl))
+    code = generate(description, args.wsdl, args.operation)
+    if args.output:
+        with open(args.output, 'wt') as fh:
+            fh.write(code)
+    else:
+        sys.stdout.write(code)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
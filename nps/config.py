@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import logging
 import os
-import yaml
+import threading
+
+from nps import settings as defaults
+
+
+logger = logging.getLogger(__name__)
 
 
 class Dict2Object(object):
@@ -22,6 +28,75 @@ class Dict2Object(object):
     def __getattr__(self, name):
         return self._data.get(name, None)
 
+    def items(self):
+        return self._data.items()
+
+
+class Choices(frozenset):
+    """frozenset que recuerda el orden original de los valores, para que
+    los mensajes de error y la iteracion sigan siendo los de la lista de
+    la configuracion."""
+
+    __slots__ = ('_order',)
+
+    def __new__(cls, values):
+        values = tuple(dict.fromkeys(values))
+        choices = super(Choices, cls).__new__(cls, values)
+        choices._order = values
+        return choices
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __getitem__(self, index):
+        return self._order[index]
+
+    def __repr__(self):
+        return repr(self._order)
+
+    def __reduce__(self):
+        return (Choices, (self._order,))
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return Snapshot(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        try:
+            return Choices(value)
+        except TypeError:
+            return tuple(_freeze(item) for item in value)
+    return value
+
+
+class Snapshot(object):
+    """Configuracion inmutable, armada una sola vez.
+
+    Cada valor es un atributo comun de la instancia, asi que leerlo no
+    pasa por ningun __getattr__. Los dicts se convierten en Snapshots y
+    las listas en Choices (frozensets), de modo que los `in` de los
+    validadores no recorren la lista. Como Dict2Object, un valor que no
+    esta en la configuracion es None.
+    """
+
+    def __init__(self, obj):
+        assert isinstance(obj, dict), 'Argument must be a dict instance.'
+        for kw, value in obj.items():
+            object.__setattr__(self, str(kw), _freeze(value))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Settings snapshots are read-only')
+
+    __delattr__ = __setattr__
+
+    def items(self):
+        return vars(self).items()
+
 
 class Config(dict):
     """Configuration helper class.
@@ -38,12 +113,190 @@ class Config(dict):
 
     def load_file(self, filename):
         """Set the configuration from a YAML file."""
+        import yaml
+
         with open(filename, "rt") as fh:
-            cfg = yaml.load(fh.read())
-        self.update(cfg)
+            cfg = yaml.safe_load(fh.read())
+        self.update(cfg or {})
+
+
+def config_path():
+    """Path de pynps.yaml: /etc/pynps para root, ~/.config/pynps para el
+    resto de los usuarios."""
+    confdir = os.path.join('/etc/pynps')
+    if os.getuid():
+        confdir = os.path.expanduser('~/.config/pynps')
+    return os.path.join(confdir, 'pynps.yaml')
+
+
+def load_settings(path=None):
+    """Lee la configuracion y retorna un Snapshot. Lo que no este en
+    pynps.yaml, o todo si el archivo no existe, toma el valor de
+    nps.settings."""
+    cfg = Config()
+    cfg.update((name, getattr(defaults, name)) for name in dir(defaults)
+               if name.isupper())
+    path = path or config_path()
+    if os.path.exists(path):
+        cfg.load_file(path)
+    return Snapshot(cfg)
+
+
+class LazySettings(object):
+    """La configuracion en uso. El archivo se lee recien cuando se pide el
+    primer valor.
+
+    reload() lee el archivo de nuevo y reemplaza el Snapshot entero de una
+    sola vez: quien lee la configuracion ve la anterior o la nueva, nunca
+    una mezcla, y las lecturas no toman ningun lock. check() hace el
+    reload solo si el archivo cambio (por mtime y tamaño) y watch() lo
+    llama periodicamente desde un thread, para que los procesos largos
+    tomen los cambios de merchants o de listas permitidas sin reiniciar.
+    """
+
+    def __init__(self, path=None):
+        self._wrapped = None
+        # cambia con cada Snapshot nuevo (ver Setting)
+        self._generation = 0
+        self._path = path
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.snapshot(), name)
+
+    @property
+    def path(self):
+        return self._path or config_path()
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def snapshot(self):
+        """El Snapshot actual. En codigo que lee muchos valores seguidos
+        conviene tomarlo una vez y leer de el."""
+        wrapped = self._wrapped
+        if wrapped is None:
+            with self._lock:
+                if self._wrapped is None:
+                    self._stamp = self._file_stamp()
+                    self._wrapped = load_settings(self.path)
+                    self._generation += 1
+            wrapped = self._wrapped
+        return wrapped
+
+    def reload(self):
+        """Lee el archivo y reemplaza la configuracion. Si el archivo es
+        invalido la excepcion se propaga y queda la anterior."""
+        with self._lock:
+            stamp = self._file_stamp()
+            snapshot = load_settings(self.path)
+            self._stamp = stamp
+            self._wrapped = snapshot
+            self._generation += 1
+        for listener in list(self._listeners):
+            listener(snapshot)
+        return snapshot
+
+    def check(self):
+        """reload() si el archivo cambio desde la ultima lectura. Retorna
+        True si se recargo."""
+        if self._wrapped is None or self._file_stamp() == self._stamp:
+            return False
+        self.reload()
+        return True
+
+    def subscribe(self, listener):
+        """`listener(snapshot)` se llama despues de cada reload, por
+        ejemplo MerchantRegistry.reload."""
+        self._listeners.append(listener)
+
+    def watch(self, interval=1.0):
+        """Llama a check() cada `interval` segundos en un thread daemon.
+        Los errores al recargar se loguean y se sigue con la
+        configuracion anterior."""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception:
+                    logger.exception('Could not reload %s', self.path)
+
+        self._watcher = threading.Thread(target=run, daemon=True,
+                                         name='nps-settings-watch')
+        self._watcher.start()
+
+    def stop(self):
+        """Detiene el thread de watch()."""
+        watcher = self._watcher
+        if watcher is not None:
+            self._stop.set()
+            watcher.join()
+            self._watcher = None
+
+
+class Setting(object):
+    """Un valor de la configuracion que se resuelve recien cuando se usa.
+    Sirve como `in_` de los fields, para que definir las clases de
+    transacciones no obligue a leer la configuracion. El valor se guarda
+    hasta que un reload cambia el Snapshot.
+
+    Parametros del constructor:
+        name(str) = Nombre del setting.
+        source(LazySettings) = De donde se lee. Por defecto
+                               nps.config.settings.
+    """
+
+    def __init__(self, name, source=None):
+        self.name = name
+        self.source = source
+        self._cached = None
+
+    @property
+    def value(self):
+        source = self.source or settings
+        # la generacion se lee antes que el Snapshot: si un reload pasa en
+        # el medio, el valor queda guardado con la generacion vieja y se
+        # vuelve a leer en el proximo uso.
+        generation = source._generation
+        cached = self._cached
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        if not generation:
+            # primera lectura de la configuracion
+            source.snapshot()
+            generation = source._generation
+        value = getattr(source.snapshot(), self.name)
+        self._cached = (generation, value)
+        return value
+
+    def __contains__(self, item):
+        return item in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __repr__(self):
+        return repr(self.value)
 
 
-confdir = os.path.join('/etc/pynps')
-if os.getuid():
-    confdir = os.path.expanduser('~/.config/pynps')
-settings = Dict2Object(Config(os.path.join(confdir, 'pynps.yaml')))
+settings = LazySettings()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 *-*
+
+"""Armado y lectura de los mensajes SOAP de NPS sin pasar por suds."""
+
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+SOAP_ENC_NS = 'http://schemas.xmlsoap.org/soap/encoding/'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+
+# Tamaño de las lecturas con que se alimenta a ResponseParser.
+CHUNK_SIZE = 64 * 1024
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="' + SOAP_ENV_NS + '"'
+    ' xmlns:xsi="' + XSI_NS + '" xmlns:ns1="%s"%s>'
+    '<SOAP-ENV:Body>%s</SOAP-ENV:Body></SOAP-ENV:Envelope>')
+
+
+class SOAPFault(Exception):
+    """NPS respondio con un SOAP Fault."""
+
+    def __init__(self, faultcode, faultstring):
+        super(SOAPFault, self).__init__('%s: %s' % (faultcode, faultstring))
+        self.faultcode = faultcode
+        self.faultstring = faultstring
+
+
+class HTTPError(IOError):
+    """Respuesta HTTP inesperada."""
+
+    def __init__(self, status, body):
+        super(HTTPError, self).__init__('HTTP %s' % status)
+        self.status = status
+        self.body = body
+
+
+def headers(operation):
+    """Headers HTTP para invocar `operation`."""
+    return {'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': '"%s"' % operation.soap_action}
+
+
+def _escape(value):
+    if '&' in value or '<' in value or '>' in value:
+        return escape(value)
+    return value
+
+
+class EnvelopeTemplate(object):
+    """Envelope precompilado para una operacion y una clase de request.
+
+    Todo el XML fijo (envelope, operacion, tags de apertura y cierre de
+    cada campo) se arma una sola vez. `render` copia la lista de partes,
+    completa los lugares de los valores y hace un unico join y encode.
+
+    Parametros del constructor:
+        operation: wsdl.Operation a invocar.
+        names: Nombres de los campos a serializar, en orden.
+        indexes: Posicion de cada campo de `names` en la secuencia de
+                 valores que recibe `render`. Por defecto, la misma.
+    """
+
+    def __init__(self, operation, names, indexes=None):
+        encoding = ''
+        if operation.use == 'encoded':
+            encoding = ' SOAP-ENV:encodingStyle="%s"' % SOAP_ENC_NS
+        if operation.style == 'rpc':
+            part_type = ''
+            if operation.use == 'encoded':
+                part_type = ' xsi:type="ns1:%s"' % operation.input_type
+            open_ = '<ns1:%s><%s%s>' % (operation.name, operation.input_part,
+                                        part_type)
+            close = '</%s></ns1:%s>' % (operation.input_part, operation.name)
+        else:
+            open_ = '<ns1:%s>' % operation.input_type
+            close = '</ns1:%s>' % operation.input_type
+        head, tail = (ENVELOPE % (operation.namespace, encoding, '\0')).split(
+            '\0')
+
+        if indexes is None:
+            indexes = range(len(names))
+        self.names = tuple(names)
+        self.slots = tuple(('<%s>' % name, '</%s>' % name, index)
+                           for name, index in zip(self.names, indexes))
+        self.parts = [head + open_] + [''] * len(self.names) + \
+            [close + tail]
+
+    def render(self, values):
+        """Envelope (bytes) con los valores no vacios de `values`."""
+        parts = self.parts[:]
+        position = 1
+        for open_, close, index in self.slots:
+            value = values[index]
+            if value:
+                parts[position] = open_ + _escape(str(value)) + close
+            position += 1
+        return ''.join(parts).encode('utf-8')
+
+    def render_request(self, request):
+        return self.render(request.values_tuple())
+
+    @classmethod
+    def for_request(cls, operation, request_class, fields=None):
+        """Template para las instancias de `request_class`. `fields` es el
+        orden de los campos segun el schema del WSDL, si se conoce; los
+        campos que el WSDL no declara no se envian."""
+        names = request_class.schema.names
+        if fields is not None:
+            declared = request_class.schema.name_set
+            names = [name for name in fields if name in declared]
+        return cls(operation, names,
+                   [request_class.schema.names.index(name)
+                    for name in names])
+
+
+def build_envelope(operation, items, fields=None):
+    """Retorna el envelope (bytes) para llamar a `operation` con los
+    valores no vacios de `items`. `fields` es el orden de los campos
+    segun el schema; por defecto se usa el de `items`."""
+
+    if fields is None:
+        fields = list(items)
+    return EnvelopeTemplate(operation, fields).render(
+        [items.get(name) for name in fields])
+
+
+class ResponseParser(object):
+    """Lectura incremental de la respuesta de NPS.
+
+    Recibe el envelope de a partes con `feed` (por ejemplo, a medida que
+    llega por la conexion) y completa `response` con los campos psp_* que
+    declara su clase. No se arma ningun arbol: el texto solo se junta
+    para los elementos que interesan y el contenido de psp_Transaction se
+    saltea sin pasar por Python, salvo que se pida.
+
+    Parametros del constructor:
+        response: Instancia de la respuesta a completar.
+        transaction_data(bool) = Si es True, los hijos directos de
+                                 psp_Transaction se guardan como dict en
+                                 `response.user_data`.
+    """
+
+    def __init__(self, response, transaction_data=False):
+        self.response = response
+        self.transaction_data = transaction_data
+        self.received = 0
+        self._names = response.schema.name_set
+        self._path = []
+        self._text = ''
+        self._body = False
+        self._transaction = None
+        self._fault = None
+        self._skipping = None
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parse_all()
+
+    def _parse_all(self):
+        parser = self._parser
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._data
+
+    def _skip_until(self, tag):
+        # expat no llama a Python por los tags de apertura ni el texto
+        # hasta que se cierra `tag`.
+        parser = self._parser
+        parser.StartElementHandler = None
+        parser.CharacterDataHandler = None
+        parser.EndElementHandler = self._skip_end
+        self._skipping = tag
+
+    def feed(self, data):
+        self.received += len(data)
+        self._parser.Parse(data, False)
+
+    def close(self):
+        """Termina la lectura y retorna `response`. Levanta SOAPFault si
+        NPS respondio con un Fault."""
+        self._parser.Parse(b'', True)
+        if self._fault is not None:
+            raise SOAPFault(self._fault.get('faultcode'),
+                            self._fault.get('faultstring'))
+        if not self._body:
+            raise ValueError('Response is not a SOAP envelope')
+        return self.response
+
+    def _start(self, tag, attrs):
+        # los tags llegan con el prefijo tal cual ("SOAP-ENV:Body")
+        name = tag[tag.find(':') + 1:]
+        self._text = ''
+        if name == 'Body' and len(self._path) == 1:
+            self._body = True
+        elif name == 'Fault':
+            self._fault = dict()
+        elif name == 'psp_Transaction':
+            if not self.transaction_data:
+                self._skip_until(tag)
+                return
+            self._transaction = dict()
+        self._path.append(name)
+
+    def _data(self, data):
+        self._text += data
+
+    def _end(self, tag):
+        name = self._path.pop()
+        text = self._text or None
+        self._text = ''
+        if self._transaction is not None:
+            if name == 'psp_Transaction':
+                self.response.user_data = self._transaction
+                self._transaction = None
+            elif self._path[-1] == 'psp_Transaction':
+                self._transaction[name] = text
+        elif self._fault is not None and self._path[-1:] == ['Fault']:
+            self._fault[name] = text
+        elif text is not None and name in self._names:
+            self.response[name] = text
+
+    def _skip_end(self, tag):
+        if tag == self._skipping:
+            self._skipping = None
+            self._text = ''
+            self._parse_all()
+
+
+def parse_response(data, response, transaction_data=False):
+    """Completa `response` con los campos psp_* que declara, a partir del
+    envelope de respuesta `data`. Con `transaction_data`, psp_Transaction
+    se guarda como dict en `response.user_data`."""
+
+    parser = ResponseParser(response, transaction_data)
+    parser.feed(data)
+    return parser.close()
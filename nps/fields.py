@@ -1,13 +1,12 @@
 # -*- coding: utf-8 *-*
 
+import hashlib
 import re
 import string
 
 from datetime import date
 from datetime import datetime
 
-from weakref import WeakKeyDictionary
-
 
 VALIDATE_EMAIL = re.compile(  # thanks django
     r"(^[-!#$%&'*+/=?^_`{}|~0-9A-Z]+(\.[-!#$%&'*+/=?^_`{}|~0-9A-Z]+)*"
@@ -19,7 +18,76 @@ VALIDATE_URL = re.compile(r"""\b((?:[a-z][\w-]+:(?:/{1,3}|[a-z0-9%])|www\d{0,3}[
 
 VALIDATE_VERSION = re.compile(r'[0-9]\.[0-9]')
 
-class Text(object):
+HEXDIGITS = frozenset(string.hexdigits)
+ALNUM = frozenset(string.ascii_letters + string.digits)
+
+
+def _collect(values, errors):
+    """Arma el resultado de validate_many: los valores invalidos se
+    reemplazan por None y los errores quedan como (posicion, mensaje)."""
+    for position in errors:
+        values[position] = None
+    return values, sorted(errors.items())
+
+
+def _all_str(values):
+    return set(map(type, values)) <= set([str])
+
+
+class Field(object):
+    """ Base de todos los fields.
+
+        El valor de cada instancia se guarda en la posicion `index` de la
+        lista `_values` de la instancia; `index` lo asigna la clase que
+        declara el field (ver transactions.SchemaMeta). Asi los fields no
+        guardan estado propio y las instancias pueden usarse desde varios
+        threads a la vez.
+
+        `clean(value)` valida y normaliza un valor sin guardarlo, y
+        `validate_many(values)` hace lo mismo con una columna entera.
+    """
+
+    index = None
+    default = None
+
+    # True si el valor se calcula al leerlo (ver Date y DateTime).
+    computed = False
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance._values[self.index]
+
+    def __set__(self, instance, value):
+        instance._values[self.index] = self.clean(value)
+
+    def clean(self, value):
+        return value
+
+    def initial(self):
+        """Valor inicial del field, ya validado."""
+        if self.default:
+            return self.clean(self.default)
+        return self.default
+
+    def validate_many(self, values):
+        """ Valida una secuencia de valores.
+
+            Retorna (valores, errores): los valores normalizados, con None
+            en lugar de los invalidos, y una lista de (posicion, mensaje).
+        """
+        values = list(values)
+        errors = dict()
+        clean = self.clean
+        for position, value in enumerate(values):
+            try:
+                values[position] = clean(value)
+            except (ValueError, TypeError, AttributeError) as exc:
+                errors[position] = str(exc)
+        return _collect(values, errors)
+
+
+class Text(Field):
     """ Tipo de datos base para los fields de tipo Text
 
         Parametros opcionales al crear una instancia:
@@ -43,8 +111,6 @@ class Text(object):
                  null=False, in_=None, default=None,
                  accept_invalid_values=False):
 
-        self.data = WeakKeyDictionary()
-
         self.in_ = in_
         self.null = null
         self.length = length
@@ -53,14 +119,8 @@ class Text(object):
         self.max_length = max_length
         self.accept_invalid_values = accept_invalid_values
 
-        if default:
-            self.value = self._validate(default)
-
-    def __get__(self, instance, owner):
-        return self.data.get(instance)
-
-    def __set__(self, instance, value):
-        self.data[instance] = self._validate(value)
+    def clean(self, value):
+        return self._validate(value)
 
     def _validate(self, value):
         """ Validacion para los tipos Text
@@ -93,135 +153,188 @@ class Text(object):
 
         return value
 
+    def validate_many(self, values):
+        values = list(values)
+        if not _all_str(values):
+            return super(Text, self).validate_many(values)
+        values = self._normalize_many(values)
+        errors = self._validate_many(values)
+        errors.update(self._check_many(values))
+        return _collect(values, errors)
+
+    def _normalize_many(self, values):
+        return values
+
+    def _check_many(self, values):
+        """Errores propios del tipo, que tienen precedencia sobre los de
+        _validate_many (como en clean)."""
+        return dict()
+
+    def _validate_many(self, values):
+        """ _validate para una columna de strings. Igual que en _validate,
+        si un valor tiene varios errores se reporta el ultimo.
+        """
+
+        errors = dict()
+        if self.accept_invalid_values or not values:
+            return errors
+        lengths = list(map(len, values))
+        shortest, longest = min(lengths), max(lengths)
+
+        # Cada chequeo recorre la columna solo si el minimo o el maximo
+        # indican que algun valor falla.
+        if not self.null and shortest == 0:
+            msg = 'Argument cant be \'\''
+            errors.update((i, msg) for i, n in enumerate(lengths) if n == 0)
+        if self.length and not shortest == longest == self.length:
+            msg = 'Argument must have exactly length %s' % self.length
+            errors.update((i, msg) for i, n in enumerate(lengths)
+                          if n != self.length)
+        if self.max_length and longest > self.max_length:
+            msg = 'Value cant be bigger than %s' % self.max_length
+            errors.update((i, msg) for i, n in enumerate(lengths)
+                          if n > self.max_length)
+        if self.min_length and shortest < self.min_length:
+            msg = 'Value cant be small than %s' % self.min_length
+            errors.update((i, msg) for i, n in enumerate(lengths)
+                          if n < self.min_length)
+        if self.in_:
+            allowed = frozenset(self.in_)
+            if not allowed.issuperset(values):
+                msg = 'Value must be one of %s' % repr(self.in_)
+                errors.update((i, msg) for i, value in enumerate(values)
+                              if value not in allowed)
+        return errors
 
-class Email(object):
 
-    _value = None
+class Email(Field):
 
     def __init__(self, validate=False):
         self.validate = validate
 
-    def __get__(self, instance, owner):
-        return self._value
-
-    def __set__(self, name, value):
+    def clean(self, value):
         if self.validate:
             if not bool(VALIDATE_EMAIL.match(value)):
                 raise ValueError()
-        self._value = value
-
+        return value
 
-class Version(object):
 
-    _value = None
+class Version(Field):
 
     def __init__(self, validate=False):
         self.validate = validate
 
-    def __get__(self, instance, owner):
-        return self._value
-
-    def __set__(self, name, value):
+    def clean(self, value):
         if self.validate and value is not None:
             if not bool(VALIDATE_VERSION.match(str(value))):
                 raise ValueError('Invalid version')
-        self._value = value
-
+        return value
 
-class Url(object):
 
-    _value = None
+class Url(Field):
 
     def __init__(self, validate=True, max_length=255):
         self.validate = validate
         self.max_length = max_length
 
-    def __get__(self, instance, owner):
-        return self._value
-
-    def __set__(self, name, value):
+    def clean(self, value):
         if self.validate and value is not None:
             if not bool(VALIDATE_URL.match(value)):
                 raise ValueError('Invalid URL Format')
         if len(value) > self.max_length:
             msg = 'Url cant be longer than %s chars' % self.max_length
             raise ValueError(msg)
-        self._value = value
-
+        return value
 
-class Date(object):
 
-    _value = None
+class Date(Field):
 
     def __init__(self, today=False):
         self.today = today
+        self.computed = today
 
     def __get__(self, instance, owner):
+        if instance is None:
+            return self
         if self.today:
-            self.__set__('_value', date.today())
-        return self._value
+            self.__set__(instance, date.today())
+        return instance._values[self.index]
 
-    def __set__(self, name, value):
+    def clean(self, value):
         if isinstance(value, str):
             value = datetime.strptime(value, '%Y-%m-%d').date()
         if not isinstance(value, date):
             msg = 'Argument must be a datetime date instance'
             raise ValueError(msg)
-        self._value = value.strftime('%Y-%m-%d')
-
+        return value.strftime('%Y-%m-%d')
 
-class DateTime(object):
 
-    _value = None
+class DateTime(Field):
 
     def __init__(self, now=False):
         self.now = now
+        self.computed = now
 
     def __get__(self, instance, owner):
+        if instance is None:
+            return self
         if self.now:
-            self.__set__('_value', datetime.now())
-        return self._value
+            self.__set__(instance, datetime.now())
+        return instance._values[self.index]
 
-    def __set__(self, name, value):
+    def clean(self, value):
         if isinstance(value, str):
             value = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
         if not  isinstance(value, datetime):
             msg = 'Argument must be a datetime instance'
             raise ValueError(msg)
-        self._value = value.strftime('%Y-%m-%d %H:%M:%S')
+        return value.strftime('%Y-%m-%d %H:%M:%S')
 
 
 class Time(DateTime):
 
-    def __set__(self, name, value):
+    def clean(self, value):
         if isinstance(value, str):
             value = datetime.strptime(value, '%H:%M:%S')
         if not isinstance(value, datetime):
             msg = 'Argument must be a datetime instance'
             raise ValueError(msg)
-        self._value = value.strftime('%H:%M:%S')
+        return value.strftime('%H:%M:%S')
 
 
-class MD5(object):
+class MD5(Field):
 
-    _value = None
     MD5_LENGTH = 32
 
-    def __get__(self, instance, owner):
-        return self._value
-
-    def __set__(self, name, value):
+    def clean(self, value):
         if not self.is_md5(value):
             msg = 'Argument must be a valid md5 hash'
             raise ValueError(msg)
-        self._value = value
+        return value
 
     def is_md5(self, value):
-        if not all(c in string.hexdigits for c in value):
-            return False
-        if len(value) != self.MD5_LENGTH:
-            return False
-        return True
+        return len(value) == self.MD5_LENGTH and HEXDIGITS.issuperset(value)
+
+
+class SecureHash(Field):
+    """ Digest hexadecimal del psp_SecureHash. Acepta el largo de
+    cualquier backend de nps.hashing (md5, sha1, sha256, sha512, etc), de
+    modo que cambiar el backend del gateway no obliga a cambiar los
+    requests.
+    """
+
+    LENGTHS = frozenset(hashlib.new(name).digest_size * 2
+                        for name in hashlib.algorithms_guaranteed
+                        if not name.startswith('shake'))
+
+    def clean(self, value):
+        if not self.is_digest(value):
+            msg = 'Argument must be a valid hex digest'
+            raise ValueError(msg)
+        return value
+
+    def is_digest(self, value):
+        return len(value) in self.LENGTHS and HEXDIGITS.issuperset(value)
 
 
 class Numeric(Text):
@@ -229,38 +342,93 @@ class Numeric(Text):
     numerico debe ser pasado como string, por ej: '032' o '12'
     """
 
-    def __set__(self, name, value):
+    exc_ = 'Argument must be numbers but passed as strings, like "132"'
+
+    def clean(self, value):
         if not value.isdigit():
-            msg = 'Argument must be numbers but passed as strings, like "132"'
-            raise ValueError(msg)
-        super(Numeric, self).__set__(name, value)
+            raise ValueError(self.exc_)
+        return self._validate(value)
+
+    def _check_many(self, values):
+        if all(values) and ''.join(values).isdigit():
+            return dict()
+        return dict((i, self.exc_) for i, value in enumerate(values)
+                    if not value.isdigit())
 
 
-class Amount(Text):
+class Amount(Numeric):
     """Representa un importe expresado en la menor denominación de la
     moneda. En Argentina, esto son centavos. Ej: $150.32 son 15032 ctvs."""
 
-    def __set__(self, name, value):
+    def clean(self, value):
         value = value.replace(',', '').replace('.', '')
-        if not value.isdigit():
-            msg = 'Argument must be numbers but passed as strings, like "132"'
-            raise ValueError(msg)
-        super(Amount, self).__set__(name, value)
+        return super(Amount, self).clean(value)
+
+    def _normalize_many(self, values):
+        return [value.replace(',', '').replace('.', '') for value in values]
 
 
 class Alfa(Text):
     """ Solo caracteres alfabéticos, en el rango de la 'A' a la 'Z' y de la
     'a' a la 'z'.
+
+    Cada subclase declara los caracteres validos en `chars`; si solo
+    declara la expresion regular `set_`, esta se compila una vez al
+    definir la clase y se usa en su lugar.
     """
 
     set_ = '^[a-zA-Z]+$'
     exc_ = 'Only values with ASCII letters accepted'
+    chars = frozenset(string.ascii_letters)
+
+    def __init_subclass__(cls, **kwargs):
+        super(Alfa, cls).__init_subclass__(**kwargs)
+        if 'set_' in vars(cls) and 'chars' not in vars(cls):
+            cls.chars = None
+        cls._compile()
+
+    @classmethod
+    def _compile(cls):
+        """Prepara los validadores de la clase, una sola vez."""
+        cls.pattern = re.compile(cls.set_)
+        cls._fast = cls.chars is not None and \
+            cls.chars.issuperset(string.ascii_letters)
+        if cls._fast:
+            cls._digits = cls.chars.issuperset(string.digits)
+            cls._extra = ''.join(sorted(cls.chars - ALNUM))
+
+    def is_valid(self, value):
+        if self.chars is None:
+            return bool(self.pattern.match(value))
+        return bool(value) and self.chars.issuperset(value)
+
+    def _all_valid(self, text):
+        """True si todos los caracteres de `text` son validos, usando solo
+        metodos de str. Un False no es concluyente."""
+        for char in self._extra:
+            text = text.replace(char, '')
+        if not text.isascii():
+            return False
+        return text.isalnum() if self._digits else text.isalpha()
 
-    def __set__(self, name, value):
-        expr = re.compile(self.set_)
-        if not bool(expr.match(value)):
+    def clean(self, value):
+        if not self.is_valid(value):
             raise ValueError(self.exc_)
-        super(Alfa, self).__set__(name, value)
+        return self._validate(value)
+
+    def _check_many(self, values):
+        if self.chars is None:
+            match = self.pattern.match
+            return dict((i, self.exc_) for i, value in enumerate(values)
+                        if not match(value))
+        if all(values) and self._fast and self._all_valid(''.join(values)):
+            return dict()
+        issuperset = self.chars.issuperset
+        return dict((i, self.exc_) for i, value in enumerate(values)
+                    if not value or not issuperset(value))
+
+Alfa._compile()
+
 
 class Alfanumeric(Alfa):
     """ Alfa + Numeric. Cualquier caracter que sea un número del 0 al 9, una
@@ -269,6 +437,7 @@ class Alfanumeric(Alfa):
 
     set_ = '^[a-zA-Z0-9]+$'
     exc_ = 'Only Alfa and Numeric chars are allowed'
+    chars = frozenset(string.ascii_letters + string.digits)
 
 
 class Order(Alfa):
@@ -277,6 +446,7 @@ class Order(Alfa):
 
     set_ = '^[a-zA-Z0-9 \_\-\.]+$'
     exc_ = 'Only Alfa, Numeric, "_", "-" and "." chars are allowed'
+    chars = frozenset(string.ascii_letters + string.digits + ' _-.')
 
 
 class MerchantId(Alfa):
@@ -285,6 +455,7 @@ class MerchantId(Alfa):
 
     set_ = '^[a-zA-Z0-9 \_]+$'
     exc_ = 'Only Alfa, Numeric, and "_" chars are allowed'
+    chars = frozenset(string.ascii_letters + string.digits + ' _')
 
 
 class Country(Text):
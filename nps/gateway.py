@@ -1,11 +1,268 @@
 # -*- coding: utf-8 *-*
 
-import hashlib
-from suds.client import Client
+import copy
+import logging
+import threading
+import time
+
+from nps import hashing
+from nps.pool import ClientPool
+
+logger = logging.getLogger(__name__)
+
+
+def _when_done(futures, callback):
+    """Llama a callback() cuando terminaron todos los `futures`."""
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(done)
 
 
 class NPSGateway(object):
 
+    def __init__(self, pool=None, artifacts=(), hash_backend=None,
+                 engine='suds', timeout=60, transaction_data=False,
+                 cache=None, instrumentation=None, merchants=None,
+                 rate_limiter=None, limiter=None, max_wait=None,
+                 breaker=None, hedging=None):
+        """ Parametros del constructor:
+                pool: ClientPool a utilizar. Por defecto se crea uno nuevo.
+                artifacts: Paths de WSDL compilados con nps-compile-wsdl.
+                hash_backend: Backend del psp_SecureHash (ver nps.hashing).
+                              Por defecto md5.
+                engine: 'suds' arma y lee los mensajes con suds. 'template'
+                        los arma con envelopes precompilados (ver
+                        nps.envelope) y los envia por HTTP directamente.
+                timeout: Segundos de espera de las conexiones HTTP del
+                         engine 'template'.
+                transaction_data: Con el engine 'template', guardar
+                                  psp_Transaction en response.user_data.
+                                  Por defecto se saltea al leer la
+                                  respuesta.
+                cache: cache.QueryCache para las respuestas de las
+                       transacciones idempotentes (SimpleQueryTx).
+                instrumentation: instrumentation.Instrumentation que recibe
+                                 los tiempos de cada fase de `process`.
+                                 Por defecto no se mide nada.
+                merchants: merchants.MerchantRegistry. Las transacciones
+                           de los merchants registrados toman de ahi la
+                           url y el secret que no traigan, y usan un pool
+                           y un rate limit propios del merchant.
+                rate_limiter: ratelimit.TokenBucket con las llamadas por
+                              segundo a NPS de todo el gateway.
+                limiter: ratelimit.AdaptiveLimiter que ajusta las llamadas
+                         simultaneas a NPS segun la latencia y los errores.
+                max_wait: Segundos que una llamada espera lugar en el
+                          rate_limiter y en el limiter antes de fallar con
+                          ratelimit.RateLimited. None espera lo necesario.
+                breaker: breaker.CircuitBreaker. Mientras esta abierto,
+                         process() falla con breaker.CircuitOpen sin
+                         llamar a NPS.
+                hedging: hedging.Hedging. Las transacciones idempotentes
+                         que tardan mas que el percentil configurado se
+                         envian de nuevo y se usa la primera respuesta.
+        """
+        if engine not in ('suds', 'template'):
+            raise ValueError('Unknown engine %r' % engine)
+        self.engine = engine
+        self.timeout = timeout
+        self.transaction_data = transaction_data
+        self.cache = cache
+        self.instrumentation = instrumentation
+        self.merchants = merchants
+        self.rate_limiter = rate_limiter
+        self.limiter = limiter
+        self.max_wait = max_wait
+        self.breaker = breaker
+        self.hedging = hedging
+        self._hedge_executor = None
+        self._hedge_slots = None
+        self._merchant_pools = dict()
+        self._lock = threading.Lock()
+        self.hash_backend = hash_backend or hashing.MD5()
+        self.artifacts = dict()
+        self.descriptions = dict()
+        self.templates = dict()
+        if pool is None:
+            pool = ClientPool(client_factory=self.create_client)
+        self.pool = pool
+        self.connections = ClientPool(client_factory=self.create_connection)
+        for path in artifacts:
+            self.load_artifact(path)
+
+    def load_artifact(self, path, verify=True):
+        """Registra un WSDL compilado para su url. Si el artefacto no se
+        puede leer, o si `verify` es True y el WSDL publicado ya no tiene
+        el mismo hash, se ignora y los clientes se construyen con el WSDL
+        remoto. La verificacion solo descarga el WSDL, sin parsearlo, y
+        espera a lo sumo self.timeout; si no se puede descargar se usa el
+        artefacto y se deja un warning en el log. Retorna el artefacto
+        registrado o None."""
+        import pickle
+        from nps import wsdl
+
+        try:
+            artifact = wsdl.WSDLArtifact.load(path)
+        except (IOError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        if verify:
+            try:
+                data = wsdl.fetch(artifact.url, self.timeout)
+            except OSError as exc:
+                logger.warning('Could not verify the WSDL artifact %s against '
+                               '%s, using it anyway: %s', path, artifact.url,
+                               exc)
+                data = None
+            if data is not None and not artifact.matches(data):
+                return None
+        self.artifacts[artifact.url] = artifact
+        return artifact
+
+    def create_client(self, url):
+        """Construye el cliente suds para `url`."""
+        from nps import wsdl
+
+        return wsdl.create_client(url, self.artifacts.get(url))
+
+    def create_connection(self, location):
+        """Conexion HTTP keep-alive al endpoint `location`."""
+        import http.client
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(location)
+        if parts.scheme == 'https':
+            return http.client.HTTPSConnection(parts.netloc,
+                                               timeout=self.timeout)
+        return http.client.HTTPConnection(parts.netloc, timeout=self.timeout)
+
+    def describe(self, url):
+        """Retorna el wsdl.ServiceDescription de `url`, tomado del artefacto
+        compilado si lo hay o del WSDL publicado."""
+        description = self.descriptions.get(url)
+        if description is None:
+            from nps import wsdl
+
+            artifact = self.artifacts.get(url)
+            if artifact is not None:
+                description = artifact.description
+            else:
+                description = wsdl.parse_wsdl(wsdl.fetch(url))
+            self.descriptions[url] = description
+        return description
+
+    def template_for(self, transaction, description):
+        """EnvelopeTemplate de la operacion y la clase de request de
+        `transaction`, compilado la primera vez que se usa."""
+        key = (transaction.url, transaction.method,
+               transaction.request.__class__)
+        template = self.templates.get(key)
+        if template is None:
+            from nps.envelope import EnvelopeTemplate
+
+            operation = description.operations[transaction.method]
+            template = EnvelopeTemplate.for_request(
+                operation, transaction.request.__class__,
+                description.types.get(operation.input_type))
+            self.templates[key] = template
+        return template
+
+    def pools_for(self, merchant):
+        """(pool de clientes suds, pool de conexiones HTTP) a usar para
+        `merchant`. Cada merchant registrado tiene los suyos, de
+        `merchant.pool_size` lugares, para que uno con mucho trafico no
+        deje sin conexiones a los demas.
+
+        Si MerchantRegistry.reload cambio la configuracion del merchant
+        (ya no es el mismo objeto), sus pools se descartan y se crean de
+        nuevo con la configuracion nueva."""
+        if merchant is None:
+            return self.pool, self.connections
+        entry = self._merchant_pools.get(merchant.merchant_id)
+        if entry is None or entry[0] is not merchant:
+            with self._lock:
+                entry = self._merchant_pools.get(merchant.merchant_id)
+                if entry is None or entry[0] is not merchant:
+                    if entry is not None:
+                        for pool in entry[1]:
+                            pool.clear()
+                    pools = (ClientPool(merchant.pool_size,
+                                        client_factory=self.create_client),
+                             ClientPool(merchant.pool_size,
+                                        client_factory=self.create_connection))
+                    entry = self._merchant_pools[merchant.merchant_id] = \
+                        (merchant, pools)
+        return entry[1]
+
+    def post(self, location, body, headers, parser=None, connections=None,
+             idempotent=False):
+        """Envia un POST por una conexion del pool `connections` (por
+        defecto, el del gateway); retorna (status, body). Con `parser` (un
+        envelope.ResponseParser), el cuerpo de una respuesta 200 se le
+        entrega de a partes a medida que se lee y el body retornado es
+        None.
+
+        Si el servidor corta la conexion, el POST se repite una sola vez
+        con una conexion nueva cuando es `idempotent` o cuando la conexion
+        venia del pool y se corto antes de terminar de mandar el pedido.
+        Si no, NPS pudo haberlo procesado y el error se propaga."""
+        import http.client
+        import select
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(location)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if connections is None:
+            connections = self.connections
+        with connections.acquire(location) as pooled:
+            conn = pooled.client
+            # una conexion libre no deberia tener nada para leer: si lo
+            # tiene, el servidor la cerro mientras estaba en el pool.
+            if conn.sock is not None and \
+                    select.select([conn.sock], [], [], 0)[0]:
+                conn.close()
+            reused = conn.sock is not None
+            sent = False
+            try:
+                conn.request('POST', path, body, headers)
+                sent = True
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                conn.close()
+                if not (idempotent or (reused and not sent)):
+                    raise
+                conn.request('POST', path, body, headers)
+                response = conn.getresponse()
+            if parser is None or response.status != 200:
+                return response.status, response.read()
+            from nps.envelope import CHUNK_SIZE
+
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    return response.status, None
+                parser.feed(chunk)
+
+    def warmup(self, urls, size=1):
+        """Deja listos `size` clientes por url, con las operaciones
+        conocidas ya resueltas, antes de atender el primer request."""
+        from nps.transactions import PayOnlineTransactionThreeSteps
+        from nps.transactions import SimpleQueryTx
+        operations = [(tx.factory, tx.method) for tx in
+                      (PayOnlineTransactionThreeSteps, SimpleQueryTx)]
+        self.pool.warmup(urls, operations, size)
+
     def create_secure_hash_for(self, transaction):
         """ Permite al NPS controlar la integridad del mensaje enviado
         por el cliente. El campo psp_SecureHash es una firma md5 generada
@@ -17,49 +274,427 @@ class NPSGateway(object):
         alfabéticamente en forma ascendente.
         """
 
-        request = transaction.request
-        keys = sorted(request.items.keys())
-        hash_values = []
-        for kw in keys:
-            if kw == 'psp_SecureHash':
-                continue
-            value = request.items[kw] if request.items[kw] != None else ''
-            hash_values.append(str(value))
-        hash_values.append(transaction.secret)
-        input_ = ''.join([v for v in hash_values if v])
-        m = hashlib.md5()
-        m.update(input_.encode('utf-8'))
-
-        return m.hexdigest()
-
-    def process(self, transaction):
+        return hashing.secure_hash(transaction, self.hash_backend)
+
+    def create_secure_hashes(self, transactions, workers=None):
+        """create_secure_hash_for para un lote de transacciones. Retorna
+        la lista de hashes en el mismo orden. Con `workers` los hashes se
+        calculan en un pool de procesos (ver hashing.secure_hashes)."""
+        return hashing.secure_hashes(transactions, self.hash_backend,
+                                     workers)
+
+    def process(self, transaction, hashed=False):
         """Procesa la transaccion dada contra el WSDL de NPS.
-        Retorna el objeto transaccion pasado.
+        Retorna el objeto transaccion pasado. Con `hashed` se usa el
+        psp_SecureHash que ya tiene el request (ver process_batch).
         """
 
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return self._process(transaction, None, hashed)
+        timer = instrumentation.start(transaction)
+        try:
+            self._process(transaction, timer, hashed)
+        except Exception as exc:
+            instrumentation.finish(transaction, timer, exc)
+            raise
+        instrumentation.finish(transaction, timer)
+        return transaction
+
+    def process_batch(self, transactions, workers=None, concurrency=8,
+                      chunksize=500, max_pending=None):
+        """Procesa un lote de transacciones sin tenerlo entero en memoria.
+
+        `transactions` puede ser un generador que arme las transacciones a
+        medida que se piden. Se leen de a `chunksize`; con `workers` los
+        psp_SecureHash de cada bloque se calculan en un pool de procesos
+        mientras se envia el bloque anterior, y los envios se hacen con a
+        lo sumo `concurrency` llamadas en vuelo por las conexiones del
+        gateway.
+
+        Genera pares (transaccion, respuesta) en orden de finalizacion; si
+        el envio fallo, en lugar de la respuesta se entrega la excepcion.
+        Nunca hay mas de `max_pending` transacciones leidas y sin
+        entregar (por defecto concurrency + 2 bloques por worker): si NPS
+        o quien consume los resultados se atrasa, se deja de leer
+        `transactions` hasta que se liberen lugares.
+        """
+        import collections
+        import concurrent.futures
+        import itertools
+
+        if max_pending is None:
+            max_pending = concurrency + 2 * chunksize * (workers or 1)
+        transactions = iter(transactions)
+        backend = self.hash_backend
+        chunks = collections.deque()    # (future, bloque) en el pool
+        hashed = collections.deque()
+        sending = dict()
+        pending = 0
+        exhausted = False
+
+        hash_executor = None
+        if workers:
+            hash_executor = concurrent.futures.ProcessPoolExecutor(workers)
+        send_executor = concurrent.futures.ThreadPoolExecutor(
+            concurrency, thread_name_prefix='nps-batch')
+        try:
+            while True:
+                while not exhausted and pending < max_pending:
+                    chunk = list(itertools.islice(
+                        transactions, min(chunksize, max_pending - pending)))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    # el hash necesita el secret que route() toma del
+                    # MerchantRegistry
+                    chunk, errors = self._route_chunk(chunk)
+                    for transaction, exc in errors:
+                        yield transaction, exc
+                    if not chunk:
+                        continue
+                    pending += len(chunk)
+                    inputs = [hashing.hash_input(tx) for tx in chunk]
+                    if hash_executor is None:
+                        self._set_hashes(chunk,
+                                         hashing.hash_chunk(inputs, backend))
+                        hashed.extend(chunk)
+                    else:
+                        chunks.append((hash_executor.submit(
+                            hashing.hash_chunk, inputs, backend), chunk))
+
+                # si no hay nada para enviar se espera al proximo bloque
+                while chunks and (chunks[0][0].done() or
+                                  not (hashed or sending)):
+                    future, chunk = chunks.popleft()
+                    self._set_hashes(chunk, future.result())
+                    hashed.extend(chunk)
+                while hashed and len(sending) < concurrency:
+                    transaction = hashed.popleft()
+                    sending[send_executor.submit(
+                        self.process, transaction, True)] = transaction
+
+                if not sending:
+                    if exhausted and not chunks:
+                        return
+                    continue
+                waiting = list(sending)
+                if chunks:
+                    waiting.append(chunks[0][0])
+                done, _ = concurrent.futures.wait(
+                    waiting, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    transaction = sending.pop(future, None)
+                    if transaction is None:
+                        continue
+                    pending -= 1
+                    exc = future.exception()
+                    if exc is not None:
+                        yield transaction, exc
+                    else:
+                        yield transaction, transaction.response
+        finally:
+            for future in sending:
+                future.cancel()
+            send_executor.shutdown(wait=True)
+            if hash_executor is not None:
+                hash_executor.shutdown(wait=True, cancel_futures=True)
+
+    def _route_chunk(self, chunk):
+        """Completa la url y el secret de cada transaccion del bloque con
+        su merchant. Retorna (transacciones ruteadas, [(transaccion,
+        excepcion)] de las que no se pudieron rutear)."""
+        if self.merchants is None:
+            return chunk, []
+        from nps.merchants import UnknownMerchant
+
+        routed = []
+        errors = []
+        for transaction in chunk:
+            try:
+                self.merchants.route(transaction)
+            except UnknownMerchant as exc:
+                errors.append((transaction, exc))
+            else:
+                routed.append(transaction)
+        return routed, errors
+
+    @staticmethod
+    def _set_hashes(chunk, hashes):
+        for transaction, secure_hash in zip(chunk, hashes):
+            transaction.request.psp_SecureHash = secure_hash
+
+    def _process(self, transaction, timer, hashed=False):
+        merchant = None
+        if self.merchants is not None:
+            merchant = self.merchants.route(transaction)
+        cache = None
+        if getattr(transaction, 'idempotent', False):
+            cache = self.cache
+        if cache is not None:
+            hit = cache.fetch(transaction)
+            if timer is not None:
+                timer.mark('cache')
+                timer.count('cache_hit' if hit else 'cache_miss')
+            if hit:
+                return transaction
+
+        breaker = self.breaker
+        if breaker is None:
+            self._send(transaction, timer, merchant, hashed)
+        else:
+            breaker.allow()
+            try:
+                self._send(transaction, timer, merchant, hashed)
+            except Exception as exc:
+                breaker.failure(exc)
+                raise
+            breaker.success()
+        if cache is not None:
+            cache.update(transaction)
+            if timer is not None:
+                timer.mark('cache_store')
+        return transaction  # return the transaction
+
+    def _send(self, transaction, timer, merchant, hashed=False):
+        limited = False
+        if merchant is not None and merchant.limiter is not None:
+            merchant.limiter.acquire(merchant.max_wait)
+            limited = True
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.max_wait)
+            limited = True
+        if limited and timer is not None:
+            timer.mark('ratelimit')
+
+        if not hashed:
+            transaction.request.psp_SecureHash = \
+                self.create_secure_hash_for(transaction)
+            if timer is not None:
+                timer.mark('hash')
+        limiter = self.limiter
+        if limiter is None:
+            self._call(transaction, timer, merchant)
+        else:
+            ticket = limiter.acquire(self.max_wait)
+            if timer is not None:
+                timer.mark('queue')
+            started = time.monotonic()
+            error = True
+            attempts = []
+            try:
+                if self.hedging is not None and \
+                        getattr(transaction, 'idempotent', False):
+                    self._call_hedged(transaction, timer, merchant, attempts)
+                else:
+                    self._call(transaction, timer, merchant)
+                error = limiter.failed(transaction)
+            except Exception as exc:
+                error = limiter.overloaded(exc)
+                raise
+            finally:
+                latency = time.monotonic() - started
+                running = [future for future in attempts
+                           if not future.done()]
+                if running:
+                    # el intento de hedging que perdio sigue ocupando un
+                    # lugar en NPS; el ticket se devuelve cuando termina.
+                    _when_done(running, lambda: limiter.release(
+                        ticket, latency, error))
+                else:
+                    limiter.release(ticket, latency, error)
+
+    def _call(self, transaction, timer, merchant):
+        if self.hedging is not None and \
+                getattr(transaction, 'idempotent', False):
+            return self._call_hedged(transaction, timer, merchant)
+        self._call_engine(transaction, timer, merchant)
+
+    def _call_engine(self, transaction, timer, merchant):
+        if self.engine == 'template':
+            self._process_template(transaction, timer, merchant)
+        else:
+            self._process_suds(transaction, timer, merchant)
+
+    def _call_hedged(self, transaction, timer, merchant, attempts=None):
+        """Llama a NPS y, si tarda mas de lo que indica self.hedging,
+        manda un duplicado. Cada intento usa su propia respuesta y la
+        primera que llega bien reemplaza a transaction.response; el otro
+        intento no se puede cancelar y termina en su thread. Los futures
+        de los intentos se agregan a `attempts`.
+
+        Los intentos corren en un pool de threads que nunca encola: si
+        los threads estan ocupados (por intentos colgados, por ejemplo) la
+        llamada se hace en el thread que llama y sin duplicado."""
+        import concurrent.futures
+
+        hedging = self.hedging
+        if self._hedge_executor is None:
+            with self._lock:
+                if self._hedge_executor is None:
+                    workers = hedging.workers
+                    if self.limiter is not None:
+                        # cada llamada que deja pasar el limiter ocupa a
+                        # lo sumo dos threads.
+                        workers = 2 * int(self.limiter.max_limit)
+                    self._hedge_slots = threading.BoundedSemaphore(workers)
+                    self._hedge_executor = \
+                        concurrent.futures.ThreadPoolExecutor(
+                            workers, thread_name_prefix='nps-hedge')
+
+        def attempt():
+            shadow = copy.copy(transaction)
+            shadow.response = type(transaction.response)()
+            started = time.monotonic()
+            self._call_engine(shadow, None, merchant)
+            hedging.record(time.monotonic() - started)
+            return shadow
+
+        def submit():
+            if not self._hedge_slots.acquire(False):
+                return None
+            future = self._hedge_executor.submit(attempt)
+            future.add_done_callback(lambda f: self._hedge_slots.release())
+            return future
+
+        delay = hedging.delay()
+        primary = None
+        if delay is not None:
+            primary = submit()
+        if primary is None:
+            started = time.monotonic()
+            self._call_engine(transaction, timer, merchant)
+            hedging.record(time.monotonic() - started)
+            return transaction
+        if attempts is None:
+            attempts = []
+        attempts.append(primary)
+        done, _ = concurrent.futures.wait(attempts, delay)
+        if not done:
+            hedge = submit()
+            if hedge is not None:
+                hedging.hedged()
+                if timer is not None:
+                    timer.count('hedged')
+                attempts.append(hedge)
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is not None:
+                    continue
+                if future is not attempts[0]:
+                    hedging.won()
+                transaction.response = future.result().response
+                if timer is not None:
+                    timer.mark('network')
+                return transaction
+        raise error
+
+    def _process_suds(self, transaction, timer=None, merchant=None):
         request = transaction.request
         url = transaction.url
 
         factory = transaction.factory
         method = transaction.method
-        client = Client(url)
 
-        request.psp_SecureHash = self.create_secure_hash_for(transaction)
-        ws_factory = client.factory.create(factory)
-        ws_method = getattr(client.service, method)
+        pool = self.pools_for(merchant)[0]
+        with pool.acquire(url) as client:
+            if timer is not None:
+                timer.mark('wsdl')
+            ws_factory = client.create(factory)
+            ws_method = client.method(method)
 
-        for key, value in request.items.items():
-            if not value:
-                continue
-            ws_factory[key] = value
+            for key, value in zip(request.schema.names,
+                                  request.values_tuple()):
+                if not value:
+                    continue
+                ws_factory[key] = value
+            if timer is not None:
+                timer.mark('factory')
 
-        response = ws_method(ws_factory)  # call the webservice
+            # suds arma el envelope, hace el request y lee la respuesta
+            # en la misma llamada.
+            response = ws_method(ws_factory)  # call the webservice
+            if timer is not None:
+                timer.mark('call')
         if hasattr(response, 'psp_Transaction'):
             transaction.response.user_data = getattr(response,
                                                 'psp_Transaction')
-        for kw in transaction.response.items.keys():
+        for kw in transaction.response.schema.names:
             if response.__contains__(kw):
                 value = getattr(response, kw)
                 transaction.response[kw] = value
+        if timer is not None:
+            timer.mark('mapping')
+        return transaction
 
-        return transaction  # return the transaction
+    def _process_template(self, transaction, timer=None, merchant=None):
+        from nps import envelope
+
+        description = self.describe(transaction.url)
+        operation = description.operations[transaction.method]
+        template = self.template_for(transaction, description)
+        if timer is not None:
+            timer.mark('wsdl')
+        body = template.render_request(transaction.request)
+        if timer is not None:
+            timer.mark('serialize')
+        parser = envelope.ResponseParser(transaction.response,
+                                         self.transaction_data)
+        # la respuesta se va parseando a medida que se lee, asi que
+        # 'network' incluye la lectura de los campos.
+        status, data = self.post(description.location, body,
+                                 envelope.headers(operation), parser,
+                                 self.pools_for(merchant)[1],
+                                 getattr(transaction, 'idempotent', False))
+        if timer is not None:
+            timer.mark('network')
+        if status != 200:
+            if b'Fault' not in data:
+                raise envelope.HTTPError(status, data)
+            parser.feed(data)
+        parser.close()
+        if timer is not None:
+            timer.mark('mapping')
+        return transaction
+
+    def query_many(self, refs, url, merchant_id, secret, concurrency=8,
+                   checkpoint=None, retries=3, backoff=0.5):
+        """Consulta con SimpleQueryTx cada psp_MerchTxRef de `refs`, con a
+        lo sumo `concurrency` consultas en vuelo.
+
+        Genera pares (ref, transaccion) en orden de finalizacion. Los
+        errores transitorios se reintentan con backoff; si una consulta
+        falla igual, en lugar de la transaccion se entrega la excepcion.
+        `checkpoint` es un path o un reconcile.Checkpoint: las refs ya
+        registradas se saltean y cada consulta exitosa se registra, asi
+        una corrida interrumpida retoma donde quedo.
+        """
+        from nps import reconcile
+        from nps.transactions import SimpleQueryTx
+
+        if isinstance(checkpoint, str):
+            checkpoint = reconcile.Checkpoint(checkpoint)
+        if checkpoint is not None:
+            refs = (ref for ref in refs if ref not in checkpoint)
+
+        def query(ref):
+            return reconcile.retry(
+                lambda: self.process(
+                    SimpleQueryTx(url, merchant_id, secret, None, ref)),
+                retries, backoff)
+
+        try:
+            for ref, result in reconcile.run_bounded(query, refs,
+                                                     concurrency):
+                if checkpoint is not None and \
+                        not isinstance(result, Exception):
+                    checkpoint.add(ref)
+                yield ref, result
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 *-*
+
+"""Calculo del psp_SecureHash.
+
+El digest se hace con un backend intercambiable. `MD5` es el que exige
+NPS hoy: md5(campos concatenados + secret). Para migrar a un algoritmo mas
+fuerte alcanza con pasarle otro backend al gateway, por ejemplo
+`HMAC('sha256')`. El field psp_SecureHash de los requests
+(fields.SecureHash) acepta el digest de cualquiera de estos backends.
+"""
+
+import hashlib
+import hmac
+
+
+class MD5(object):
+    """hash(campos + secret) con un algoritmo de hashlib."""
+
+    algorithm = 'md5'
+
+    def start(self, secret):
+        return hashlib.new(self.algorithm)
+
+    def finish(self, digest, secret):
+        if secret:
+            digest.update(secret.encode('utf-8'))
+        return digest.hexdigest()
+
+
+class SHA256(MD5):
+
+    algorithm = 'sha256'
+
+
+class HMAC(object):
+    """HMAC de los campos, usando el secret como clave."""
+
+    def __init__(self, algorithm='sha256'):
+        self.algorithm = algorithm
+
+    def start(self, secret):
+        return hmac.new((secret or '').encode('utf-8'),
+                        digestmod=self.algorithm)
+
+    def finish(self, digest, secret):
+        return digest.hexdigest()
+
+
+def hash_values(values, secret, backend):
+    """Digest de `values` (ya en el orden del hash) y `secret`. Los
+    valores se le pasan al backend de a uno, sin armar el string entero."""
+    digest = backend.start(secret)
+    update = digest.update
+    for value in values:
+        if value is not None:
+            update(str(value).encode('utf-8'))
+    return backend.finish(digest, secret)
+
+
+def hash_chunk(chunk, backend):
+    """Digests de una lista de pares (valores, secret)."""
+    return [hash_values(values, secret, backend) for values, secret in chunk]
+
+
+def hash_input(transaction):
+    """(valores en el orden del hash, secret) de una transaccion."""
+    request = transaction.request
+    values = request.values_tuple()
+    return [values[i] for i in request.schema.hash_indexes], \
+        transaction.secret
+
+
+def secure_hash(transaction, backend):
+    values, secret = hash_input(transaction)
+    return hash_values(values, secret, backend)
+
+
+def secure_hashes(transactions, backend, workers=None, chunksize=2000):
+    """Calcula el secure hash de cada transaccion, en orden.
+
+    Con `workers` los hashes se calculan en un pool de procesos, de a
+    `chunksize` transacciones. Solo conviene para lotes grandes: cada
+    hash cuesta pocos microsegundos y enviar los datos a otro proceso
+    cuesta mas que eso.
+    """
+    inputs = [hash_input(transaction) for transaction in transactions]
+    if not workers or len(inputs) <= chunksize:
+        return hash_chunk(inputs, backend)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = [inputs[i:i + chunksize]
+              for i in range(0, len(inputs), chunksize)]
+    hashes = []
+    with ProcessPoolExecutor(workers) as executor:
+        for result in executor.map(hash_chunk, chunks,
+                                   [backend] * len(chunks)):
+            hashes.extend(result)
+    return hashes
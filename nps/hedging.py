@@ -0,0 +1,88 @@
+# -*- coding: utf-8 *-*
+
+"""Hedged requests: si una consulta tarda mas que casi todas las
+recientes, se envia un duplicado y se usa la primera respuesta.
+
+Solo se hace con transacciones idempotentes (transaction.idempotent,
+como SimpleQueryTx): repetir un PayOnLine_3p crearia dos pagos.
+"""
+
+import collections
+import threading
+
+from nps.instrumentation import percentile
+
+
+class Hedging(object):
+    """Cuando mandar el duplicado de una llamada.
+
+    El duplicado sale si la llamada no respondio despues del percentil
+    `percentile` de las latencias recientes. Para no sumarle carga a NPS
+    justo cuando esta lento, los duplicados no pasan de `budget` del total
+    de llamadas.
+
+    Parametros del constructor:
+        percentile(float) = Percentil de las latencias recientes, 0.95 es
+                            el p95.
+        window(int) = Cantidad de latencias recientes que se usan.
+        min_samples(int) = Latencias necesarias antes de empezar a mandar
+                           duplicados.
+        min_delay(float) = Segundos minimos antes del duplicado.
+        budget(float) = Fraccion maxima de llamadas duplicadas.
+        workers(int) = Threads para las llamadas de NPSGateway (el
+                       gateway asincronico no los usa). Si el gateway
+                       tiene un AdaptiveLimiter se usan dos por cada
+                       llamada que deja pasar.
+    """
+
+    def __init__(self, percentile=0.95, window=1000, min_samples=20,
+                 min_delay=0.01, budget=0.1, workers=16):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = budget
+        self.workers = workers
+        self.calls = 0
+        self.hedges = 0
+        self.wins = 0
+        self._latencies = collections.deque(maxlen=window)
+        self._delay = None
+        self._stale = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Agrega la latencia de una llamada (original o duplicado)."""
+        with self._lock:
+            self._latencies.append(seconds)
+            self._stale += 1
+
+    def delay(self):
+        """Segundos a esperar antes del duplicado, o None si no hay que
+        mandarlo."""
+        with self._lock:
+            self.calls += 1
+            if len(self._latencies) < self.min_samples or \
+                    self.hedges >= self.budget * self.calls:
+                return None
+            # ordenar la ventana en cada llamada es caro; el percentil se
+            # recalcula cada 5% de la ventana
+            if self._delay is None or \
+                    self._stale * 20 >= self._latencies.maxlen:
+                self._delay = max(self.min_delay, percentile(
+                    sorted(self._latencies), self.percentile))
+                self._stale = 0
+            return self._delay
+
+    def hedged(self):
+        with self._lock:
+            self.hedges += 1
+
+    def won(self):
+        """El duplicado respondio antes que la llamada original."""
+        with self._lock:
+            self.wins += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(calls=self.calls, hedges=self.hedges, wins=self.wins,
+                        delay=self._delay)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 *-*
+
+"""Medicion de los tiempos de NPSGateway.process por fase.
+
+Cada llamada recibe un Timer y el gateway marca el fin de cada fase
+(wsdl, hash, factory, serialize, network, mapping, ...). Al terminar, la
+Instrumentation recibe el Timer con la duracion de cada fase. Si el
+gateway no tiene instrumentation, no se crea ningun Timer y las marcas no
+se hacen.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+
+class Timer(object):
+    """Tiempos de una llamada.
+
+    Atributos:
+        method: transaction.method de la llamada.
+        phases: Lista de pares (fase, segundos), en orden.
+        events: Nombres de los eventos contados durante la llamada
+                (por ejemplo 'cache_hit').
+        total: Segundos desde el inicio hasta la ultima marca.
+    """
+
+    __slots__ = ('method', 'phases', 'events', 'started', 'last')
+
+    def __init__(self, method):
+        self.method = method
+        self.phases = []
+        self.events = []
+        self.started = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """Cierra la fase `phase`, que empezo en la marca anterior."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def count(self, event):
+        self.events.append(event)
+
+    @property
+    def total(self):
+        return self.last - self.started
+
+
+class Instrumentation(object):
+    """Interfaz que usa el gateway. Las subclases redefinen `before` y
+    `after`, que se llaman antes y despues de cada transaccion, o
+    `record` para guardar los tiempos."""
+
+    def start(self, transaction):
+        self.before(transaction)
+        return Timer(transaction.method)
+
+    def finish(self, transaction, timer, error=None):
+        self.record(timer, error)
+        self.after(transaction, timer, error)
+
+    def before(self, transaction):
+        pass
+
+    def after(self, transaction, timer, error):
+        pass
+
+    def record(self, timer, error):
+        pass
+
+
+def percentile(ordered, fraction):
+    """Percentil por rango mas cercano de una lista ordenada."""
+    index = int(round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class Collector(Instrumentation):
+    """Junta los tiempos en memoria y calcula p50/p95/p99 por
+    transaction.method y por fase.
+
+    Parametros del constructor:
+        max_samples(int) = Muestras que se conservan por metodo y fase;
+                           se descartan las mas viejas.
+        exporters = Objetos con un metodo export(report) a los que
+                    `flush` entrega el reporte (ver LoggingExporter y
+                    CallbackExporter).
+    """
+
+    def __init__(self, max_samples=10000, exporters=()):
+        self.max_samples = max_samples
+        self.exporters = list(exporters)
+        self._samples = dict()
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _append(self, key, seconds):
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = collections.deque(maxlen=self.max_samples)
+            self._samples[key] = samples
+        samples.append(seconds)
+
+    def record(self, timer, error):
+        method = timer.method
+        with self._lock:
+            for phase, seconds in timer.phases:
+                self._append((method, phase), seconds)
+            self._append((method, 'total'), timer.total)
+            self._counters[(method, 'calls')] += 1
+            if error is not None:
+                self._counters[(method, 'errors')] += 1
+            for event in timer.events:
+                self._counters[(method, event)] += 1
+
+    def report(self):
+        """Retorna {method: {'phases': {fase: {count, p50, p95, p99}},
+        'counters': {nombre: n}}}, con los tiempos en segundos."""
+        with self._lock:
+            samples = dict((key, sorted(values))
+                           for key, values in self._samples.items())
+            counters = dict(self._counters)
+        report = dict()
+        for (method, phase), ordered in samples.items():
+            entry = report.setdefault(method, dict(phases={}, counters={}))
+            entry['phases'][phase] = dict(
+                count=len(ordered), p50=percentile(ordered, 0.50),
+                p95=percentile(ordered, 0.95), p99=percentile(ordered, 0.99))
+        for (method, name), value in counters.items():
+            entry = report.setdefault(method, dict(phases={}, counters={}))
+            entry['counters'][name] = value
+        return report
+
+    def flush(self, reset=True):
+        """Entrega el reporte a los exporters y, si `reset` es True,
+        empieza a juntar de nuevo."""
+        report = self.report()
+        if reset:
+            self.reset()
+        for exporter in self.exporters:
+            exporter.export(report)
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counters.clear()
+
+
+class CallbackExporter(object):
+    """Entrega cada reporte a una funcion, por ejemplo la que lo manda al
+    sistema de metricas.
+
+    Parametros del constructor:
+        callback(callable) = Recibe el reporte de Collector.report().
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def export(self, report):
+        self.callback(report)
+
+
+class LoggingExporter(object):
+    """Escribe cada reporte en un logger, una linea por metodo y fase.
+
+    Parametros del constructor:
+        logger = logging.Logger a usar. Por defecto 'nps.instrumentation'.
+        level(int) = Nivel de los mensajes.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def export(self, report):
+        for method, entry in sorted(report.items()):
+            for phase, stats in sorted(entry['phases'].items()):
+                self.logger.log(
+                    self.level, '%s %s n=%d p50=%.2fms p95=%.2fms '
+                    'p99=%.2fms', method, phase, stats['count'],
+                    stats['p50'] * 1e3, stats['p95'] * 1e3,
+                    stats['p99'] * 1e3)
+            for name, value in sorted(entry['counters'].items()):
+                self.logger.log(self.level, '%s %s=%d', method, name, value)
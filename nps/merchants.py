@@ -0,0 +1,129 @@
+# -*- coding: utf-8 *-*
+
+"""Registro de merchants: endpoint, secret, tamaño del pool y rate limit
+de cada merchant id.
+
+Se puede cargar de la seccion MERCHANTS de pynps.yaml:
+
+    MERCHANTS:
+        tienda_1:
+            url: https://sandbox.nps.com.ar/ws.php?wsdl
+            secret: ...
+            pool_size: 4
+            rate: 20
+"""
+
+from nps.ratelimit import TokenBucket
+
+
+class UnknownMerchant(ValueError):
+    """La transaccion es de un merchant que no esta registrado y no trae
+    url y secret propios."""
+
+
+class Merchant(object):
+    """Un merchant id y lo que hace falta para operar con el.
+
+    Parametros del constructor:
+        merchant_id(str) = Usuario dado por NPS.
+        url(str) = Url del WSDL de NPS para este merchant.
+        secret(str) = Secret del secure hash.
+        pool_size(int) = Clientes y conexiones simultaneas del merchant.
+        rate(float) = Llamadas por segundo a NPS. None no limita.
+        burst(int) = Llamadas que se pueden hacer de golpe.
+        max_wait(float) = Segundos que una llamada espera lugar en el rate
+                          limit antes de fallar con RateLimited. None
+                          espera lo necesario.
+    """
+
+    def __init__(self, merchant_id, url, secret, pool_size=8, rate=None,
+                 burst=None, max_wait=None):
+        self.merchant_id = merchant_id
+        self.url = url
+        self.secret = secret
+        self.pool_size = pool_size
+        self.max_wait = max_wait
+        self.limiter = None
+        if rate:
+            self.limiter = TokenBucket(rate, burst)
+
+    def _key(self):
+        limiter = self.limiter
+        return (self.url, self.secret, self.pool_size, self.max_wait,
+                limiter and (limiter.rate, limiter.burst))
+
+
+class MerchantRegistry(object):
+    """Merchants conocidos, por merchant id."""
+
+    def __init__(self, merchants=()):
+        self._merchants = dict()
+        for merchant in merchants:
+            self.register(merchant)
+
+    def register(self, merchant):
+        self._merchants[merchant.merchant_id] = merchant
+        return merchant
+
+    def get(self, merchant_id):
+        try:
+            return self._merchants[merchant_id]
+        except KeyError:
+            raise UnknownMerchant('Unknown merchant %r' % merchant_id)
+
+    def __contains__(self, merchant_id):
+        return merchant_id in self._merchants
+
+    def __iter__(self):
+        return iter(self._merchants.values())
+
+    def __len__(self):
+        return len(self._merchants)
+
+    @classmethod
+    def from_settings(cls, settings=None):
+        """Registro con los merchants de la seccion MERCHANTS de la
+        configuracion."""
+        if settings is None:
+            from nps import config
+
+            settings = config.settings
+        registry = cls()
+        for merchant_id, entry in (settings.MERCHANTS or {}).items():
+            options = dict((name, getattr(entry, name)) for name in
+                           ('pool_size', 'rate', 'burst', 'max_wait')
+                           if getattr(entry, name) is not None)
+            registry.register(Merchant(str(merchant_id), entry.url,
+                                       entry.secret, **options))
+        return registry
+
+    def reload(self, settings=None):
+        """Reemplaza los merchants por los de la configuracion, de una
+        sola vez. Los merchants que no cambiaron conservan su rate limit
+        y sus pools en el gateway; los que cambiaron son objetos nuevos y
+        el gateway les arma pools nuevos. Sirve como listener de
+        config.settings.subscribe."""
+        merchants = dict()
+        for merchant in self.from_settings(settings):
+            current = self._merchants.get(merchant.merchant_id)
+            if current is not None and current._key() == merchant._key():
+                merchant = current
+            merchants[merchant.merchant_id] = merchant
+        self._merchants = merchants
+
+    def route(self, transaction):
+        """Retorna el Merchant de `transaction` y le completa la url y el
+        secret si no los trae. Las transacciones de merchants no
+        registrados se procesan como siempre (retorna None) si traen url
+        y secret."""
+        merchant = self._merchants.get(transaction.merchant_id)
+        if merchant is None:
+            if transaction.url and transaction.secret:
+                return None
+            raise UnknownMerchant('Unknown merchant %r' %
+                                  transaction.merchant_id)
+        if not transaction.url:
+            transaction.url = merchant.url
+        if not transaction.secret:
+            transaction.secret = merchant.secret
+        return merchant
@@ -0,0 +1,489 @@
+# -*- coding: utf-8 *-*
+
+"""Outbox: journal local de las transacciones a enviar a NPS.
+
+`Outbox.submit` guarda la transaccion en una base SQLite y retorna cuando
+quedo escrita en disco; un dispatcher en background la envia despues. Asi
+un handler no espera a NPS y una caida no deja dudas: cada entrada del
+journal esta en uno de estos estados
+
+    pending   guardada, todavia no enviada.
+    sending   tomada por el dispatcher. Si el proceso se cae en este
+              estado, al abrir el outbox pasa a in_doubt.
+    in_doubt  no se sabe si llego a NPS (timeout, error de red, caida).
+              El reconciliador la consulta con SimpleQueryTx por su
+              psp_MerchTxRef: si NPS la tiene pasa a done y si no vuelve
+              a pending.
+    done      NPS respondio; la respuesta queda en la entrada.
+    failed    NPS la rechazo (SOAP Fault) o no paso la validacion.
+    unresolved
+              el reconciliador no pudo consultarla `max_checks` veces
+              seguidas; hay que revisarla a mano. El ultimo error queda en
+              la entrada.
+
+Las escrituras se hacen en un solo thread que junta las que llegan
+mientras escribe y las confirma en una sola transaccion (group commit),
+de modo que muchos submit concurrentes comparten el fsync.
+
+    outbox = Outbox('outbox.db', gateway)
+    outbox.start()
+    entry_id = outbox.submit(transaction)
+    ...
+    outbox.get(entry_id).state
+    outbox.close()
+
+El secret no se guarda en el journal: al enviar se toma del
+MerchantRegistry del gateway, que es obligatorio. Las transacciones se
+vuelven a crear con `cls(url, merchant_id, secret)`, como
+PayOnlineTransactionThreeSteps.
+"""
+
+import collections
+import importlib
+import json
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nps.breaker import CircuitOpen
+from nps.envelope import SOAPFault
+from nps.ratelimit import RateLimited
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENDING = 'sending'
+IN_DOUBT = 'in_doubt'
+DONE = 'done'
+FAILED = 'failed'
+UNRESOLVED = 'unresolved'
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    merchant_id TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    url TEXT,
+    request TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    response TEXT,
+    error TEXT,
+    checks INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    UNIQUE (merchant_id, ref))'''
+
+Entry = collections.namedtuple(
+    'Entry', 'id merchant_id ref kind state attempts response error')
+
+# errores por los que la transaccion no llego a salir: se reintenta
+NOT_SENT_ERRORS = (RateLimited, CircuitOpen)
+# NPS la rechazo: no tiene sentido reintentar. Con el engine 'suds' el
+# SOAP Fault llega como suds.WebFault, que se agrega al primer envio (ver
+# rejected_errors) para no importar suds antes. Un ValueError solo es
+# rechazo si sale de armar el pedido (ver Outbox._send): despues del envio
+# puede ser la respuesta que no se pudo leer, y eso queda en duda.
+REJECTED_ERRORS = (SOAPFault,)
+
+
+def rejected_errors():
+    """REJECTED_ERRORS mas las fallas de negocio de suds."""
+    from nps.pool import business_errors
+
+    return tuple(set(REJECTED_ERRORS + business_errors()))
+
+
+def found(query):
+    """Default del reconciliador: NPS tiene la transaccion si la consulta
+    trae el detalle en psp_Transaction."""
+    return bool(getattr(query.response, 'user_data', None))
+
+
+class _Write(object):
+
+    __slots__ = ('fn', 'event', 'result', 'error')
+
+    def __init__(self, fn, wait):
+        self.fn = fn
+        self.event = threading.Event() if wait else None
+        self.result = None
+        self.error = None
+
+
+class Outbox(object):
+    """Journal SQLite de transacciones con dispatcher y reconciliador.
+
+    Parametros del constructor:
+        path(str) = Archivo de la base.
+        gateway = NPSGateway con un MerchantRegistry. Con el engine
+                  'template' tiene que tener transaction_data=True, para
+                  que el reconciliador vea psp_Transaction.
+        workers(int) = Transacciones enviadas a NPS en paralelo.
+        batch_size(int) = Escrituras maximas por commit, y entradas que
+                          toma el dispatcher de una vez.
+        retry_delay(float) = Segundos antes de reintentar una transaccion
+                             que no salio por rate limit o circuit breaker.
+        reconcile_interval(float) = Cada cuantos segundos el dispatcher
+                                    corre el reconciliador.
+        found(callable) = Recibe la SimpleQueryTx del reconciliador y
+                          retorna True si NPS tiene la transaccion.
+        max_checks(int) = Consultas fallidas del reconciliador tras las
+                          cuales la entrada pasa a unresolved.
+        timeout(float) = Segundos de espera cuando la base esta
+                         bloqueada.
+    """
+
+    def __init__(self, path, gateway, workers=8, batch_size=100,
+                 retry_delay=5, reconcile_interval=30, found=found,
+                 timeout=5, max_checks=10):
+        if gateway.merchants is None:
+            raise ValueError('The gateway needs a MerchantRegistry')
+        if gateway.engine == 'template' and not gateway.transaction_data:
+            raise ValueError('The reconciler needs transaction_data=True')
+        self.path = path
+        self.gateway = gateway
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.reconcile_interval = reconcile_interval
+        self.found = found
+        self.timeout = timeout
+        self.max_checks = max_checks
+        self._local = threading.local()
+        self._writes = queue.Queue()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._drain = True
+        self._dispatcher = None
+        self._rejected_errors = None
+
+        conn = self._connection()
+        conn.execute(SCHEMA)
+        columns = [row[1] for row in
+                   conn.execute('PRAGMA table_info(outbox)')]
+        if 'checks' not in columns:
+            # journals creados antes de la columna checks
+            conn.execute('ALTER TABLE outbox ADD COLUMN checks INTEGER '
+                         'NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS outbox_state '
+                     'ON outbox (state, not_before)')
+        # lo que estaba saliendo cuando se cayo el proceso anterior
+        conn.execute('UPDATE outbox SET state = ? WHERE state = ?',
+                     (IN_DOUBT, SENDING))
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='nps-outbox-writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # en WAL, FULL hace fsync en cada commit
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    # escrituras
+
+    def _write(self, fn, wait=True):
+        """Encola `fn(conn)` para el thread de escritura. Con `wait`,
+        espera el commit y retorna el resultado de `fn`."""
+        write = _Write(fn, wait)
+        self._writes.put(write)
+        if not wait:
+            return None
+        write.event.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _write_loop(self):
+        conn = self._connection()
+        while True:
+            write = self._writes.get()
+            if write is None:
+                break
+            batch = [write]
+            # group commit: todo lo que llego mientras se escribia el
+            # commit anterior va en este
+            while len(batch) < self.batch_size:
+                try:
+                    write = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if write is None:
+                    self._writes.put(None)
+                    break
+                batch.append(write)
+            self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        error = None
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write in batch:
+                conn.execute('SAVEPOINT write')
+                try:
+                    write.result = write.fn(conn)
+                except Exception as exc:
+                    conn.execute('ROLLBACK TO write')
+                    write.error = exc
+                conn.execute('RELEASE write')
+            conn.execute('COMMIT')
+        except Exception as exc:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            error = exc
+        for write in batch:
+            if error is not None:
+                write.error = error
+            if write.event is not None:
+                write.event.set()
+
+    def submit(self, transaction, wait=True):
+        """Guarda `transaction` en el journal y retorna el id de la
+        entrada. Con `wait` (por defecto) retorna recien cuando esta en
+        disco. Volver a enviar la misma psp_MerchTxRef del mismo merchant
+        retorna la entrada existente."""
+        request = transaction.request
+        kind = '%s:%s' % (type(transaction).__module__,
+                          type(transaction).__name__)
+        merchant_id = transaction.merchant_id
+        ref = request.psp_MerchTxRef
+        if not ref:
+            raise ValueError('psp_MerchTxRef is required')
+        row = (merchant_id, ref, kind, transaction.url,
+               json.dumps(request.to_dict()), PENDING, time.time())
+
+        def insert(conn):
+            conn.execute(
+                'INSERT OR IGNORE INTO outbox (merchant_id, ref, kind, url, '
+                'request, state, updated) VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+            return conn.execute(
+                'SELECT id FROM outbox WHERE merchant_id = ? AND ref = ?',
+                (merchant_id, ref)).fetchone()[0]
+
+        entry_id = self._write(insert, wait)
+        self._wakeup.set()
+        return entry_id
+
+    def _update(self, entry_id, state, response=None, error=None,
+                not_before=0):
+        def update(conn):
+            conn.execute(
+                'UPDATE outbox SET state = ?, response = ?, error = ?, '
+                'not_before = ?, checks = 0, updated = ? WHERE id = ?',
+                (state, response, error, not_before, time.time(), entry_id))
+        self._write(update, wait=False)
+
+    # lectura
+
+    def get(self, entry_id):
+        row = self._connection().execute(
+            'SELECT id, merchant_id, ref, kind, state, attempts, response, '
+            'error FROM outbox WHERE id = ?', (entry_id,)).fetchone()
+        if row is None:
+            raise KeyError(entry_id)
+        entry = Entry(*row)
+        if entry.response is not None:
+            entry = entry._replace(response=json.loads(entry.response))
+        return entry
+
+    def flush(self):
+        """Espera a que esten en disco las escrituras encoladas."""
+        self._write(lambda conn: None)
+
+    def counts(self):
+        """{estado: cantidad de entradas}."""
+        return dict(self._connection().execute(
+            'SELECT state, COUNT(*) FROM outbox GROUP BY state'))
+
+    # dispatcher
+
+    def _claim(self, limit):
+        """Pasa a sending hasta `limit` entradas pendientes y las retorna,
+        despues de que el cambio quedo en disco."""
+        def claim(conn):
+            rows = conn.execute(
+                'SELECT id, merchant_id, ref, kind, url, request FROM outbox '
+                'WHERE state = ? AND not_before <= ? ORDER BY id LIMIT ?',
+                (PENDING, time.time(), limit)).fetchall()
+            conn.executemany(
+                'UPDATE outbox SET state = ?, attempts = attempts + 1, '
+                'updated = ? WHERE id = ?',
+                [(SENDING, time.time(), row[0]) for row in rows])
+            return rows
+        return self._write(claim)
+
+    @property
+    def rejected_errors(self):
+        if self._rejected_errors is None:
+            self._rejected_errors = rejected_errors()
+        return self._rejected_errors
+
+    def _build(self, kind, url, merchant_id, request):
+        module, _, name = kind.partition(':')
+        cls = getattr(importlib.import_module(module), name)
+        transaction = cls(url, merchant_id, None)
+        for key, value in json.loads(request).items():
+            if value is not None:
+                transaction.request[key] = value
+        return transaction
+
+    def _send(self, row):
+        entry_id, merchant_id, ref, kind, url, request = row
+        try:
+            transaction = self._build(kind, url, merchant_id, request)
+        except ValueError as exc:
+            self._update(entry_id, FAILED, error=str(exc))
+            self._wakeup.set()
+            return
+        try:
+            self.gateway.process(transaction)
+        except NOT_SENT_ERRORS as exc:
+            self._update(entry_id, PENDING, error=str(exc),
+                         not_before=time.time() + self.retry_delay)
+        except self.rejected_errors as exc:
+            self._update(entry_id, FAILED, error=str(exc))
+        except Exception as exc:
+            self._update(entry_id, IN_DOUBT, error=str(exc))
+        else:
+            self._update(entry_id, DONE, response=dump_response(
+                transaction.response))
+        self._wakeup.set()
+
+    def dispatch(self, limit=None):
+        """Envia, en el thread que llama, las entradas pendientes (a lo
+        sumo `limit`). Retorna cuantas envio."""
+        rows = self._claim(limit or self.batch_size)
+        for row in rows:
+            self._send(row)
+        self.flush()
+        return len(rows)
+
+    def start(self):
+        """Arranca el dispatcher en background."""
+        if self._dispatcher is None:
+            self._stopping.clear()
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name='nps-outbox-dispatcher')
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+        return self
+
+    def _dispatch_loop(self):
+        inflight = set()
+        reconciled = time.monotonic()
+        with ThreadPoolExecutor(self.workers,
+                                thread_name_prefix='nps-outbox') as executor:
+            while True:
+                inflight = set(f for f in inflight if not f.done())
+                if self._stopping.is_set() and not self._drain:
+                    break
+                if time.monotonic() - reconciled >= self.reconcile_interval:
+                    self.reconcile()
+                    reconciled = time.monotonic()
+                rows = []
+                # se toma un poco mas de lo que se puede enviar, para que
+                # los workers no esperen al commit del claim
+                room = self.workers * 2 - len(inflight)
+                if room > 0:
+                    rows = self._claim(min(room, self.batch_size))
+                for row in rows:
+                    inflight.add(executor.submit(self._send, row))
+                if not rows:
+                    if self._stopping.is_set() and not inflight:
+                        break
+                    self._wakeup.wait(0.5)
+                    self._wakeup.clear()
+
+    # reconciliador
+
+    def reconcile(self, limit=None):
+        """Consulta a NPS por las entradas in_doubt. Retorna cuantas
+        resolvio."""
+        from nps.reconcile import run_bounded
+        from nps.transactions import SimpleQueryTx
+
+        rows = self._connection().execute(
+            'SELECT id, merchant_id, ref, url FROM outbox WHERE state = ? '
+            'ORDER BY id LIMIT ?',
+            (IN_DOUBT, limit or self.batch_size)).fetchall()
+
+        def query(row):
+            entry_id, merchant_id, ref, url = row
+            return self.gateway.process(
+                SimpleQueryTx(url, merchant_id, None, None, ref))
+
+        resolved = 0
+        for row, result in run_bounded(query, rows, self.workers):
+            if isinstance(result, Exception):
+                logger.warning('Could not reconcile outbox entry %s (%s): '
+                               '%r', row[0], row[2], result)
+                self._check_failed(row[0], result)
+                continue
+            if self.found(result):
+                self._update(row[0], DONE, response=dump_response(
+                    result.response))
+            else:
+                self._update(row[0], PENDING)
+            resolved += 1
+        self.flush()
+        if resolved:
+            self._wakeup.set()
+        return resolved
+
+    def _check_failed(self, entry_id, exc):
+        """Cuenta una consulta fallida del reconciliador; despues de
+        `max_checks` la entrada pasa a unresolved."""
+        max_checks = self.max_checks
+
+        def update(conn):
+            conn.execute(
+                'UPDATE outbox SET checks = checks + 1, error = ?, '
+                'updated = ? WHERE id = ?',
+                (repr(exc), time.time(), entry_id))
+            checks, = conn.execute('SELECT checks FROM outbox WHERE id = ?',
+                                   (entry_id,)).fetchone()
+            if checks >= max_checks:
+                conn.execute('UPDATE outbox SET state = ? WHERE id = ?',
+                             (UNRESOLVED, entry_id))
+                logger.error('Outbox entry %s is unresolved after %s '
+                             'failed checks', entry_id, checks)
+        self._write(update, wait=False)
+
+    def close(self, drain=True):
+        """Detiene el dispatcher y el thread de escritura. Con `drain`,
+        antes se envia lo pendiente que ya se puede enviar."""
+        if self._dispatcher is not None:
+            self._drain = drain
+            self._stopping.set()
+            self._wakeup.set()
+            self._dispatcher.join()
+            self._dispatcher = None
+        self._writes.put(None)
+        self._writer.join()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def dump_response(response):
+    """JSON de los campos de `response` y de psp_Transaction si esta."""
+    data = response.to_dict()
+    user_data = getattr(response, 'user_data', None)
+    if user_data is not None:
+        data['psp_Transaction'] = user_data
+    return json.dumps(data, default=str)
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 *-*
+
+import copy
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+def _suds_client(url):
+    from suds.client import Client
+
+    return Client(url)
+
+
+def business_errors():
+    """Fallas que NPS responde sin que el cliente quede en mal estado (un
+    pago rechazado, un SOAP Fault): con estas el cliente vuelve al pool."""
+    from suds import WebFault
+
+    from nps.envelope import SOAPFault
+
+    return (WebFault, SOAPFault)
+
+
+class PoolTimeout(Exception):
+    """No se obtuvo un cliente libre dentro del tiempo de espera."""
+
+
+class PooledClient(object):
+    """Cliente suds reutilizable.
+
+    Guarda ya resueltos los templates de `client.factory.create(factory)` y
+    los metodos de `client.service`, de modo que cada uso posterior solo
+    copia el template en lugar de recorrer el schema del WSDL. La copia es
+    superficial: la metadata del objeto suds referencia al schema y no se
+    modifica al completar los campos.
+    """
+
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+        self.last_used = time.monotonic()
+        self._templates = dict()
+        self._methods = dict()
+
+    def prepare(self, factory, method):
+        """Resuelve de antemano el template y el metodo de una operacion."""
+        if factory not in self._templates:
+            self._templates[factory] = self.client.factory.create(factory)
+        if method not in self._methods:
+            self._methods[method] = getattr(self.client.service, method)
+
+    def create(self, factory):
+        """Retorna un objeto nuevo del tipo `factory`, listo para llenar."""
+        template = self._templates.get(factory)
+        if template is None:
+            template = self.client.factory.create(factory)
+            self._templates[factory] = template
+        obj = copy.copy(template)
+        obj.__keylist__ = list(template.__keylist__)
+        return obj
+
+    def method(self, name):
+        """Retorna el metodo `name` del servicio."""
+        ws_method = self._methods.get(name)
+        if ws_method is None:
+            ws_method = getattr(self.client.service, name)
+            self._methods[name] = ws_method
+        return ws_method
+
+    def close(self):
+        """Cierra el cliente si tiene como (una conexion HTTP, por
+        ejemplo; un cliente suds no guarda conexiones abiertas)."""
+        close = getattr(self.client, 'close', None)
+        if close is not None:
+            close()
+
+
+class ClientPool(object):
+    """Pool thread-safe de clientes suds, agrupados por url del WSDL.
+
+    Parametros del constructor:
+        max_size(int) = Cantidad maxima de clientes por url.
+        idle_timeout(float) = Segundos que puede estar un cliente sin
+                              usarse antes de ser descartado.
+        wait_timeout(float) = Segundos que se espera por un cliente libre
+                              cuando se llego a `max_size`. None espera
+                              indefinidamente.
+        client_factory(callable) = Construye el cliente suds para una url.
+                                   Por defecto suds.client.Client.
+        reusable_errors(tuple) = Excepciones despues de las cuales el
+                                 cliente se devuelve al pool; con
+                                 cualquier otra se descarta. Por defecto
+                                 las de business_errors().
+    """
+
+    def __init__(self, max_size=8, idle_timeout=300, wait_timeout=None,
+                 client_factory=None, reusable_errors=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.client_factory = client_factory or _suds_client
+        self._reusable_errors = reusable_errors
+        self._idle = dict()
+        self._sizes = dict()
+        self._lock = threading.Condition()
+
+    def get(self, url, timeout=None):
+        """Retorna un cliente libre para `url`, creandolo si hace falta."""
+        if timeout is None:
+            timeout = self.wait_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            evicted = self._evict_idle(time.monotonic())
+        self._close(evicted)
+        with self._lock:
+            while True:
+                idle = self._idle.get(url)
+                if idle:
+                    return idle.pop()
+                if self._sizes.get(url, 0) < self.max_size:
+                    self._sizes[url] = self._sizes.get(url, 0) + 1
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout('No free client for %s' % url)
+                self._lock.wait(remaining)
+        try:
+            return PooledClient(url, self.client_factory(url))
+        except Exception:
+            with self._lock:
+                self._sizes[url] -= 1
+                self._lock.notify()
+            raise
+
+    def put(self, pooled):
+        """Devuelve un cliente al pool."""
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault(pooled.url, []).append(pooled)
+            self._lock.notify()
+
+    def discard(self, pooled):
+        """Descarta un cliente que quedo en un estado invalido."""
+        with self._lock:
+            self._sizes[pooled.url] -= 1
+            self._lock.notify()
+        pooled.close()
+
+    @property
+    def reusable_errors(self):
+        # se resuelve al primer error, para no importar suds antes
+        if self._reusable_errors is None:
+            self._reusable_errors = business_errors()
+        return self._reusable_errors
+
+    @contextmanager
+    def acquire(self, url, timeout=None):
+        """Cliente del pool para usar en un with. Si el bloque falla por
+        un error de transporte o desconocido el cliente se descarta; si
+        es una falla de negocio (reusable_errors) vuelve al pool."""
+        pooled = self.get(url, timeout)
+        try:
+            yield pooled
+        except Exception as exc:
+            if isinstance(exc, self.reusable_errors):
+                self.put(pooled)
+            else:
+                self.discard(pooled)
+            raise
+        else:
+            self.put(pooled)
+
+    def warmup(self, urls, operations=(), size=1):
+        """Crea `size` clientes por cada url y resuelve las operaciones
+        dadas como pares (factory, method)."""
+        for url in urls:
+            clients = [self.get(url) for _ in range(size)]
+            for pooled in clients:
+                for factory, method in operations:
+                    pooled.prepare(factory, method)
+                self.put(pooled)
+
+    def evict_idle(self):
+        """Descarta los clientes que superaron `idle_timeout`."""
+        with self._lock:
+            evicted = self._evict_idle(time.monotonic())
+        self._close(evicted)
+
+    def _evict_idle(self, now):
+        """Saca del pool los clientes vencidos y los retorna, para
+        cerrarlos fuera del lock."""
+        evicted = []
+        if self.idle_timeout is None:
+            return evicted
+        for url, idle in self._idle.items():
+            fresh = []
+            for pooled in idle:
+                if now - pooled.last_used < self.idle_timeout:
+                    fresh.append(pooled)
+                else:
+                    evicted.append(pooled)
+            self._sizes[url] -= len(idle) - len(fresh)
+            idle[:] = fresh
+        if evicted:
+            self._lock.notify_all()
+        return evicted
+
+    def _close(self, clients):
+        for pooled in clients:
+            pooled.close()
+
+    def clear(self):
+        """Descarta (y cierra) todos los clientes libres."""
+        with self._lock:
+            cleared = []
+            for url, idle in self._idle.items():
+                self._sizes[url] -= len(idle)
+                cleared.extend(idle)
+            self._idle.clear()
+            self._lock.notify_all()
+        self._close(cleared)
+
+
+class TransactionPool(object):
+    """Transacciones recicladas de una clase, para no crear una
+    transaccion con su request y su respuesta en cada pago.
+
+    acquire() toma una transaccion libre y la deja como nueva con reset()
+    (los campos vuelven a sus defaults, por ejemplo psp_Country='ARG');
+    si no hay, crea una. Al terminar de usarla se devuelve con release().
+    Una transaccion devuelta no se debe seguir usando, ni su request ni
+    su respuesta.
+
+    Parametros del constructor:
+        transaction_class(class) = Clase de las transacciones, con un
+                                   metodo reset() que recibe los mismos
+                                   parametros que el constructor.
+        max_size(int) = Cantidad maxima de transacciones libres. Las que
+                        se devuelven con el pool lleno se descartan.
+    """
+
+    def __init__(self, transaction_class, max_size=1024):
+        self.transaction_class = transaction_class
+        self.max_size = max_size
+        self._free = []
+        # ids de las transacciones en _free, para detectar un release doble
+        self._released = set()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def acquire(self, *args):
+        """Transaccion lista para usar, armada con `args` como si fuera
+        transaction_class(*args)."""
+        with self._lock:
+            if self._free:
+                transaction = self._free.pop()
+                self._released.discard(id(transaction))
+                self.reused += 1
+            else:
+                transaction = None
+                self.created += 1
+        if transaction is None:
+            return self.transaction_class(*args)
+        transaction.reset(*args)
+        return transaction
+
+    def release(self, transaction):
+        """Devuelve `transaction` al pool. Devolverla dos veces levanta
+        ValueError: la misma transaccion se entregaria a dos usuarios."""
+        with self._lock:
+            if id(transaction) in self._released:
+                raise ValueError('transaction already released')
+            if len(self._free) < self.max_size:
+                self._free.append(transaction)
+                self._released.add(id(transaction))
+            else:
+                self.discarded += 1
+
+    @contextmanager
+    def transaction(self, *args):
+        """acquire() y release() alrededor de un bloque with."""
+        transaction = self.acquire(*args)
+        try:
+            yield transaction
+        finally:
+            self.release(transaction)
+
+    def stats(self):
+        """Contadores del pool."""
+        with self._lock:
+            return dict(created=self.created, reused=self.reused,
+                        discarded=self.discarded, idle=len(self._free))
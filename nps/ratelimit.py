@@ -0,0 +1,263 @@
+# -*- coding: utf-8 *-*
+
+"""Limites de la tasa de llamadas a NPS."""
+
+import collections
+import threading
+import time
+
+
+class RateLimited(Exception):
+    """No se obtuvo lugar para la llamada dentro del tiempo de espera."""
+
+
+class TokenBucket(object):
+    """Token bucket thread-safe.
+
+    Cada llamada consume un token; los tokens se reponen a `rate` por
+    segundo hasta un maximo de `burst`. `reserve` toma el token aunque
+    todavia no este disponible y retorna cuanto hay que esperar para
+    usarlo, de modo que el mismo bucket sirve para codigo con threads
+    (`acquire` duerme) y con asyncio (se espera con asyncio.sleep).
+
+    Parametros del constructor:
+        rate(float) = Llamadas por segundo.
+        burst(int) = Llamadas que se pueden hacer de golpe. Por defecto,
+                     las de un segundo.
+        clock(callable) = Reloj en segundos.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, timeout=None):
+        """Reserva un token y retorna los segundos a esperar antes de
+        usarlo. Levanta RateLimited si la espera supera `timeout`."""
+        with self._lock:
+            self._refill(self.clock())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            delay = -self.tokens / self.rate
+            if timeout is not None and delay > timeout:
+                self.tokens += 1
+                raise RateLimited('Rate limit of %s/s exceeded' % self.rate)
+            return delay
+
+    def acquire(self, timeout=None):
+        """Espera, a lo sumo `timeout` segundos, un token."""
+        delay = self.reserve(timeout)
+        if delay:
+            time.sleep(delay)
+
+
+class _Waiter(object):
+
+    __slots__ = ('ticket', 'wake')
+
+    def __init__(self, wake):
+        self.ticket = None
+        self.wake = wake
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimiter(object):
+    """Limite de llamadas simultaneas a NPS que se adapta a lo que NPS
+    aguanta (AIMD, como el control de congestion de TCP).
+
+    Mientras la latencia (en promedio movil) no supere `tolerance` veces
+    la menor medida, cada llamada que termina bien sube el limite en
+    1/limite (uno por cada ronda de llamadas), si se estaba usando al
+    menos la mitad del limite. Un error de `failures`, un psp_ResponseCod
+    de `error_codes` o una latencia mayor lo multiplican por `backoff`, una
+    sola vez por ronda: las llamadas que ya estaban en vuelo cuando se
+    redujo no lo vuelven a reducir. Las llamadas que no entran esperan en
+    orden de llegada.
+
+    Se usa igual desde threads (`acquire`) y desde asyncio
+    (`acquire_async`); en los dos casos el ticket se devuelve con
+    `release`.
+
+    Parametros del constructor:
+        initial(int) = Limite inicial.
+        min_limit(int) = Limite minimo.
+        max_limit(int) = Limite maximo.
+        backoff(float) = Factor por el que se multiplica el limite al
+                         detectar sobrecarga.
+        tolerance(float) = Cuantas veces la menor latencia medida se
+                           considera normal.
+        window(int) = Cantidad de latencias recientes que se recuerdan.
+        probe_interval(float) = Cada cuantos segundos la menor latencia
+                                se vuelve a tomar de las `window`
+                                recientes, para seguir a NPS si su
+                                latencia normal cambia.
+        max_queue(int) = Llamadas que pueden esperar lugar. Las que no
+                         entran fallan con RateLimited. None no limita.
+        error_codes = Valores de psp_ResponseCod que indican que NPS esta
+                      sobrecargado.
+        failures = Tupla de las excepciones que indican sobrecarga (por
+                   defecto las mismas que cuenta el CircuitBreaker). Un
+                   SOAP Fault o un error de validacion no bajan el limite.
+        clock(callable) = Reloj en segundos.
+    """
+
+    def __init__(self, initial=10, min_limit=1, max_limit=200, backoff=0.7,
+                 tolerance=2.0, window=100, probe_interval=60,
+                 max_queue=None, error_codes=(), failures=None,
+                 clock=time.monotonic):
+        if not 0 < backoff < 1:
+            raise ValueError('backoff must be between 0 and 1')
+        if failures is None:
+            from nps.reconcile import TRANSIENT_ERRORS as failures
+        self.failures = failures
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.probe_interval = probe_interval
+        self.max_queue = max_queue
+        self.clock = clock
+        self.error_codes = frozenset(str(code) for code in error_codes)
+        self.inflight = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._latencies = collections.deque(maxlen=window)
+        self._baseline = None
+        self._recent = None
+        self._probed = clock()
+        self._waiters = collections.deque()
+        self._seq = 0
+        self._cut = 0
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        self.inflight += 1
+        self._seq += 1
+        return self._seq
+
+    def _reserve(self, waiter):
+        """Ticket si hay lugar; si no, encola `waiter` y retorna None."""
+        with self._lock:
+            if not self._waiters and self.inflight < int(self.limit):
+                return self._admit()
+            if self.max_queue is not None and \
+                    len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise RateLimited('Too many calls waiting for NPS')
+            self._waiters.append(waiter)
+            return None
+
+    def _claim(self, waiter, timeout):
+        with self._lock:
+            if waiter.ticket is None:
+                self._waiters.remove(waiter)
+                self.rejected += 1
+                raise RateLimited('No room for the call within %ss' % timeout)
+            return waiter.ticket
+
+    def acquire(self, timeout=None):
+        """Espera, a lo sumo `timeout` segundos, lugar para una llamada y
+        retorna su ticket."""
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        ticket = self._reserve(waiter)
+        if ticket is not None:
+            return ticket
+        event.wait(timeout)
+        return self._claim(waiter, timeout)
+
+    async def acquire_async(self, timeout=None):
+        """Como `acquire`, para asyncio."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(_resolve, future))
+        ticket = self._reserve(waiter)
+        if ticket is not None:
+            return ticket
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.ticket is None:
+                    self._waiters.remove(waiter)
+                    raise
+            self.release(waiter.ticket, None)
+            raise
+        return self._claim(waiter, timeout)
+
+    def failed(self, transaction):
+        """True si la respuesta de `transaction` indica sobrecarga."""
+        return str(transaction.response.psp_ResponseCod) in self.error_codes
+
+    def overloaded(self, exc):
+        """True si la llamada que levanto `exc` indica sobrecarga."""
+        return isinstance(exc, self.failures)
+
+    def release(self, ticket, latency, error=False):
+        """Devuelve el lugar de `ticket`. `latency` son los segundos que
+        tardo la llamada; None la descarta (llamada cancelada)."""
+        with self._lock:
+            self.inflight -= 1
+            if latency is not None:
+                if not error:
+                    self._measure(latency)
+                baseline = self._baseline
+                if error or (baseline is not None and
+                             self._recent > baseline * self.tolerance):
+                    if ticket > self._cut:
+                        self.limit = max(self.min_limit,
+                                         self.limit * self.backoff)
+                        self._cut = self._seq
+                        self.decreases += 1
+                elif self.inflight + 1 >= self.limit / 2:
+                    # solo se sube si el limite se estaba usando
+                    self.limit = min(self.max_limit,
+                                     self.limit + 1.0 / self.limit)
+            while self._waiters and self.inflight < int(self.limit):
+                waiter = self._waiters.popleft()
+                waiter.ticket = self._admit()
+                waiter.wake()
+
+    def _measure(self, latency):
+        # la latencia actual es un promedio movil, para que una llamada
+        # lenta suelta no reduzca el limite
+        if self._recent is None:
+            self._recent = latency
+        else:
+            self._recent += (latency - self._recent) * 0.2
+        self._latencies.append(latency)
+        now = self.clock()
+        if now - self._probed >= self.probe_interval:
+            self._baseline = min(self._latencies)
+            self._probed = now
+        elif self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+
+    def stats(self):
+        with self._lock:
+            return dict(limit=self.limit, baseline=self._baseline,
+                        latency=self._recent,
+                        inflight=self.inflight,
+                        waiting=len(self._waiters), rejected=self.rejected,
+                        decreases=self.decreases)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 *-*
+
+"""Herramientas para correr muchas consultas contra NPS: concurrencia
+acotada, reintentos con backoff y checkpoints para poder retomar."""
+
+import os
+import random
+import time
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from suds.transport import TransportError
+
+
+TRANSIENT_ERRORS = (IOError, TransportError)
+
+
+def retry(fn, retries=3, backoff=0.5, transient=TRANSIENT_ERRORS):
+    """Llama a `fn` reintentando hasta `retries` veces ante errores
+    transitorios, esperando `backoff` * 2**intento segundos (con jitter)
+    entre intentos."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except transient:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def run_bounded(fn, items, concurrency):
+    """Aplica `fn` a cada item en un pool de threads, con a lo sumo
+    `concurrency` llamadas en vuelo. Genera pares (item, resultado) en
+    orden de finalizacion; si `fn` fallo el resultado es la excepcion."""
+
+    items = iter(items)
+    pending = dict()
+    with ThreadPoolExecutor(concurrency) as executor:
+        try:
+            for item in items:
+                pending[executor.submit(fn, item)] = item
+                if len(pending) >= concurrency:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    exc = future.exception()
+                    if exc is not None:
+                        yield item, exc
+                    else:
+                        yield item, future.result()
+                    for next_item in items:
+                        pending[executor.submit(fn, next_item)] = next_item
+                        break
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class Checkpoint(object):
+    """Registro en disco de las referencias ya procesadas.
+
+    Cada referencia se agrega como una linea al archivo `path`; al crear
+    el checkpoint se leen las que ya estaban, de modo que una corrida
+    interrumpida puede retomarse salteando lo hecho.
+
+    Parametros del constructor:
+        path(str) = Archivo del checkpoint.
+        sync_every(int) = Cada cuantas referencias se hace fsync.
+    """
+
+    def __init__(self, path, sync_every=100):
+        self.path = path
+        self.sync_every = sync_every
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, 'rt') as fh:
+                self.done.update(line.rstrip('\n') for line in fh)
+        self._fh = open(path, 'at')
+        self._unsynced = 0
+
+    def __contains__(self, ref):
+        return ref in self.done
+
+    def add(self, ref):
+        self.done.add(ref)
+        self._fh.write('%s\n' % ref)
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self._fh.closed:
+            self.sync()
+            self._fh.close()
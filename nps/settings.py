@@ -4,3 +4,6 @@ DEBUG_NPS_FACTORY = 'PayOnLine_3p'
 ALLOWED_COUNTRIES = ('ARG', 'URY', 'BOL', 'COL', 'MEX', 'PRY', 'PER', 'VEN', 'CHL',)
 ALLOWED_TX_SOURCES = ('WEB', 'IVR', 'CALLCENTRE', 'TELORDER', 'MAILORDER',
     'MTORDER', 'CARDPRESENT', 'PSPBACKOFFICE',)
+# merchant id -> url, secret, pool_size, rate, burst, max_wait.
+# Ver nps.merchants.
+MERCHANTS = {}
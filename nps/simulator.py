@@ -0,0 +1,503 @@
+# -*- coding: utf-8 *-*
+
+"""Simulador local de NPS, para probar y medir el gateway sin salir a la
+red.
+
+Reemplaza al fake de examples/soap-server (flaskext.enterprise y soaplib
+ya no se mantienen) usando solo la libreria estandar. Publica un WSDL con
+PayOnLine_3p y SimpleQueryTx y, en modo 'realistic', responde como NPS:
+valida el psp_SecureHash con el secret de cada merchant, registra cada
+pago y lo devuelve en las consultas. Ademas se le puede configurar la
+latencia, fallas (errores HTTP, SOAP Faults, codigos de respuesta de NPS
+o conexiones cortadas) y un limite de tasa y de llamadas simultaneas, para
+medir throughput y latencias de cola:
+
+    from nps import simulator
+    server = simulator.FakeNPS(
+        secrets={'tienda_1': 'secret'},
+        latency=simulator.lognormal(0.05, 0.4),
+        faults=[simulator.Fault(0.01, status=503)],
+        rate=500).start()
+    server.url  # url del WSDL
+    server.stop()
+
+Tambien se puede correr aparte: nps-simulator --port 8080 --secret
+tienda_1:secret --latency 0.05 --p99 0.4.
+
+En modo 'echo' cada operacion responde con los campos del request que
+existen en la respuesta, sin guardar nada.
+"""
+
+import argparse
+import itertools
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import unescape
+
+from nps import hashing
+from nps.ratelimit import RateLimited
+from nps.ratelimit import TokenBucket
+from nps.wsdl import parse_wsdl
+
+
+WSDL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    'simulator.wsdl')
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope'
+    ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"'
+    ' xmlns:ns1="%s"><SOAP-ENV:Body><ns1:%sResponse><%s>%s</%s>'
+    '</ns1:%sResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>')
+
+FAULT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope'
+    ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<SOAP-ENV:Body><SOAP-ENV:Fault><faultcode>%s</faultcode>'
+    '<faultstring>%s</faultstring></SOAP-ENV:Fault></SOAP-ENV:Body>'
+    '</SOAP-ENV:Envelope>')
+
+FIELD = re.compile(r'<(psp_\w+)>([^<]*)</\1>')
+OPERATION = re.compile(r'<(?:[\w-]+:)?Body[^>]*>\s*<(?:[\w-]+:)?(\w+)')
+
+# (psp_ResponseCod, psp_ResponseMsg) de las respuestas del simulador. Los
+# mensajes de error contienen 'Error', como los de NPS, asi que la
+# transaccion queda con success = False.
+PAYMENT_OK = ('1', 'Solicitud de Autorizacion 3p Registrada')
+QUERY_OK = ('2', 'Consulta de Transaccion exitosa')
+INVALID_HASH = ('9', 'Error: psp_SecureHash invalido')
+UNKNOWN_MERCHANT = ('9', 'Error: psp_MerchantId inexistente')
+NOT_FOUND = ('3', 'Error: Transaccion inexistente')
+
+
+def fixed(seconds):
+    """Latencia constante."""
+    return lambda rnd: seconds
+
+
+def uniform(low, high):
+    """Latencia uniforme entre `low` y `high` segundos."""
+    return lambda rnd: rnd.uniform(low, high)
+
+
+def lognormal(median, p99):
+    """Latencia log-normal con esa mediana y ese percentil 99, en
+    segundos: la forma habitual de la latencia de un servicio, con una
+    cola larga."""
+    sigma = math.log(p99 / median) / 2.326
+    mu = math.log(median)
+    return lambda rnd: rnd.lognormvariate(mu, sigma)
+
+
+class Fault(object):
+    """Falla que el simulador inyecta en una fraccion de las llamadas.
+
+    Parametros del constructor:
+        probability(float) = Fraccion de las llamadas que fallan.
+        status(int) = Status HTTP de la respuesta. Con 500 se responde un
+                      SOAP Fault y con otros status un texto plano.
+        cod(str) = Si se indica, se responde 200 con este psp_ResponseCod
+                   y `message` (un rechazo de NPS, no una falla HTTP).
+        message(str) = psp_ResponseMsg o faultstring.
+        drop(bool) = Cortar la conexion sin responder, como una caida de
+                     red con el pedido ya enviado.
+        operation(str) = Fallar solo en esta operacion.
+    """
+
+    def __init__(self, probability, status=500, cod=None,
+                 message='Error: falla simulada', drop=False,
+                 operation=None):
+        self.probability = probability
+        self.status = status
+        self.cod = cod
+        self.message = message
+        self.drop = drop
+        self.operation = operation
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # la respuesta sale en dos writes (headers y body); sin esto Nagle y
+    # el ACK demorado del cliente agregan ~40ms a cada request.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.fake._count('wsdl')
+        self.reply(200, self.server.fake.wsdl)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length).decode('utf-8')
+        status, body = self.server.fake.respond(data)
+        if status is None:
+            self.close_connection = True
+            return
+        self.reply(status, body)
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status in (429, 503):
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeNPS(object):
+    """Servidor del simulador en un thread.
+
+    Parametros del constructor:
+        mode(str) = 'realistic' o 'echo'.
+        host(str) = Direccion donde escuchar.
+        port(int) = Puerto. Por defecto se elige uno libre.
+        secrets(dict) = merchant id -> secret. Si se indica, se valida el
+                        psp_SecureHash de cada llamada y los merchants que
+                        no estan se rechazan.
+        hash_backend = Backend del secure hash (ver nps.hashing). Por
+                       defecto md5.
+        latency = Segundos que tarda cada respuesta: un numero, una de
+                  fixed/uniform/lognormal, o un dict operacion -> latencia.
+        faults(list) = Fallas a inyectar (ver Fault).
+        rate(float) = Llamadas por segundo que se atienden; las demas se
+                      responden con 429.
+        burst(int) = Llamadas que se pueden hacer de golpe con `rate`.
+        max_concurrency(int) = Llamadas simultaneas que se atienden; las
+                               demas se responden con 503.
+        strict(bool) = Si es True, SimpleQueryTx solo encuentra los pagos
+                       registrados. Por defecto inventa una transaccion
+                       aprobada para las referencias desconocidas.
+        seed = Semilla del azar de latencias y fallas.
+    """
+
+    def __init__(self, mode='realistic', host='127.0.0.1', port=0,
+                 secrets=None, hash_backend=None, latency=None, faults=(),
+                 rate=None, burst=None, max_concurrency=None, strict=False,
+                 seed=None):
+        if mode not in ('echo', 'realistic'):
+            raise ValueError('Unknown mode %r' % mode)
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.secrets = secrets
+        self.hash_backend = hash_backend or hashing.MD5()
+        self.latency = latency
+        self.faults = list(faults)
+        self.limiter = None
+        if rate:
+            self.limiter = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.strict = strict
+        self.random = random.Random(seed)
+        self.server = None
+        self.url = None
+        self.wsdl = None
+        self.description = None
+        self.transactions = dict()
+        self._refs = dict()
+        self._ids = itertools.count(100000)
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._counts = dict()
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        location = 'http://%s:%s/ws.php' % self.server.server_address
+        self.url = location + '?wsdl'
+        with open(WSDL, 'rt') as fh:
+            wsdl = re.sub(r'location="[^"]*"', 'location="%s"' % location,
+                          fh.read())
+        self.wsdl = wsdl.encode('utf-8')
+        self.description = parse_wsdl(self.wsdl)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def stats(self):
+        """Cantidad de respuestas por tipo: 'ok', 'throttled', 'busy',
+        'fault', 'invalid_hash', 'wsdl' (descargas del WSDL), etc."""
+        with self._lock:
+            return dict(self._counts, transactions=len(self.transactions))
+
+    def respond(self, data):
+        """(status, body) de la respuesta a `data`; status None corta la
+        conexion sin responder."""
+        if self.limiter is not None:
+            try:
+                self.limiter.reserve(0)
+            except RateLimited:
+                self._count('throttled')
+                return 429, b'Too Many Requests'
+        with self._lock:
+            busy = self.max_concurrency is not None and \
+                self._inflight >= self.max_concurrency
+            if not busy:
+                self._inflight += 1
+        if busy:
+            self._count('busy')
+            return 503, b'Service Unavailable'
+        try:
+            return self._respond(data)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def _respond(self, data):
+        match = OPERATION.search(data)
+        operation = match and self.description.operations.get(
+            match.group(1))
+        if operation is None:
+            self._count('unknown_operation')
+            return 500, (FAULT % ('SOAP-ENV:Client',
+                                  'Unknown operation')).encode('utf-8')
+        self._sleep(operation.name)
+        fault = self._fault(operation.name)
+        if fault is not None and fault.cod is None:
+            self._count('fault')
+            if fault.drop:
+                return None, None
+            if fault.status == 500:
+                return 500, (FAULT % ('SOAP-ENV:Server',
+                                      escape(fault.message))).encode('utf-8')
+            return fault.status, fault.message.encode('utf-8')
+
+        request = dict((name, unescape(value))
+                       for name, value in FIELD.findall(data))
+        rejected = self._check_hash(request)
+        if rejected is None and fault is not None:
+            rejected = (fault.cod, fault.message)
+        if rejected is not None:
+            self._count('rejected')
+            values = dict(request)
+            values.update(psp_ResponseCod=rejected[0],
+                          psp_ResponseMsg=rejected[1],
+                          psp_ResponseExtended=rejected[1])
+        elif self.mode == 'echo':
+            values = request
+        elif operation.name == 'SimpleQueryTx':
+            values = self.query_values(request)
+        else:
+            values = self.payment_values(request)
+        if rejected is None:
+            self._count('ok')
+        return 200, self.envelope(operation, values)
+
+    def _sleep(self, operation):
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(operation)
+        if callable(latency):
+            latency = latency(self.random)
+        if latency:
+            time.sleep(latency)
+
+    def _fault(self, operation):
+        for fault in self.faults:
+            if fault.operation not in (None, operation):
+                continue
+            if self.random.random() < fault.probability:
+                return fault
+        return None
+
+    def _check_hash(self, request):
+        """None si el secure hash es valido, o la respuesta de rechazo."""
+        if self.secrets is None:
+            return None
+        secret = self.secrets.get(request.get('psp_MerchantId'))
+        if secret is None:
+            self._count('unknown_merchant')
+            return UNKNOWN_MERCHANT
+        values = [request[name] for name in sorted(request)
+                  if name != 'psp_SecureHash']
+        expected = hashing.hash_values(values, secret, self.hash_backend)
+        if request.get('psp_SecureHash') != expected:
+            self._count('invalid_hash')
+            return INVALID_HASH
+        return None
+
+    def envelope(self, operation, values):
+        declared = self.description.types[operation.output_type]
+        body = ''.join(self.element(name, values[name])
+                       for name in declared if name in values)
+        return (ENVELOPE % (
+            self.description.namespace, operation.name,
+            operation.output_part, body, operation.output_part,
+            operation.name)).encode('utf-8')
+
+    def element(self, name, value):
+        if isinstance(value, dict):
+            value = ''.join(self.element(k, v) for k, v in value.items())
+        else:
+            value = escape(value)
+        return '<%s>%s</%s>' % (name, value, name)
+
+    def payment_values(self, request):
+        """Registra el pago. Un psp_MerchTxRef repetido del mismo merchant
+        retorna el pago ya registrado."""
+        key = (request.get('psp_MerchantId'), request.get('psp_MerchTxRef'))
+        with self._lock:
+            transaction_id = self._refs.get(key)
+            if transaction_id is None:
+                transaction_id = str(next(self._ids))
+                self._refs[key] = transaction_id
+                self.transactions[transaction_id] = \
+                    self.transaction_record(request, transaction_id)
+        values = dict(request)
+        values.update(
+            psp_ResponseCod=PAYMENT_OK[0],
+            psp_ResponseMsg=PAYMENT_OK[1],
+            psp_ResponseExtended=PAYMENT_OK[1],
+            psp_TransactionId=transaction_id,
+            psp_Session3p='%032x' % int(transaction_id),
+            psp_FrontPSP_URL='https://psp.example.com/Front3p/' +
+                             transaction_id)
+        return values
+
+    def transaction_record(self, request, transaction_id):
+        """psp_Transaction de un pago, como lo devuelve SimpleQueryTx."""
+        record = dict(
+            psp_MerchantId=request.get('psp_MerchantId', ''),
+            psp_TransactionId=transaction_id,
+            psp_MerchTxRef=request.get('psp_MerchTxRef', ''),
+            psp_MerchOrderId=request.get('psp_MerchOrderId', ''),
+            psp_Operation='PayOnLine_3p',
+            psp_Amount=request.get('psp_Amount', ''),
+            psp_NumPayments=request.get('psp_NumPayments', '1'),
+            psp_Currency=request.get('psp_Currency', '032'),
+            psp_Country=request.get('psp_Country', 'ARG'),
+            psp_Product=request.get('psp_Product', '14'),
+            psp_TxSource=request.get('psp_TxSource', 'WEB'),
+            psp_CustomerMail=request.get('psp_CustomerMail', ''),
+            psp_PurchaseDescription=request.get('psp_PurchaseDescription',
+                                                ''),
+            psp_ResponseCod='0',
+            psp_ResponseMsg='APROBADA (Autorizada)',
+            psp_ResponseExtended='APROBADA - Codigo 00',
+            psp_AuthorizationCode='123456',
+            psp_BatchNro='12',
+            psp_SequenceNumber='000123',
+            psp_TicketNumber='4567',
+            psp_CardNumber_FSD='450799',
+            psp_CardNumber_LFD='4905',
+            psp_CardExpDate='1812',
+            psp_CardHolderName='JUAN PEREZ',
+            psp_Session3p='%032x' % int(transaction_id),
+            psp_PosDateTime=request.get('psp_PosDateTime',
+                                        '2013-05-21 12:30:00'),
+            psp_CreatedAt='2013-05-21 12:30:01')
+        return dict((name, value) for name, value in record.items()
+                    if value is not None)
+
+    def find(self, request):
+        """psp_Transaction que busca una consulta, o None. Con
+        psp_QueryCriteria 'T' se busca por psp_TransactionId y si no por
+        psp_MerchTxRef."""
+        reference = request.get('psp_QueryCriteriaId', '')
+        with self._lock:
+            if request.get('psp_QueryCriteria') == 'T':
+                return self.transactions.get(reference)
+            transaction_id = self._refs.get(
+                (request.get('psp_MerchantId'), reference))
+            return self.transactions.get(transaction_id)
+
+    def query_values(self, request):
+        values = dict(request)
+        transaction = self.find(request)
+        if transaction is None:
+            if self.strict:
+                values.update(psp_ResponseCod=NOT_FOUND[0],
+                              psp_ResponseMsg=NOT_FOUND[1],
+                              psp_ResponseExtended=NOT_FOUND[1])
+                return values
+            transaction = self.transaction_record(dict(
+                psp_MerchantId=request.get('psp_MerchantId', ''),
+                psp_MerchTxRef=request.get('psp_QueryCriteriaId', ''),
+                psp_MerchOrderId='order-' + request.get(
+                    'psp_QueryCriteriaId', ''),
+                psp_Amount='15032',
+                psp_CustomerMail='customer@example.com',
+                psp_PurchaseDescription='Compra online'),
+                str(next(self._ids)))
+        values.update(psp_ResponseCod=QUERY_OK[0],
+                      psp_ResponseMsg=QUERY_OK[1],
+                      psp_ResponseExtended=QUERY_OK[1],
+                      psp_Transaction=transaction)
+        return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run a local NPS simulator.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--mode', default='realistic',
+                        choices=('realistic', 'echo'))
+    parser.add_argument('--secret', action='append', default=[],
+                        metavar='MERCHANT:SECRET',
+                        help='validate the secure hash of this merchant '
+                             '(repeatable)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='median latency in seconds')
+    parser.add_argument('--p99', type=float,
+                        help='99th percentile latency in seconds '
+                             '(log-normal); default: fixed latency')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of calls answered with a 500 fault')
+    parser.add_argument('--rate', type=float,
+                        help='calls per second before answering 429')
+    parser.add_argument('--max-concurrency', type=int,
+                        help='concurrent calls before answering 503')
+    parser.add_argument('--strict', action='store_true',
+                        help='queries only find registered payments')
+    args = parser.parse_args(argv)
+
+    secrets = None
+    if args.secret:
+        secrets = dict(entry.split(':', 1) for entry in args.secret)
+    latency = args.latency
+    if args.p99 and args.latency:
+        latency = lognormal(args.latency, args.p99)
+    faults = []
+    if args.error_rate:
+        faults.append(Fault(args.error_rate))
+    server = FakeNPS(args.mode, args.host, args.port, secrets=secrets,
+                     latency=latency, faults=faults, rate=args.rate,
+                     max_concurrency=args.max_concurrency,
+                     strict=args.strict).start()
+    sys.stdout.write('NPS simulator at %s\n' % server.url)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 *-*
+
+import asyncio
+import unittest
+
+from nps import simulator
+from nps import transactions
+from nps.aio import AsyncNPSGateway
+from nps.envelope import HTTPError
+from nps.envelope import SOAPFault
+from nps.ratelimit import AdaptiveLimiter
+
+
+def query(url, ref):
+    return transactions.SimpleQueryTx(url, 'tienda', 'secret', None, ref)
+
+
+class TestAsyncGateway(unittest.IsolatedAsyncioTestCase):
+
+    def start(self, **kwargs):
+        server = simulator.FakeNPS(**kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def gateway(self, **kwargs):
+        gateway = AsyncNPSGateway(**kwargs)
+        self.addCleanup(gateway.close)
+        return gateway
+
+    async def test_concurrency(self):
+        """Las llamadas en vuelo no pasan de `concurrency` y el WSDL se
+        descarga una sola vez aunque lleguen muchas juntas en frio."""
+
+        server = self.start(latency=simulator.fixed(0.02),
+                            max_concurrency=4)
+        gateway = self.gateway(concurrency=4)
+        done = await asyncio.gather(*[
+            gateway.process(query(server.url, 'ref%s' % i))
+            for i in range(40)])
+        self.assertTrue(all(tx.response.psp_ResponseCod ==
+                            simulator.QUERY_OK[0] for tx in done))
+        stats = server.stats()
+        self.assertEqual(stats['wsdl'], 1)
+        self.assertEqual(stats['ok'], 40)
+        self.assertNotIn('busy', stats)
+
+    async def test_connection_pool(self):
+        server = self.start(latency=simulator.fixed(0))
+        gateway = self.gateway(concurrency=4)
+        for i in range(5):
+            await gateway.process(query(server.url, 'ref%s' % i))
+        idle, = gateway.connections._idle.values()
+        self.assertEqual(len(idle), 1)
+        first = idle[0]
+        await gateway.process(query(server.url, 'ref5'))
+        self.assertIs(gateway.connections._idle.popitem()[1][0], first)
+
+        # una conexion libre que el servidor cerro se reemplaza.
+        await gateway.process(query(server.url, 'ref6'))
+        idle, = gateway.connections._idle.values()
+        idle[0].writer.close()
+        await idle[0].writer.wait_closed()
+        transaction = await gateway.process(query(server.url, 'ref7'))
+        self.assertEqual(transaction.response.psp_ResponseCod,
+                         simulator.QUERY_OK[0])
+
+    async def test_errors(self):
+        server = self.start(faults=[
+            simulator.Fault(1, operation='SimpleQueryTx')])
+        gateway = self.gateway()
+        with self.assertRaises(SOAPFault):
+            await gateway.process(query(server.url, 'ref1'))
+
+        server.faults = [simulator.Fault(1, status=503)]
+        with self.assertRaises(HTTPError) as error:
+            await gateway.process(query(server.url, 'ref1'))
+        self.assertEqual(error.exception.status, 503)
+
+        server.faults = []
+        server.latency = simulator.fixed(0.5)
+        with self.assertRaises(asyncio.TimeoutError):
+            await gateway.process(query(server.url, 'ref1'), timeout=0.05)
+
+    async def test_limiter(self):
+        """Un SOAP Fault no baja el limite del AdaptiveLimiter; un 503
+        si."""
+        server = self.start(faults=[
+            simulator.Fault(1, operation='SimpleQueryTx')])
+        limiter = AdaptiveLimiter(initial=4, tolerance=1e6)
+        gateway = self.gateway(limiter=limiter)
+        with self.assertRaises(SOAPFault):
+            await gateway.process(query(server.url, 'ref1'))
+        self.assertEqual(limiter.decreases, 0)
+
+        server.faults = [simulator.Fault(1, status=503)]
+        with self.assertRaises(HTTPError):
+            await gateway.process(query(server.url, 'ref1'))
+        self.assertEqual(limiter.decreases, 1)
+        self.assertEqual(limiter.inflight, 0)
+
+    async def test_describe_error(self):
+        """Si la descarga del WSDL falla, todas las llamadas que la
+        esperaban reciben el error y la siguiente vuelve a intentar."""
+        server = self.start()
+        gateway = self.gateway()
+        url = server.url.replace('ws.php', 'missing.php')
+        server.stop()
+        results = await asyncio.gather(
+            *[gateway.describe(url) for i in range(5)],
+            return_exceptions=True)
+        self.assertTrue(all(isinstance(result, IOError)
+                            for result in results))
+        self.assertEqual(gateway._describing, {})
+        self.assertNotIn(url, gateway.descriptions)
+
+    async def test_query_many(self):
+        server = self.start(faults=[
+            simulator.Fault(1, status=503, operation='SimpleQueryTx')])
+        gateway = self.gateway()
+        refs = ['ref%s' % i for i in range(10)]
+
+        results = dict()
+        async for ref, result in gateway.query_many(
+                refs, server.url, 'tienda', 'secret', concurrency=3,
+                retries=1, backoff=0.01):
+            results[ref] = result
+        self.assertEqual(sorted(results), refs)
+        self.assertTrue(all(isinstance(result, HTTPError)
+                            for result in results.values()))
+
+        server.faults = []
+        async for ref, result in gateway.query_many(
+                refs, server.url, 'tienda', 'secret', concurrency=3):
+            self.assertEqual(result.response.psp_ResponseCod,
+                             simulator.QUERY_OK[0])
+            self.assertEqual(result.request.psp_QueryCriteriaId, ref)
+
+    def test_sync_methods(self):
+        gateway = AsyncNPSGateway()
+        self.assertRaises(TypeError, gateway.process_batch, [])
+        self.assertRaises(TypeError, gateway.warmup, ['http://nps.test'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 *-*
+
+import threading
+import unittest
+
+from nps import transactions
+from nps.envelope import HTTPError
+from nps.gateway import NPSGateway
+from nps.merchants import Merchant
+from nps.merchants import MerchantRegistry
+from nps.merchants import UnknownMerchant
+
+
+def build(i):
+    transaction = transactions.PayOnlineTransactionThreeSteps(
+        'http://untitest.com', 'unittest', 'topsecret')
+    request = transaction.request
+    request.psp_MerchantId = 'unittest'
+    request.psp_MerchTxRef = 'ref-%s' % i
+    request.psp_Amount = '%s.00' % i
+    request.psp_ReturnURL = 'http://untitest.com/return/%s' % i
+    request.psp_CustomerMail = 'customer%s@untitest.com' % i
+    return transaction
+
+
+class TestProcessBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.gateway = NPSGateway()
+        self.calls = []
+        self.lock = threading.Lock()
+
+        def call(transaction, timer, merchant):
+            with self.lock:
+                self.calls.append(transaction)
+            if transaction.request.psp_MerchTxRef == 'ref-3':
+                raise HTTPError(502, b'Bad Gateway')
+            transaction.response.psp_ResponseCod = '0'
+
+        self.gateway._call = call
+
+    def check_hashes(self, results):
+        expected = NPSGateway()
+        for transaction, response in results:
+            self.assertEqual(transaction.request.psp_SecureHash,
+                             expected.create_secure_hash_for(transaction))
+
+    def test_stream(self):
+        """Se envian todas las transacciones, cada una con su hash, y los
+        errores se entregan en lugar de la respuesta."""
+
+        results = list(self.gateway.process_batch(
+            (build(i) for i in range(50)), concurrency=4, chunksize=7))
+        self.assertEqual(len(results), 50)
+        self.assertEqual(len(self.calls), 50)
+        by_ref = dict((tx.request.psp_MerchTxRef, response)
+                      for tx, response in results)
+        self.assertIsInstance(by_ref['ref-3'], HTTPError)
+        self.assertEqual(by_ref['ref-4'].psp_ResponseCod, '0')
+        self.check_hashes(results)
+
+    def test_workers(self):
+        """Con workers los hashes se calculan en otros procesos."""
+
+        results = list(self.gateway.process_batch(
+            (build(i) for i in range(30)), workers=2, chunksize=10))
+        self.assertEqual(len(results), 30)
+        self.check_hashes(results)
+
+    def test_backpressure(self):
+        """Si no se consumen los resultados no se leen mas transacciones
+        que max_pending."""
+
+        built = []
+
+        def source():
+            for i in range(1000):
+                built.append(i)
+                yield build(i)
+
+        batch = self.gateway.process_batch(source(), concurrency=4,
+                                           chunksize=10, max_pending=20)
+        for _ in range(5):
+            next(batch)
+        self.assertLessEqual(len(built), 25)
+        batch.close()
+        self.assertLessEqual(len(self.calls), 25)
+
+    def test_merchants(self):
+        """Las transacciones sin secret se firman con el del
+        MerchantRegistry, igual que en process()."""
+
+        registry = MerchantRegistry([
+            Merchant('unittest', 'http://untitest.com', 'topsecret')])
+        self.gateway.merchants = registry
+
+        def routed(i):
+            transaction = build(i)
+            transaction.url = transaction.secret = None
+            return transaction
+
+        single = self.gateway.process(routed(1))
+        unknown = routed(2)
+        unknown.merchant_id = 'otro'
+        results = dict((tx.request.psp_MerchTxRef, (tx, response))
+                       for tx, response in self.gateway.process_batch(
+                           [routed(1), unknown], chunksize=1))
+        batched = results['ref-1'][0]
+        self.assertEqual(batched.secret, 'topsecret')
+        self.assertEqual(batched.request.psp_SecureHash,
+                         single.request.psp_SecureHash)
+        self.assertEqual(batched.request.psp_SecureHash,
+                         NPSGateway().create_secure_hash_for(build(1)))
+        self.assertIsInstance(results['ref-2'][1], UnknownMerchant)
+
+
+if __name__ == '__main__':
+    unittest.main()
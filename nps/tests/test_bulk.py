@@ -0,0 +1,83 @@
+# -*- coding: utf-8 *-*
+
+import csv
+import io
+import unittest
+
+from nps import transactions
+from nps.bulk import BulkLoader
+
+
+CSV = '''order,email,amount,country
+ref-1,a@example.com,150.32,
+ref-2,b@example.com,12a,ARG
+ref-3,c@example.com,10,XXX
+ref 4!,d@example.com,10,
+ref-5,e@example.com
+ref-6,f@example.com,"1,000.00",ARG
+'''
+
+COLUMNS = {'order': 'psp_MerchTxRef', 'email': 'psp_CustomerMail',
+           'amount': 'psp_Amount', 'country': 'psp_Country'}
+
+
+class TestBulkLoader(unittest.TestCase):
+
+    def load(self, batch_size=2):
+        loader = BulkLoader(
+            transactions.PayOnlineTransactionThreeStepsRequest, COLUMNS,
+            batch_size)
+        return loader, list(loader.load(csv.reader(io.StringIO(CSV))))
+
+    def test_load(self):
+        """Las filas validas se cargan con los valores normalizados y los
+        defaults; las invalidas quedan en la tabla de errores."""
+
+        loader, loaded = self.load()
+        self.assertEqual([row for row, _ in loaded], [0, 5])
+        request = loaded[0][1]
+        self.assertEqual(request.psp_MerchTxRef, 'ref-1')
+        self.assertEqual(request.psp_Amount, '15032')
+        self.assertEqual(request.psp_Country, 'ARG')
+        self.assertEqual(request.psp_TxSource, 'WEB')
+        self.assertEqual(loaded[1][1].psp_Amount, '100000')
+        self.assertEqual(loader.loaded, 2)
+
+        errors = loader.errors.by_row()
+        self.assertEqual(sorted(errors), [1, 2, 3, 4])
+        self.assertEqual([field for field, _ in errors[1]], ['psp_Amount'])
+        self.assertEqual([field for field, _ in errors[2]], ['psp_Country'])
+        self.assertEqual([field for field, _ in errors[3]],
+                         ['psp_MerchTxRef'])
+        self.assertEqual(errors[4], [(None, 'Expected 4 columns, got 2')])
+        self.assertEqual(len(loader.errors), 4)
+
+    def test_matches_setitem(self):
+        """Cada request cargado es igual al armado campo por campo."""
+
+        for batch_size in (1, 3, 100):
+            _, loaded = self.load(batch_size)
+            request = transactions.PayOnlineTransactionThreeStepsRequest()
+            request['psp_MerchTxRef'] = 'ref-6'
+            request['psp_CustomerMail'] = 'f@example.com'
+            request['psp_Amount'] = '1,000.00'
+            request['psp_Country'] = 'ARG'
+            self.assertEqual(loaded[-1][1].to_dict(), request.to_dict())
+
+    def test_columns(self):
+        """load_columns recibe lotes ya en columnas; las columnas que no
+        son campos del request fallan al crear el loader."""
+
+        loader = BulkLoader(transactions.SimpleQueryTxRquest)
+        loaded = list(loader.load_columns(
+            {'psp_QueryCriteriaId': ['ref-1', 'ref!2']}, start=10))
+        self.assertEqual([row for row, _ in loaded], [10])
+        self.assertEqual(list(loader.errors)[0][:2],
+                         (11, 'psp_QueryCriteriaId'))
+        self.assertRaises(ValueError, BulkLoader,
+                          transactions.SimpleQueryTxRquest,
+                          {'ref': 'psp_Nope'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 *-*
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nps import simulator
+from nps import transactions
+from nps.cache import QueryCache
+from nps.cache import SQLiteStore
+from nps.gateway import NPSGateway
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def query(ref):
+    return transactions.SimpleQueryTx('http://nps.test/ws.php?wsdl',
+                                      'merchant', 'secret', None, ref)
+
+
+def answer(transaction, status='1', code='2'):
+    """Respuesta de NPS a la consulta: `code` es el psp_ResponseCod de la
+    consulta y `status` el de la transaccion consultada."""
+    transaction.response.psp_ResponseCod = code
+    transaction.response.psp_QueryCriteriaId = \
+        transaction.request.psp_QueryCriteriaId
+    transaction.response.user_data = dict(psp_ResponseCod=status)
+    return transaction
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_lru_and_ttl(self):
+        """Las respuestas vencen segun su estado y las menos usadas se
+        descartan al llenarse el cache."""
+
+        clock = Clock()
+        cache = QueryCache(max_size=2, ttl=10, final_ttl=100, clock=clock)
+        cache.update(answer(query('pending'), '1'))
+        cache.update(answer(query('final'), '0'))
+        self.assertTrue(cache.fetch(query('pending')))
+
+        clock.now += 50
+        self.assertFalse(cache.fetch(query('pending')))
+        cached = query('final')
+        self.assertTrue(cache.fetch(cached))
+        self.assertEqual(cached.response.user_data['psp_ResponseCod'], '0')
+
+        cache.update(answer(query('a')))
+        cache.update(answer(query('b')))
+        self.assertFalse(cache.fetch(query('final')))
+        self.assertEqual(cache.stats(), dict(
+            hits=2, misses=2, evictions=1, expirations=1, store_hits=0,
+            size=2))
+
+        # las respuestas de error no se guardan.
+        self.assertFalse(cache.update(answer(query('missing'), code='3')))
+        self.assertFalse(cache.fetch(query('missing')))
+
+    def test_sqlite_store(self):
+        """Un cache nuevo encuentra lo que guardo otro en el mismo
+        store."""
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'cache.db')
+        first = QueryCache(store=SQLiteStore(path))
+        first.update(answer(query('ref1')))
+
+        second = QueryCache(store=SQLiteStore(path))
+        cached = query('ref1')
+        self.assertTrue(second.fetch(cached))
+        self.assertEqual(cached.response.psp_QueryCriteriaId, 'ref1')
+        self.assertEqual(second.stats()['store_hits'], 1)
+        first.store.close()
+        second.store.close()
+
+    def test_gateway(self):
+        """El gateway solo consulta a NPS si la respuesta no esta en el
+        cache, y solo para transacciones idempotentes."""
+
+        calls = []
+
+        def process(transaction, timer=None, merchant=None):
+            calls.append(transaction)
+            transaction.response.psp_ResponseCod = '2'
+
+        gateway = NPSGateway(cache=QueryCache())
+        gateway._process_suds = process
+
+        gateway.process(query('ref1'))
+        transaction = gateway.process(query('ref1'))
+        self.assertEqual(transaction.response.psp_ResponseCod, '2')
+        self.assertEqual(len(calls), 1)
+
+        payment = transactions.PayOnlineTransactionThreeSteps(
+            'http://nps.test/ws.php?wsdl', 'merchant', 'secret')
+        gateway.process(payment)
+        gateway.process(payment)
+        self.assertEqual(len(calls), 3)
+
+    def test_suds_engine(self):
+        """Con el engine 'suds', el psp_Transaction se guarda como dict
+        (tambien en el store) y las consultas fallidas no se guardan."""
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        server = simulator.FakeNPS().start()
+        self.addCleanup(server.stop)
+        clock = Clock()
+        cache = QueryCache(ttl=10, final_ttl=100, clock=clock,
+                           store=SQLiteStore(os.path.join(tmpdir, 'db')))
+        self.addCleanup(cache.store.close)
+        gateway = NPSGateway(cache=cache)
+
+        first = gateway.process(transactions.SimpleQueryTx(
+            server.url, 'tienda', 'secret', None, 'ref1'))
+        transaction_id = first.response.user_data.psp_TransactionId
+        clock.now += 50
+        cache.clear()
+        cached = gateway.process(transactions.SimpleQueryTx(
+            server.url, 'tienda', 'secret', None, 'ref1'))
+        self.assertEqual(cached.response.user_data['psp_TransactionId'],
+                         transaction_id)
+        self.assertEqual(cached.response.psp_ResponseCod,
+                         simulator.QUERY_OK[0])
+        self.assertEqual(cache.stats()['store_hits'], 1)
+
+        server.strict = True
+        for i in range(2):
+            missing = gateway.process(transactions.SimpleQueryTx(
+                server.url, 'tienda', 'secret', None, 'ref2'))
+            self.assertEqual(missing.response.psp_ResponseCod,
+                             simulator.NOT_FOUND[0])
+        self.assertEqual(server.stats()['ok'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 *-*
+
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from nps import codegen
+from nps import fields
+from nps import hashing
+from nps import transactions
+from nps import wsdl
+from nps.simulator import WSDL
+
+
+def describe(descriptor):
+    """Tipo y parametros de un field, para comparar dos definiciones."""
+    params = dict(vars(descriptor))
+    params.pop('index', None)
+    if params.get('in_') is not None:
+        params['in_'] = tuple(params['in_'])
+    return type(descriptor), params
+
+
+def load(code):
+    module = types.ModuleType('nps_operations')
+    exec(compile(code, 'nps_operations.py', 'exec'), module.__dict__)
+    return module
+
+
+class TestCodegen(unittest.TestCase):
+
+    def setUp(self):
+        with open(WSDL, 'rb') as fh:
+            self.description = wsdl.parse_wsdl(fh.read())
+        self.module = load(codegen.generate(self.description))
+
+    def test_classes(self):
+        """Una clase por operacion, con los campos del WSDL y los mismos
+        fields que las clases escritas a mano."""
+
+        payment = self.module.PayOnLine_3p('http://nps.test/ws.php?wsdl',
+                                           'merchant', 'secret')
+        self.assertEqual(payment.factory, 'RequerimientoStruct_PayOnLine_3p')
+        self.assertEqual(
+            payment.request.schema.names,
+            self.description.types['RequerimientoStruct_PayOnLine_3p'])
+        self.assertEqual(payment.request.psp_MerchantId, 'merchant')
+        self.assertEqual(payment.request.psp_Country, 'ARG')
+        handwritten = transactions.PayOnlineTransactionThreeStepsRequest
+        for name, descriptor in zip(payment.request.schema.names,
+                                    payment.request.schema.descriptors):
+            self.assertIs(type(descriptor),
+                          type(getattr(handwritten, name)), name)
+        self.assertFalse(getattr(payment, 'idempotent', False))
+
+        query = self.module.SimpleQueryTx
+        self.assertTrue(query.idempotent)
+        self.assertNotIn('psp_Transaction',
+                         query.response_class.schema.name_set)
+
+    def test_handwritten_fields(self):
+        """Las tablas de codegen no se apartan de nps.transactions: los
+        campos de las clases escritas a mano que estan en el WSDL se
+        generan igual."""
+
+        url = 'http://nps.test/ws.php?wsdl'
+        for generated, handwritten in (
+                (self.module.PayOnLine_3p,
+                 transactions.PayOnlineTransactionThreeSteps(
+                     url, 'merchant', None)),
+                (self.module.SimpleQueryTx,
+                 transactions.SimpleQueryTx(url, 'merchant', None, None,
+                                            'ref1'))):
+            for side in ('request', 'response'):
+                schema = getattr(generated, side + '_class').schema
+                expected = getattr(handwritten, side).schema
+                for name, descriptor in zip(expected.names,
+                                            expected.descriptors):
+                    if name not in schema.name_set:
+                        continue
+                    self.assertEqual(
+                        describe(schema.descriptors[
+                            schema.names.index(name)]),
+                        describe(descriptor), '%s %s.%s' % (
+                            generated.method, side, name))
+            self.assertEqual(
+                generated.method in codegen.IDEMPOTENT_OPERATIONS,
+                getattr(handwritten, 'idempotent', False))
+
+    def test_secure_hash(self):
+        generated = self.module.PayOnLine_3p('http://nps.test/ws.php?wsdl',
+                                             'merchant', 'secret')
+        handwritten = transactions.PayOnlineTransactionThreeSteps(
+            'http://nps.test/ws.php?wsdl', 'merchant', 'secret')
+        for transaction in (generated, handwritten):
+            transaction.request.psp_MerchantId = 'merchant'
+            transaction.request.psp_MerchTxRef = 'ref1'
+            transaction.request.psp_Amount = '150.32'
+        backend = hashing.MD5()
+        self.assertEqual(hashing.secure_hash(generated, backend),
+                         hashing.secure_hash(handwritten, backend))
+
+    def test_field_for(self):
+        self.assertEqual(codegen.field_for('psp_CancelURL', {}),
+                         'fields.Url()')
+        self.assertEqual(codegen.field_for('psp_Other', {}),
+                         codegen.DEFAULT_FIELD)
+        self.assertEqual(codegen.class_name('3D-Secure'), 'Op_3D_Secure')
+        self.assertIsInstance(eval(codegen.DEFAULT_FIELD), fields.Text)
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'nps_operations.py')
+            codegen.main([WSDL, '-o', path, '--operation', 'SimpleQueryTx'])
+            with open(path) as fh:
+                module = load(fh.read())
+            self.assertTrue(hasattr(module, 'SimpleQueryTx'))
+            self.assertFalse(hasattr(module, 'PayOnLine_3p'))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
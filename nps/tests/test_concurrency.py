@@ -0,0 +1,53 @@
+# -*- coding: utf-8 *-*
+
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nps import transactions
+from nps.gateway import NPSGateway
+
+
+def build(i):
+    transaction = transactions.PayOnlineTransactionThreeSteps(
+        'http://untitest.com', 'unittest', 'topsecret')
+    request = transaction.request
+    request.psp_MerchantId = 'unittest'
+    request.psp_MerchTxRef = 'ref-%s' % i
+    request.psp_Amount = '%s.00' % i
+    request.psp_ReturnURL = 'http://untitest.com/return/%s' % i
+    request.psp_CustomerMail = 'customer%s@untitest.com' % i
+    request.psp_PosDateTime = '2014-01-01 10:00:%02d' % (i % 60)
+    request.psp_SecureHash = NPSGateway().create_secure_hash_for(transaction)
+    return i, transaction
+
+
+class TestConcurrentTransactions(unittest.TestCase):
+
+    def test_parallel_build(self):
+        """Las transacciones armadas en paralelo no comparten valores."""
+
+        barrier = threading.Barrier(8)
+
+        def task(i):
+            if i < 8:
+                barrier.wait()
+            return build(i)
+
+        with ThreadPoolExecutor(8) as executor:
+            built = list(executor.map(task, range(500)))
+
+        for i, transaction in built:
+            request = transaction.request
+            self.assertEqual(request.psp_ReturnURL,
+                             'http://untitest.com/return/%s' % i)
+            self.assertEqual(request.psp_CustomerMail,
+                             'customer%s@untitest.com' % i)
+            self.assertEqual(request.psp_PosDateTime[-2:], '%02d' % (i % 60))
+            self.assertEqual(request.psp_SecureHash,
+                             build(i)[1].request.psp_SecureHash)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 *-*
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from nps import config
+from nps.gateway import NPSGateway
+from nps.merchants import MerchantRegistry
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_frozen(self):
+        """Las listas quedan como frozensets que conservan el orden y el
+        snapshot no se puede modificar."""
+
+        snapshot = config.Snapshot(dict(
+            ALLOWED=['WEB', 'IVR', 'WEB'], MERCHANTS=dict(m=dict(url='u'))))
+        self.assertIsInstance(snapshot.ALLOWED, frozenset)
+        self.assertEqual(list(snapshot.ALLOWED), ['WEB', 'IVR'])
+        self.assertEqual(repr(snapshot.ALLOWED), "('WEB', 'IVR')")
+        self.assertEqual(snapshot.MERCHANTS.m.url, 'u')
+        self.assertIsNone(snapshot.MISSING)
+        self.assertRaises(AttributeError, setattr, snapshot, 'ALLOWED', ())
+
+
+class TestReload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'pynps.yaml')
+        self.write('ALLOWED_COUNTRIES: [ARG]\n', 1000)
+        self.settings = config.LazySettings(self.path)
+
+    def tearDown(self):
+        self.settings.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, text, mtime):
+        with open(self.path, 'wt') as fh:
+            fh.write(text)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_check(self):
+        """check() recarga solo si el archivo cambio y reemplaza el
+        snapshot entero."""
+
+        old = self.settings.snapshot()
+        self.assertEqual(list(self.settings.ALLOWED_COUNTRIES), ['ARG'])
+        self.assertEqual(self.settings.ALLOWED_TX_SOURCES[0], 'WEB')
+        self.assertFalse(self.settings.check())
+
+        reloaded = []
+        self.settings.subscribe(reloaded.append)
+        self.write('ALLOWED_COUNTRIES: [ARG, URY]\n', 2000)
+        self.assertTrue(self.settings.check())
+        self.assertIn('URY', self.settings.ALLOWED_COUNTRIES)
+        self.assertEqual(list(old.ALLOWED_COUNTRIES), ['ARG'])
+        self.assertEqual(reloaded, [self.settings.snapshot()])
+
+        # un archivo invalido deja la configuracion anterior
+        self.write('ALLOWED_COUNTRIES: [ARG\n', 3000)
+        self.assertRaises(Exception, self.settings.check)
+        self.assertIn('URY', self.settings.ALLOWED_COUNTRIES)
+
+    def test_setting(self):
+        """Setting lee el Snapshot una vez por reload."""
+
+        countries = config.Setting('ALLOWED_COUNTRIES', self.settings)
+        self.assertEqual(list(countries), ['ARG'])
+        snapshot = self.settings.snapshot
+        reads = []
+
+        def counted():
+            reads.append(1)
+            return snapshot()
+
+        self.settings.snapshot = counted
+        self.assertIn('ARG', countries)
+        self.assertNotIn('URY', countries)
+        self.assertEqual(list(countries), ['ARG'])
+        self.assertEqual(reads, [])
+
+        self.write('ALLOWED_COUNTRIES: [ARG, URY]\n', 2000)
+        self.settings.reload()
+        self.assertIn('URY', countries)
+        self.assertEqual(len(countries), 2)
+        self.assertEqual(len(reads), 1)
+
+    def test_watch(self):
+        self.settings.snapshot()
+        done = threading.Event()
+        self.settings.subscribe(lambda snapshot: done.set())
+        self.settings.watch(0.01)
+        self.write('ALLOWED_COUNTRIES: [MEX]\n', 2000)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(list(self.settings.ALLOWED_COUNTRIES), ['MEX'])
+
+    def test_merchants(self):
+        """MerchantRegistry.reload toma los merchants nuevos y conserva los
+        que no cambiaron, y el gateway rearma los pools de los que
+        cambiaron."""
+
+        self.write('MERCHANTS:\n'
+                   '  a: {url: "http://a", secret: s, rate: 5}\n'
+                   '  b: {url: "http://b", secret: s}\n', 2000)
+        registry = MerchantRegistry.from_settings(self.settings)
+        a = registry.get('a')
+        gateway = NPSGateway(merchants=registry)
+        pools_a = gateway.pools_for(a)
+        pools_b = gateway.pools_for(registry.get('b'))
+        self.settings.subscribe(registry.reload)
+        self.write('MERCHANTS:\n'
+                   '  a: {url: "http://a", secret: s, rate: 5}\n'
+                   '  b: {url: "http://b", secret: t, pool_size: 2}\n'
+                   '  c: {url: "http://c", secret: s}\n', 3000)
+        self.settings.check()
+        self.assertIs(registry.get('a'), a)
+        self.assertEqual(registry.get('b').secret, 't')
+        self.assertIn('c', registry)
+
+        self.assertIs(gateway.pools_for(registry.get('a')), pools_a)
+        reloaded = gateway.pools_for(registry.get('b'))
+        self.assertIsNot(reloaded, pools_b)
+        self.assertEqual(reloaded[0].max_size, 2)
+        self.assertIs(gateway.pools_for(registry.get('b')), reloaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
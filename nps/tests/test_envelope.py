@@ -0,0 +1,75 @@
+# -*- coding: utf-8 *-*
+
+import unittest
+
+from nps import envelope
+from nps import transactions
+
+
+RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope'
+    ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"'
+    ' xmlns:ns1="http://ws.nps.test/"><SOAP-ENV:Body>'
+    '<ns1:SimpleQueryTxResponse><Respuesta>'
+    '<psp_ResponseCod>2</psp_ResponseCod>'
+    '<psp_ResponseMsg>Consulta &amp; respuesta</psp_ResponseMsg>'
+    '<psp_Transaction><psp_Amount>1000</psp_Amount>'
+    '<psp_ResponseCod>9</psp_ResponseCod>'
+    '<psp_Detail><psp_Item>x</psp_Item></psp_Detail></psp_Transaction>'
+    '<psp_Unknown>z</psp_Unknown>'
+    '<psp_MerchantId>merchant</psp_MerchantId>'
+    '</Respuesta></ns1:SimpleQueryTxResponse>'
+    '</SOAP-ENV:Body></SOAP-ENV:Envelope>').encode('utf-8')
+
+FAULT = (
+    '<SOAP-ENV:Envelope'
+    ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<SOAP-ENV:Body><SOAP-ENV:Fault><faultcode>SOAP-ENV:Server</faultcode>'
+    '<faultstring>Invalid hash</faultstring></SOAP-ENV:Fault>'
+    '</SOAP-ENV:Body></SOAP-ENV:Envelope>').encode('utf-8')
+
+
+class TestResponseParser(unittest.TestCase):
+
+    def parse(self, data, size, transaction_data=False):
+        response = transactions.SimpleQueryTxResponse()
+        parser = envelope.ResponseParser(response, transaction_data)
+        for i in range(0, len(data), size):
+            parser.feed(data[i:i + size])
+        return parser.close()
+
+    def test_fields(self):
+        """Se completan los campos declarados, sin importar como llegue
+        partido el envelope, y se saltea psp_Transaction."""
+
+        for size in (1, 7, len(RESPONSE)):
+            response = self.parse(RESPONSE, size)
+            self.assertEqual(response.psp_ResponseCod, '2')
+            self.assertEqual(response.psp_ResponseMsg,
+                             'Consulta & respuesta')
+            self.assertEqual(response.psp_MerchantId, 'merchant')
+            self.assertFalse(hasattr(response, 'user_data'))
+
+    def test_transaction_data(self):
+        """Con transaction_data, psp_Transaction queda en user_data."""
+
+        response = self.parse(RESPONSE, 5, transaction_data=True)
+        self.assertEqual(response.psp_ResponseCod, '2')
+        self.assertEqual(response.user_data, {'psp_Amount': '1000',
+                                              'psp_ResponseCod': '9',
+                                              'psp_Detail': None})
+
+    def test_errors(self):
+        """Un Fault levanta SOAPFault; algo que no es un envelope,
+        ValueError."""
+
+        with self.assertRaises(envelope.SOAPFault) as ctx:
+            self.parse(FAULT, 16)
+        self.assertEqual(ctx.exception.faultstring, 'Invalid hash')
+        with self.assertRaises(ValueError):
+            self.parse(b'<html><body>502</body></html>', 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 *-*
+
+import unittest
+
+from nps import fields
+
+
+class TestValidateMany(unittest.TestCase):
+
+    def assertSameAsClean(self, field, values):
+        """validate_many debe coincidir con clean valor por valor."""
+
+        cleaned, errors = field.validate_many(values)
+        errors = dict(errors)
+        for position, value in enumerate(values):
+            try:
+                expected = field.clean(value)
+            except (ValueError, TypeError, AttributeError) as exc:
+                self.assertEqual(errors.get(position), str(exc))
+                self.assertIsNone(cleaned[position])
+            else:
+                self.assertNotIn(position, errors)
+                self.assertEqual(cleaned[position], expected)
+
+    def test_alfa_family(self):
+        values = ['abc', 'ab c', 'ab_c', 'ab-c.d', '', 'ñandu', 'x' * 20,
+                  'abc123']
+        for cls in (fields.Alfa, fields.Alfanumeric, fields.Order,
+                    fields.MerchantId):
+            self.assertSameAsClean(cls(max_length=14), values)
+            self.assertSameAsClean(cls(max_length=14), ['abc', 'def'])
+
+    def test_text_and_amount(self):
+        self.assertSameAsClean(fields.Amount(max_length=5),
+                               ['105.05', '1,00', 'abc', '123456', ''])
+        self.assertSameAsClean(fields.Country(length=3, in_=('ARG', 'URY')),
+                               ['ARG', 'BRA', 'AR', 'URY'])
+        self.assertSameAsClean(fields.Numeric(max_length=3), ['12', None])
+
+    def test_md5(self):
+        field = fields.MD5()
+        self.assertTrue(field.is_md5('0123456789abcdef' * 2))
+        self.assertFalse(field.is_md5('0123456789abcdeg' * 2))
+        self.assertFalse(field.is_md5('0123456789abcdef'))
+
+    def test_secure_hash(self):
+        field = fields.SecureHash()
+        for length in (32, 40, 64, 128):
+            self.assertTrue(field.is_digest('a' * length))
+        self.assertFalse(field.is_digest('g' * 32))
+        self.assertFalse(field.is_digest('a' * 33))
+        self.assertRaises(ValueError, field.clean, 'a' * 31)
+
+
+if __name__ == '__main__':
+    unittest.main()
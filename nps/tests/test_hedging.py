@@ -0,0 +1,190 @@
+# -*- coding: utf-8 *-*
+
+import threading
+import unittest
+
+from nps import transactions
+from nps.breaker import CircuitBreaker
+from nps.breaker import CircuitOpen
+from nps.envelope import HTTPError
+from nps.envelope import SOAPFault
+from nps.gateway import NPSGateway
+from nps.hedging import Hedging
+from nps.ratelimit import AdaptiveLimiter
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def query(ref='ref1'):
+    return transactions.SimpleQueryTx('http://nps.test/ws.php?wsdl',
+                                      'merchant', 'secret', None, ref)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_and_probe(self):
+        """Despues de varias fallas de red el circuito se abre; pasado el
+        reset_timeout deja pasar una sola llamada de prueba."""
+
+        clock = Clock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10,
+                                 clock=clock)
+        breaker.allow()
+        breaker.failure(SOAPFault('Server', 'error'))
+        breaker.failure(HTTPError(503, b''))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.failure(HTTPError(503, b''))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpen, breaker.allow)
+
+        clock.now += 10
+        breaker.allow()
+        self.assertRaises(CircuitOpen, breaker.allow)
+        breaker.failure(HTTPError(503, b''))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        clock.now += 10
+        breaker.allow()
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.allow()
+
+    def test_gateway(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        gateway = NPSGateway(breaker=breaker)
+        calls = []
+
+        def call(transaction, timer, merchant):
+            calls.append(transaction)
+            raise HTTPError(502, b'Bad Gateway')
+
+        gateway._call = call
+        self.assertRaises(HTTPError, gateway.process, query())
+        self.assertRaises(CircuitOpen, gateway.process, query())
+        self.assertEqual(len(calls), 1)
+
+
+class TestHedging(unittest.TestCase):
+
+    def test_delay(self):
+        hedging = Hedging(percentile=0.9, min_samples=10, min_delay=0,
+                          budget=0.25)
+        self.assertIsNone(hedging.delay())
+        for i in range(10):
+            hedging.record(i / 10.0)
+        self.assertEqual(hedging.delay(), 0.8)
+        hedging.hedged()
+        self.assertIsNone(hedging.delay())
+
+    def test_gateway(self):
+        """Si la consulta se demora se manda un duplicado y se usa su
+        respuesta; los pagos nunca se duplican."""
+
+        hedging = Hedging(min_samples=1, min_delay=0.01)
+        hedging.record(0.001)
+        gateway = NPSGateway(hedging=hedging)
+        release = threading.Event()
+        attempts = []
+
+        def call(transaction, timer, merchant):
+            attempts.append(transaction)
+            if len(attempts) == 1:
+                release.wait(5)
+                transaction.response.psp_ResponseMsg = 'slow'
+            else:
+                transaction.response.psp_ResponseMsg = 'fast'
+
+        gateway._call_engine = call
+        transaction = gateway.process(query())
+        release.set()
+        self.assertEqual(transaction.response.psp_ResponseMsg, 'fast')
+        self.assertEqual(len(attempts), 2)
+        self.assertIsNot(attempts[0].response, attempts[1].response)
+        self.assertEqual(hedging.stats()['wins'], 1)
+
+        del attempts[:]
+        release.clear()
+        payment = transactions.PayOnlineTransactionThreeSteps(
+            'http://nps.test/ws.php?wsdl', 'merchant', 'secret')
+        payment.request.psp_MerchantId = 'merchant'
+        threading.Timer(0.05, release.set).start()
+        gateway.process(payment)
+        self.assertEqual(len(attempts), 1)
+
+    def test_limiter(self):
+        """El lugar en el limiter se devuelve cuando termina el intento
+        que perdio, no cuando llega la primera respuesta."""
+
+        hedging = Hedging(min_samples=1, min_delay=0.01)
+        hedging.record(0.001)
+        limiter = AdaptiveLimiter(initial=1)
+        gateway = NPSGateway(hedging=hedging, limiter=limiter)
+        release = threading.Event()
+        finished = threading.Event()
+        attempts = []
+
+        def call(transaction, timer, merchant):
+            attempts.append(transaction)
+            if len(attempts) == 1:
+                release.wait(5)
+                finished.set()
+            transaction.response.psp_ResponseCod = '2'
+
+        gateway._call_engine = call
+        gateway.process(query())
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(limiter.inflight, 1)
+        release.set()
+        self.assertTrue(finished.wait(5))
+        gateway._hedge_executor.shutdown(wait=True)
+        self.assertEqual(limiter.inflight, 0)
+
+    def test_busy_workers(self):
+        """Con los threads ocupados por un intento colgado las llamadas
+        nuevas no esperan detras: se hacen en el thread que llama, sin
+        duplicado."""
+
+        hedging = Hedging(min_samples=1, min_delay=0.01, workers=1)
+        hedging.record(0.001)
+        gateway = NPSGateway(hedging=hedging)
+        release = threading.Event()
+        threads = []
+
+        def call(transaction, timer, merchant):
+            threads.append(threading.current_thread())
+            if len(threads) == 1:
+                release.wait(5)
+            transaction.response.psp_ResponseCod = '2'
+
+        gateway._call_engine = call
+        hung = threading.Thread(target=gateway.process, args=(query(),))
+        hung.start()
+        while not threads:
+            release.wait(0.01)
+        transaction = gateway.process(query('ref2'))
+        self.assertEqual(transaction.response.psp_ResponseCod, '2')
+        self.assertIs(threads[1], threading.current_thread())
+        self.assertEqual(hedging.stats()['hedges'], 0)
+        release.set()
+        hung.join(5)
+        self.assertEqual(len(threads), 2)
+
+    def test_limiter_workers(self):
+        hedging = Hedging(min_samples=1, workers=1)
+        hedging.record(0.001)
+        gateway = NPSGateway(hedging=hedging, limiter=AdaptiveLimiter(
+            initial=2, max_limit=3))
+        gateway._call_engine = lambda transaction, timer, merchant: None
+        gateway.process(query())
+        self.assertEqual(gateway._hedge_executor._max_workers, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 *-*
+
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+# Presupuesto para `import nps`, en microsegundos. Se puede ajustar con la
+# variable de entorno NPS_IMPORT_BUDGET_US.
+BUDGET_US = int(os.environ.get('NPS_IMPORT_BUDGET_US', 100000))
+
+
+class TestImportTime(unittest.TestCase):
+
+    def run_import(self, code):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        return subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            env=env, cwd=ROOT, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    def test_heavy_modules_are_lazy(self):
+        """`import nps` no carga suds ni yaml."""
+
+        result = self.run_import(
+            'import sys, nps; print(" ".join(sorted(sys.modules)))')
+        modules = result.stdout.split()
+        self.assertNotIn('suds', modules)
+        self.assertNotIn('yaml', modules)
+
+    def test_import_budget(self):
+        """`python -X importtime -c "import nps"` dentro del presupuesto."""
+
+        result = self.run_import('import nps')
+        cumulative = None
+        for line in result.stderr.splitlines():
+            parts = line.split('|')
+            if len(parts) == 3 and parts[2].rstrip() == ' nps':
+                cumulative = int(parts[1])
+        self.assertIsNotNone(cumulative)
+        self.assertLess(cumulative, BUDGET_US)
+
+
+if __name__ == '__main__':
+    unittest.main()
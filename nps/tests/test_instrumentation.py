@@ -0,0 +1,86 @@
+# -*- coding: utf-8 *-*
+
+import unittest
+
+from nps import transactions
+from nps.gateway import NPSGateway
+from nps.instrumentation import CallbackExporter
+from nps.instrumentation import Collector
+from nps.instrumentation import Timer
+from nps.merchants import Merchant
+from nps.merchants import MerchantRegistry
+from nps.ratelimit import TokenBucket
+
+
+class TestCollector(unittest.TestCase):
+
+    def test_percentiles(self):
+        """p50/p95/p99 por metodo y fase."""
+
+        collector = Collector()
+        for i in range(1, 101):
+            timer = Timer('SimpleQueryTx')
+            timer.phases.append(('network', i / 1000.0))
+            collector.record(timer, None if i % 10 else IOError())
+        phases = collector.report()['SimpleQueryTx']['phases']
+        self.assertEqual(phases['network']['count'], 100)
+        self.assertEqual(phases['network']['p50'], 0.051)
+        self.assertEqual(phases['network']['p95'], 0.095)
+        self.assertEqual(phases['network']['p99'], 0.099)
+        counters = collector.report()['SimpleQueryTx']['counters']
+        self.assertEqual(counters, {'calls': 100, 'errors': 10})
+
+    def test_gateway(self):
+        """El gateway marca cada fase y llama a los hooks, tambien
+        cuando la transaccion falla."""
+
+        calls = []
+
+        class Hooks(Collector):
+
+            def before(self, transaction):
+                calls.append(('before', transaction.method))
+
+            def after(self, transaction, timer, error):
+                calls.append(('after', type(error).__name__))
+
+        def process(transaction, timer=None, merchant=None):
+            timer.mark('call')
+            if transaction.request.psp_QueryCriteriaId == 'fail':
+                raise IOError('timeout')
+
+        reports = []
+        collector = Hooks(exporters=[CallbackExporter(reports.append)])
+        # con el rate limit del merchant y el del gateway la fase
+        # 'ratelimit' se cuenta una vez por llamada.
+        gateway = NPSGateway(
+            instrumentation=collector, rate_limiter=TokenBucket(1000),
+            merchants=MerchantRegistry([Merchant(
+                'merchant', 'http://nps.test/ws.php?wsdl', 'secret',
+                rate=1000)]))
+        gateway._process_suds = process
+        for ref in ('ok', 'fail'):
+            transaction = transactions.SimpleQueryTx(
+                'http://nps.test/ws.php?wsdl', 'merchant', 'secret', None,
+                ref)
+            try:
+                gateway.process(transaction)
+            except IOError:
+                pass
+
+        self.assertEqual(calls, [('before', 'SimpleQueryTx'),
+                                 ('after', 'NoneType'),
+                                 ('before', 'SimpleQueryTx'),
+                                 ('after', 'OSError')])
+        report = collector.flush()
+        self.assertEqual(reports, [report])
+        entry = report['SimpleQueryTx']
+        self.assertEqual(sorted(entry['phases']),
+                         ['call', 'hash', 'ratelimit', 'total'])
+        self.assertEqual(entry['phases']['ratelimit']['count'], 2)
+        self.assertEqual(entry['counters'], {'calls': 2, 'errors': 1})
+        self.assertEqual(collector.report(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
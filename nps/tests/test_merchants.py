@@ -0,0 +1,62 @@
+# -*- coding: utf-8 *-*
+
+import unittest
+
+from nps import transactions
+from nps.config import Dict2Object
+from nps.gateway import NPSGateway
+from nps.merchants import Merchant
+from nps.merchants import MerchantRegistry
+from nps.merchants import UnknownMerchant
+
+
+class TestMerchantRegistry(unittest.TestCase):
+
+    def test_from_settings(self):
+        settings = Dict2Object(dict(MERCHANTS=dict(
+            tienda_1=dict(url='http://nps.test/a?wsdl', secret='s1',
+                          pool_size=2, rate=5),
+            tienda_2=dict(url='http://nps.test/b?wsdl', secret='s2'))))
+        registry = MerchantRegistry.from_settings(settings)
+        self.assertEqual(len(registry), 2)
+        first = registry.get('tienda_1')
+        self.assertEqual(first.pool_size, 2)
+        self.assertEqual(first.limiter.rate, 5)
+        self.assertIsNone(registry.get('tienda_2').limiter)
+        self.assertRaises(UnknownMerchant, registry.get, 'tienda_3')
+
+    def test_route(self):
+        """Las transacciones de un merchant registrado toman su url y su
+        secret; las de uno desconocido necesitan traer los propios."""
+
+        registry = MerchantRegistry([
+            Merchant('tienda_1', 'http://nps.test/a?wsdl', 's1')])
+        transaction = transactions.SimpleQueryTx(None, 'tienda_1', None,
+                                                 None, 'ref1')
+        merchant = registry.route(transaction)
+        self.assertEqual(merchant.merchant_id, 'tienda_1')
+        self.assertEqual(transaction.url, 'http://nps.test/a?wsdl')
+        self.assertEqual(transaction.secret, 's1')
+
+        own = transactions.SimpleQueryTx('http://nps.test/c?wsdl', 'otra',
+                                         'secret', None, 'ref1')
+        self.assertIsNone(registry.route(own))
+        anonymous = transactions.SimpleQueryTx(None, 'otra', None, None,
+                                               'ref1')
+        self.assertRaises(UnknownMerchant, registry.route, anonymous)
+
+    def test_isolated_pools(self):
+        registry = MerchantRegistry([
+            Merchant('tienda_1', 'http://nps.test/a?wsdl', 's1', pool_size=2),
+            Merchant('tienda_2', 'http://nps.test/b?wsdl', 's2')])
+        gateway = NPSGateway(merchants=registry)
+        first = gateway.pools_for(registry.get('tienda_1'))
+        self.assertIs(first, gateway.pools_for(registry.get('tienda_1')))
+        self.assertIsNot(first, gateway.pools_for(registry.get('tienda_2')))
+        self.assertEqual(first[0].max_size, 2)
+        self.assertEqual(gateway.pools_for(None),
+                         (gateway.pool, gateway.connections))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 *-*
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nps import outbox
+from nps import simulator
+from nps import transactions
+from nps.envelope import SOAPFault
+from nps.gateway import NPSGateway
+from nps.merchants import Merchant
+from nps.merchants import MerchantRegistry
+from nps.outbox import Outbox
+from nps.ratelimit import RateLimited
+
+URL = 'http://nps.test/ws.php?wsdl'
+
+
+def payment(ref, url=URL):
+    transaction = transactions.PayOnlineTransactionThreeSteps(
+        url, 'merchant', None)
+    transaction.request.psp_MerchantId = 'merchant'
+    transaction.request.psp_MerchTxRef = ref
+    transaction.request.psp_Amount = '150.32'
+    return transaction
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'outbox.db')
+        self.gateway = NPSGateway(merchants=MerchantRegistry([
+            Merchant('merchant', URL, 'secret')]))
+        self.sent = []
+        self.nps = dict()
+        self.gateway._call = self.call
+        self.outboxes = []
+
+    def tearDown(self):
+        for box in self.outboxes:
+            box.close()
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        box = Outbox(self.path, self.gateway)
+        self.outboxes.append(box)
+        return box
+
+    def call(self, transaction, timer, merchant):
+        """NPS de mentira: self.nps dice que hacer con cada referencia."""
+        self.assertEqual(transaction.secret, 'secret')
+        if transaction.method == 'SimpleQueryTx':
+            ref = transaction.request.psp_QueryCriteriaId
+            answer = self.nps.get(ref)
+            if isinstance(answer, Exception):
+                raise answer
+            transaction.response.user_data = answer
+            return
+        ref = transaction.request.psp_MerchTxRef
+        self.sent.append(ref)
+        action = self.nps.get(ref)
+        if isinstance(action, Exception):
+            raise action
+        self.nps[ref] = dict(psp_MerchTxRef=ref)
+        transaction.response.psp_ResponseCod = '1'
+        transaction.response.psp_MerchTxRef = ref
+
+    def test_submit_and_dispatch(self):
+        box = self.open()
+        entry_id = box.submit(payment('ref1'))
+        self.assertEqual(box.submit(payment('ref1')), entry_id)
+        self.assertEqual(box.get(entry_id).state, outbox.PENDING)
+
+        self.assertEqual(box.dispatch(), 1)
+        entry = box.get(entry_id)
+        self.assertEqual(entry.state, outbox.DONE)
+        self.assertEqual(entry.response['psp_ResponseCod'], '1')
+        self.assertEqual(self.sent, ['ref1'])
+        self.assertEqual(box.dispatch(), 0)
+
+    def test_errors(self):
+        box = self.open()
+        self.nps['rejected'] = SOAPFault('Server', 'Invalid')
+        self.nps['limited'] = RateLimited('slow down')
+        self.nps['lost'] = IOError('timed out')
+        # la respuesta no se pudo leer: NPS pudo haberla procesado
+        self.nps['unparsed'] = ValueError('bad response')
+        refs = ('rejected', 'limited', 'lost', 'unparsed', 'invalid')
+        ids = [box.submit(payment(ref)) for ref in refs]
+        # el pedido guardado no pasa la validacion al armarlo: no sale
+        box._write(lambda conn: conn.execute(
+            'UPDATE outbox SET request = ? WHERE id = ?',
+            ('{"psp_Amount": "abc"}', ids[-1])))
+        box.dispatch()
+        self.assertEqual([box.get(i).state for i in ids],
+                         [outbox.FAILED, outbox.PENDING, outbox.IN_DOUBT,
+                          outbox.IN_DOUBT, outbox.FAILED])
+        self.assertNotIn('invalid', self.sent)
+        # el reintento del rate limit espera retry_delay
+        self.assertEqual(box.dispatch(), 0)
+
+    def test_crash_and_reconcile(self):
+        """Lo que se estaba enviando al caerse el proceso queda en duda;
+        el reconciliador lo resuelve consultando a NPS."""
+
+        box = self.open()
+        reached = box.submit(payment('reached'))
+        lost = box.submit(payment('lost'))
+        self.assertEqual(len(box._claim(10)), 2)
+        self.nps['reached'] = dict(psp_MerchTxRef='reached')
+
+        box = self.open()
+        self.assertEqual(box.counts(), {outbox.IN_DOUBT: 2})
+        self.assertEqual(box.reconcile(), 2)
+        self.assertEqual(box.get(reached).state, outbox.DONE)
+        self.assertEqual(box.get(lost).state, outbox.PENDING)
+        self.assertEqual(self.sent, [])
+
+        box.start()
+        box.close()
+        self.assertEqual(self.sent, ['lost'])
+        self.assertEqual(box.counts(), {outbox.DONE: 2})
+
+    def test_unresolved(self):
+        """Las refs con puntuacion se reconcilian; si la consulta falla
+        max_checks veces seguidas la entrada pasa a unresolved."""
+
+        box = self.open()
+        reached = box.submit(payment('reached-1.a_b'))
+        broken = box.submit(payment('broken-2'))
+        box._claim(10)
+        self.nps['reached-1.a_b'] = dict(psp_MerchTxRef='reached-1.a_b')
+        self.nps['broken-2'] = IOError('timed out')
+
+        box = self.open()
+        box.max_checks = 2
+        with self.assertLogs('nps.outbox', 'WARNING'):
+            self.assertEqual(box.reconcile(), 1)
+        self.assertEqual(box.get(reached).state, outbox.DONE)
+        self.assertEqual(box.get(broken).state, outbox.IN_DOUBT)
+        with self.assertLogs('nps.outbox', 'ERROR'):
+            self.assertEqual(box.reconcile(), 0)
+        entry = box.get(broken)
+        self.assertEqual(entry.state, outbox.UNRESOLVED)
+        self.assertIn('timed out', entry.error)
+        self.assertEqual(box.reconcile(), 0)
+
+    def test_suds(self):
+        """Con el engine 'suds' un SOAP Fault de NPS deja la entrada en
+        failed, y el reconciliador encuentra lo que llego a NPS."""
+
+        server = simulator.FakeNPS(strict=True, faults=[
+            simulator.Fault(1, operation='PayOnLine_3p')]).start()
+        self.addCleanup(server.stop)
+        self.gateway = NPSGateway(merchants=MerchantRegistry([
+            Merchant('merchant', server.url, 'secret')]))
+        box = self.open()
+        rejected = box.submit(payment('rejected', server.url))
+        box.dispatch()
+        entry = box.get(rejected)
+        self.assertEqual(entry.state, outbox.FAILED)
+        self.assertIn('falla simulada', entry.error)
+
+        server.faults = []
+        self.gateway.process(payment('reached', server.url))
+        reached = box.submit(payment('reached', server.url))
+        lost = box.submit(payment('lost', server.url))
+        self.assertEqual(len(box._claim(10)), 2)
+        box = self.open()
+        self.assertEqual(box.reconcile(), 2)
+        self.assertEqual(box.get(reached).state, outbox.DONE)
+        self.assertEqual(box.get(lost).state, outbox.PENDING)
+
+
+if __name__ == '__main__':
+    unittest.main()
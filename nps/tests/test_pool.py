@@ -0,0 +1,164 @@
+# -*- coding: utf-8 *-*
+
+import unittest
+
+from nps import transactions
+from nps.pool import ClientPool
+from nps.pool import PoolTimeout
+from nps.pool import TransactionPool
+
+
+class FakeClient(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+        def factory(url):
+            client = FakeClient(url)
+            self.created.append(client)
+            return client
+
+        self.pool = ClientPool(max_size=2, wait_timeout=0.01,
+                               client_factory=factory)
+
+    def test_clients_are_reused(self):
+        """Un cliente devuelto al pool se reutiliza para la misma url."""
+
+        with self.pool.acquire('http://a') as first:
+            pass
+        with self.pool.acquire('http://a') as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(len(self.created), 1)
+
+    def test_max_size(self):
+        """Con todos los clientes ocupados se espera y luego se falla."""
+
+        clients = [self.pool.get('http://a'), self.pool.get('http://a')]
+        self.assertRaises(PoolTimeout, self.pool.get, 'http://a')
+        self.pool.put(clients[0])
+        self.assertIs(self.pool.get('http://a'), clients[0])
+
+    def test_idle_eviction(self):
+        """Los clientes sin uso por mas de idle_timeout se descartan."""
+
+        self.pool.idle_timeout = 0
+        self.pool.warmup(['http://a'])
+        with self.pool.acquire('http://a'):
+            pass
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual([c.closed for c in self.created], [True, False])
+
+    def test_close(self):
+        """Los clientes descartados, vencidos o limpiados se cierran."""
+
+        with self.assertRaises(IOError):
+            with self.pool.acquire('http://a'):
+                raise IOError('Connection reset')
+        self.pool.warmup(['http://a', 'http://b'])
+        self.assertEqual([c.closed for c in self.created],
+                         [True, False, False])
+
+        self.pool.idle_timeout = 0
+        self.pool.evict_idle()
+        self.assertTrue(all(c.closed for c in self.created))
+
+        self.pool.idle_timeout = None
+        self.pool.warmup(['http://a'])
+        self.pool.clear()
+        self.assertTrue(all(c.closed for c in self.created))
+        self.assertEqual(len(self.created), 4)
+
+    def test_errors(self):
+        """Despues de una falla de NPS el cliente se reutiliza; despues de
+        un error de transporte se descarta."""
+
+        from suds import WebFault
+        from suds.transport import TransportError
+
+        with self.assertRaises(WebFault):
+            with self.pool.acquire('http://a') as first:
+                raise WebFault('Server raised fault', None)
+        with self.pool.acquire('http://a') as second:
+            pass
+        self.assertIs(first, second)
+
+        with self.assertRaises(TransportError):
+            with self.pool.acquire('http://a'):
+                raise TransportError('Connection refused', 500)
+        with self.pool.acquire('http://a') as third:
+            pass
+        self.assertIsNot(third, first)
+        self.assertEqual(len(self.created), 2)
+
+
+class TestTransactionPool(unittest.TestCase):
+
+    def test_reset(self):
+        """Una transaccion reciclada queda igual a una nueva."""
+
+        pool = TransactionPool(transactions.PayOnlineTransactionThreeSteps)
+        transaction = pool.acquire('http://a', 'merchant', 'secret')
+        request = transaction.request
+        request.psp_Country = 'URY'
+        request.psp_TxSource = 'IVR'
+        request.psp_MerchTxRef = 'ref-1'
+        transaction.response.psp_ResponseCod = '0'
+        pool.release(transaction)
+
+        recycled = pool.acquire('http://b', 'other', 'secret2')
+        self.assertIs(recycled, transaction)
+        self.assertIs(recycled.request, request)
+        fresh = transactions.PayOnlineTransactionThreeSteps(
+            'http://b', 'other', 'secret2')
+        self.assertEqual(recycled.request.to_dict(), fresh.request.to_dict())
+        self.assertEqual(recycled.request.psp_Country, 'ARG')
+        self.assertEqual(recycled.request.psp_TxSource, 'WEB')
+        self.assertIsNone(recycled.response.psp_ResponseCod)
+        self.assertEqual(recycled.url, 'http://b')
+        self.assertEqual(pool.stats(), dict(created=1, reused=1,
+                                            discarded=0, idle=0))
+
+    def test_query(self):
+        pool = TransactionPool(transactions.SimpleQueryTx, max_size=1)
+        with pool.transaction('http://a', 'merchant', 's', None, 'ref1') \
+                as query:
+            query.response.user_data = dict(psp_Amount='100')
+        with pool.transaction('http://a', 'merchant', 's', None, 'ref2') \
+                as recycled:
+            self.assertIs(recycled, query)
+            self.assertEqual(recycled.request.psp_QueryCriteriaId, 'ref2')
+            self.assertEqual(recycled.request.psp_Version, '2.2')
+            self.assertIsNone(recycled.response.user_data)
+            pool.release(pool.acquire('http://a', 'merchant', 's', None,
+                                      'ref3'))
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_double_release(self):
+        """Una transaccion devuelta dos veces no queda dos veces libre."""
+
+        pool = TransactionPool(transactions.SimpleQueryTx)
+        query = pool.acquire('http://a', 'merchant', 's', None, 'ref1')
+        pool.release(query)
+        self.assertRaises(ValueError, pool.release, query)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+        first = pool.acquire('http://a', 'merchant', 's', None, 'ref2')
+        second = pool.acquire('http://a', 'merchant', 's', None, 'ref3')
+        self.assertIs(first, query)
+        self.assertIsNot(second, first)
+        pool.release(first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 *-*
+
+import asyncio
+import threading
+import unittest
+
+from nps import transactions
+from nps.envelope import HTTPError
+from nps.envelope import SOAPFault
+from nps.gateway import NPSGateway
+from nps.ratelimit import AdaptiveLimiter
+from nps.ratelimit import RateLimited
+from nps.ratelimit import TokenBucket
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_reserve(self):
+        clock = Clock()
+        bucket = TokenBucket(2, burst=2, clock=clock)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+        self.assertRaises(RateLimited, bucket.reserve, 0.5)
+        clock.now += 1.5
+        self.assertEqual(bucket.reserve(0), 0)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def test_aimd(self):
+        """El limite sube de a uno por ronda mientras la latencia es
+        normal y se reduce una sola vez por ronda ante errores o
+        latencias altas."""
+
+        limiter = AdaptiveLimiter(initial=2, backoff=0.5)
+        for _ in range(5):
+            tickets = [limiter.acquire()
+                       for _ in range(int(limiter.limit))]
+            for ticket in tickets:
+                limiter.release(ticket, 0.1)
+        self.assertEqual(int(limiter.limit), 4)
+
+        # con el limite sin usar no sube
+        limit = limiter.limit
+        limiter.release(limiter.acquire(), 0.1)
+        self.assertEqual(limiter.limit, limit)
+
+        tickets = [limiter.acquire() for _ in range(4)]
+        for ticket in tickets:
+            limiter.release(ticket, 0.1, error=True)
+        self.assertEqual(int(limiter.limit), 2)
+        self.assertEqual(limiter.decreases, 1)
+
+        ticket = limiter.acquire()
+        limiter.release(ticket, 1.0)
+        self.assertEqual(int(limiter.limit), 1)
+        self.assertEqual(limiter.decreases, 2)
+
+    def test_error_codes(self):
+        limiter = AdaptiveLimiter(error_codes=(9,))
+        transaction = transactions.SimpleQueryTx(
+            'http://nps.test/ws.php?wsdl', 'merchant', 'secret', None, 'ref1')
+        transaction.response.psp_ResponseCod = '9'
+        self.assertTrue(limiter.failed(transaction))
+        transaction.response.psp_ResponseCod = '2'
+        self.assertFalse(limiter.failed(transaction))
+
+    def test_bounded_queue(self):
+        limiter = AdaptiveLimiter(initial=1, max_queue=1)
+        ticket = limiter.acquire()
+        self.assertRaises(RateLimited, limiter.acquire, 0.01)
+
+        waited = []
+        waiter = threading.Thread(
+            target=lambda: waited.append(limiter.acquire(5)))
+        waiter.start()
+        while not limiter.stats()['waiting']:
+            pass
+        self.assertRaises(RateLimited, limiter.acquire, 5)
+        limiter.release(ticket, 0.1)
+        waiter.join()
+        self.assertEqual(len(waited), 1)
+        self.assertEqual(limiter.stats()['inflight'], 1)
+
+    def test_async(self):
+        limiter = AdaptiveLimiter(initial=1)
+
+        async def call(log, i):
+            ticket = await limiter.acquire_async(1)
+            log.append(i)
+            await asyncio.sleep(0)
+            limiter.release(ticket, 0.01)
+
+        async def main():
+            log = []
+            await asyncio.gather(*[call(log, i) for i in range(5)])
+            return log
+
+        self.assertEqual(asyncio.run(main()), [0, 1, 2, 3, 4])
+
+    def test_async_cancel(self):
+        """Una espera cancelada no se queda con el lugar."""
+
+        limiter = AdaptiveLimiter(initial=1)
+
+        async def main():
+            ticket = await limiter.acquire_async()
+            waiting = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            limiter.release(ticket, 0.01)
+            await asyncio.sleep(0)
+            return waiting.cancelled()
+
+        self.assertTrue(asyncio.run(main()))
+        self.assertEqual(limiter.stats()['inflight'], 0)
+        self.assertEqual(limiter.stats()['waiting'], 0)
+
+    def test_gateway(self):
+        """El gateway pide lugar al limiter para cada llamada y le avisa
+        de las respuestas de sobrecarga."""
+
+        limiter = AdaptiveLimiter(initial=4, error_codes=('9',))
+        gateway = NPSGateway(limiter=limiter)
+        codes = ['2', '9']
+
+        def call(transaction, timer, merchant):
+            self.assertEqual(limiter.inflight, 1)
+            transaction.response.psp_ResponseCod = codes.pop(0)
+
+        gateway._call = call
+        for _ in range(2):
+            gateway.process(transactions.SimpleQueryTx(
+                'http://nps.test/ws.php?wsdl', 'merchant', 'secret', None,
+                'ref1'))
+        self.assertEqual(limiter.inflight, 0)
+        self.assertEqual(limiter.decreases, 1)
+
+    def test_gateway_errors(self):
+        """Un SOAP Fault es una respuesta de NPS: no baja el limite. Un
+        error de red o un 503 si."""
+
+        # sin tolerance las latencias de microsegundos tambien lo bajarian
+        limiter = AdaptiveLimiter(initial=4, tolerance=1e6)
+        gateway = NPSGateway(limiter=limiter)
+        errors = [SOAPFault('Server', 'Invalid'), ValueError('invalid'),
+                  HTTPError(503, ''), IOError('timed out')]
+
+        def call(transaction, timer, merchant):
+            raise errors.pop(0)
+
+        gateway._call = call
+        decreases = []
+        for _ in range(4):
+            with self.assertRaises(Exception):
+                gateway.process(transactions.SimpleQueryTx(
+                    'http://nps.test/ws.php?wsdl', 'merchant', 'secret',
+                    None, 'ref1'))
+            decreases.append(limiter.decreases)
+        self.assertEqual(decreases, [0, 0, 1, 2])
+        self.assertEqual(limiter.inflight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 *-*
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nps import reconcile
+from nps import simulator
+from nps import transactions
+from nps.gateway import NPSGateway
+
+
+class TestReconcile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_bounded(self):
+        """Se procesan todos los items y los errores se entregan como
+        resultado."""
+
+        def fn(item):
+            if item == 3:
+                raise ValueError(item)
+            return item * 2
+
+        results = dict(reconcile.run_bounded(fn, range(10), 4))
+        self.assertEqual(sorted(results), list(range(10)))
+        self.assertIsInstance(results[3], ValueError)
+        self.assertEqual(results[9], 18)
+
+    def test_retry(self):
+        """Los errores transitorios se reintentan."""
+
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) < 3:
+                raise IOError()
+            return 'ok'
+
+        self.assertEqual(reconcile.retry(fn, retries=3, backoff=0), 'ok')
+        self.assertEqual(len(calls), 3)
+
+        del calls[:]
+        self.assertRaises(IOError, reconcile.retry, fn, 1, 0)
+
+    def test_checkpoint_resume(self):
+        """Un checkpoint nuevo sobre el mismo archivo conoce lo hecho."""
+
+        path = os.path.join(self.tmpdir, 'checkpoint')
+        checkpoint = reconcile.Checkpoint(path)
+        checkpoint.add('ref-1')
+        checkpoint.close()
+        checkpoint = reconcile.Checkpoint(path)
+        self.assertIn('ref-1', checkpoint)
+        self.assertNotIn('ref-2', checkpoint)
+        checkpoint.close()
+
+    def test_query_many(self):
+        """query_many consulta por psp_MerchTxRef (con la puntuacion que
+        permite psp_MerchTxRef) y saltea las refs del checkpoint."""
+
+        server = simulator.FakeNPS(strict=True).start()
+        self.addCleanup(server.stop)
+        gateway = NPSGateway(engine='template', transaction_data=True)
+        paid = dict()
+        for ref in ('ref1', 'ref-2.b_c'):
+            payment = transactions.PayOnlineTransactionThreeSteps(
+                server.url, 'tienda', 'secret')
+            request = payment.request
+            request.psp_MerchantId = 'tienda'
+            request.psp_MerchTxRef = ref
+            request.psp_Amount = '10.00'
+            request.psp_ReturnURL = 'http://shop.example.com/return'
+            request.psp_CustomerMail = 'customer@example.com'
+            request.psp_PosDateTime = '2014-01-01 10:00:00'
+            paid[ref] = gateway.process(payment).response.psp_TransactionId
+
+        path = os.path.join(self.tmpdir, 'checkpoint')
+        results = dict(gateway.query_many(['ref1', 'ref-2.b_c', 'ref3'],
+                                          server.url, 'tienda', 'secret',
+                                          checkpoint=path))
+        for ref in ('ref1', 'ref-2.b_c'):
+            request = results[ref].request
+            self.assertEqual(request.psp_QueryCriteria, 'M')
+            self.assertIsNotNone(request.psp_PosDateTime)
+            response = results[ref].response
+            self.assertEqual(response.psp_ResponseCod, simulator.QUERY_OK[0])
+            self.assertEqual(response.user_data['psp_TransactionId'],
+                             paid[ref])
+        self.assertEqual(results['ref3'].response.psp_ResponseCod,
+                         simulator.NOT_FOUND[0])
+
+        again = dict(gateway.query_many(['ref1', 'ref4'], server.url,
+                                        'tienda', 'secret',
+                                        checkpoint=path))
+        self.assertEqual(list(again), ['ref4'])
+
+        by_id = gateway.process(transactions.SimpleQueryTx(
+            server.url, 'tienda', 'secret', paid['ref-2.b_c'], None))
+        self.assertEqual(by_id.request.psp_QueryCriteria, 'T')
+        self.assertEqual(by_id.response.user_data['psp_MerchTxRef'],
+                         'ref-2.b_c')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 *-*
+
+import socket
+import threading
+import time
+import unittest
+
+from nps import hashing
+from nps import simulator
+from nps import transactions
+from nps.envelope import HTTPError
+from nps.envelope import SOAPFault
+from nps.gateway import NPSGateway
+
+
+def payment(url, ref, secret='secret'):
+    transaction = transactions.PayOnlineTransactionThreeSteps(
+        url, 'tienda', secret)
+    request = transaction.request
+    request.psp_MerchantId = 'tienda'
+    request.psp_MerchTxRef = ref
+    request.psp_Amount = '150.32'
+    request.psp_ReturnURL = 'http://shop.example.com/return?a=1&b=2'
+    request.psp_CustomerMail = 'customer@example.com'
+    request.psp_PosDateTime = '2014-01-01 10:00:00'
+    return transaction
+
+
+def query(url, ref):
+    return transactions.SimpleQueryTx(url, 'tienda', 'secret', None, ref)
+
+
+class TestSimulator(unittest.TestCase):
+
+    def start(self, **kwargs):
+        server = simulator.FakeNPS(**kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_payments(self):
+        """Los pagos con un secure hash valido se registran y se
+        encuentran al consultarlos; los invalidos se rechazan."""
+
+        server = self.start(secrets={'tienda': 'secret'}, strict=True)
+        gateway = NPSGateway(engine='template', transaction_data=True)
+
+        paid = gateway.process(payment(server.url, 'ref1'))
+        self.assertTrue(paid.success)
+        transaction_id = paid.response.psp_TransactionId
+        again = gateway.process(payment(server.url, 'ref1'))
+        self.assertEqual(again.response.psp_TransactionId, transaction_id)
+
+        found = gateway.process(query(server.url, 'ref1'))
+        self.assertEqual(found.response.user_data['psp_TransactionId'],
+                         transaction_id)
+        self.assertEqual(found.response.user_data['psp_Amount'], '15032')
+        missing = gateway.process(query(server.url, 'ref2'))
+        self.assertEqual(missing.response.psp_ResponseCod,
+                         simulator.NOT_FOUND[0])
+
+        rejected = gateway.process(payment(server.url, 'ref3', 'wrong'))
+        self.assertFalse(rejected.success)
+        self.assertEqual(rejected.response.psp_ResponseCod,
+                         simulator.INVALID_HASH[0])
+        stats = server.stats()
+        self.assertEqual(stats['invalid_hash'], 1)
+        self.assertEqual(stats['transactions'], 1)
+
+    def test_hash_backends(self):
+        """process() firma y envia los requests con cada backend."""
+
+        for backend in (hashing.MD5(), hashing.SHA256(), hashing.HMAC(),
+                        hashing.HMAC('sha512')):
+            server = self.start(secrets={'tienda': 'secret'}, strict=True,
+                                hash_backend=backend)
+            for engine in ('suds', 'template'):
+                gateway = NPSGateway(engine=engine, hash_backend=backend)
+                ref = 'ref%s' % engine
+                paid = gateway.process(payment(server.url, ref))
+                self.assertTrue(paid.success, backend)
+                found = gateway.process(query(server.url, ref))
+                self.assertEqual(found.response.psp_ResponseCod,
+                                 simulator.QUERY_OK[0])
+                self.assertEqual(
+                    found.request.psp_SecureHash,
+                    hashing.secure_hash(found, backend))
+            self.assertNotIn('invalid_hash', server.stats())
+
+    def test_faults(self):
+        server = self.start(faults=[
+            simulator.Fault(1, operation='PayOnLine_3p'),
+            simulator.Fault(1, status=503, operation='SimpleQueryTx')])
+        gateway = NPSGateway(engine='template')
+        self.assertRaises(SOAPFault, gateway.process,
+                          payment(server.url, 'ref1'))
+        with self.assertRaises(HTTPError) as error:
+            gateway.process(query(server.url, 'ref1'))
+        self.assertEqual(error.exception.status, 503)
+
+        server.faults = [simulator.Fault(1, cod='5',
+                                         message='Error: rechazada')]
+        rejected = gateway.process(payment(server.url, 'ref1'))
+        self.assertEqual(rejected.response.psp_ResponseCod, '5')
+        self.assertFalse(rejected.success)
+
+    def test_dropped_connection(self):
+        """Si NPS corta la conexion despues de recibir el pedido, solo las
+        consultas se repiten: un pago pudo haberse procesado."""
+        server = self.start()
+        gateway = NPSGateway(engine='template')
+        gateway.process(query(server.url, 'ref1'))
+
+        server.faults = [simulator.Fault(1, drop=True)]
+        self.assertRaises(IOError, gateway.process,
+                          payment(server.url, 'ref1'))
+        self.assertEqual(server.stats()['fault'], 1)
+        self.assertRaises(IOError, gateway.process,
+                          query(server.url, 'ref1'))
+        self.assertEqual(server.stats()['fault'], 3)
+
+    def test_closed_idle_connection(self):
+        """Una conexion libre que el servidor cerro se reemplaza antes de
+        mandar el pedido, asi un POST no idempotente no falla."""
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        self.addCleanup(listener.close)
+
+        def serve():
+            # contesta un pedido por conexion y la cierra, sin avisar
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                with conn:
+                    conn.recv(65536)
+                    conn.sendall(b'HTTP/1.1 200 OK\r\n'
+                                 b'Content-Length: 2\r\n\r\nok')
+
+        threading.Thread(target=serve, daemon=True).start()
+        url = 'http://127.0.0.1:%s/ws.php' % listener.getsockname()[1]
+        gateway = NPSGateway(engine='template')
+        self.assertEqual(gateway.post(url, b'x', {}), (200, b'ok'))
+        time.sleep(0.05)
+
+        idle, = gateway.connections._idle.values()
+        conn = idle[0].client
+        opened = []
+        request = conn.request
+
+        def check(*args):
+            opened.append(conn.sock is None)
+            return request(*args)
+
+        conn.request = check
+        self.assertEqual(gateway.post(url, b'x', {}), (200, b'ok'))
+        self.assertEqual(opened, [True])
+
+    def test_throttling(self):
+        server = self.start(rate=1, burst=2, latency=simulator.fixed(0))
+        gateway = NPSGateway(engine='template')
+        gateway.process(query(server.url, 'ref1'))
+        gateway.process(query(server.url, 'ref2'))
+        with self.assertRaises(HTTPError) as error:
+            gateway.process(query(server.url, 'ref3'))
+        self.assertEqual(error.exception.status, 429)
+        self.assertEqual(server.stats()['throttled'], 1)
+
+    def test_lognormal(self):
+        import random
+
+        latency = simulator.lognormal(0.05, 0.5)
+        rnd = random.Random(1)
+        samples = sorted(latency(rnd) for _ in range(20000))
+        self.assertAlmostEqual(samples[10000], 0.05, delta=0.005)
+        self.assertAlmostEqual(samples[19800], 0.5, delta=0.08)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 *-*
 
+import hashlib
 import unittest
+
+from nps import hashing
 from nps import transactions
+from nps.gateway import NPSGateway
 
 
 class TestPayOnlineTransactionThreeSteps(unittest.TestCase):
@@ -21,6 +25,43 @@ class TestPayOnlineTransactionThreeSteps(unittest.TestCase):
         transaction.request.psp_Amount = '105.05'
         self.assertEquals(transaction.request.items.get('psp_Amount'), '10505')
 
+    def test_request_schema(self):
+        """El schema se calcula una vez por clase y respeta el orden
+        alfabetico que exige el secure hash."""
+
+        schema = transactions.PayOnlineTransactionThreeStepsRequest.schema
+        self.assertEqual(schema.names[0], 'psp_ReturnURL')
+        self.assertEqual(list(schema.hash_order),
+                         sorted(set(schema.names) - set(['psp_SecureHash'])))
+        request = transactions.PayOnlineTransactionThreeStepsRequest()
+        request.psp_Amount = '10'
+        self.assertEqual(request.to_dict(), request.items)
+        self.assertEqual(len(request.values_tuple()), len(schema.names))
+
+    def test_secure_hash(self):
+        """md5 de los campos ordenados alfabeticamente + secret, igual en
+        el calculo individual y en lote."""
+
+        built = []
+        for i in range(5):
+            transaction = transactions.PayOnlineTransactionThreeSteps(
+                'http://untitest.com', 'unittest', 'topsecret')
+            transaction.request.psp_Amount = '%s.00' % i
+            transaction.request.psp_MerchTxRef = 'ref%s' % i
+            built.append(transaction)
+
+        expected = hashlib.md5(
+            ('100' + 'ARG' + 'ref1' + 'WEB' + 'topsecret').encode('utf-8'))
+        gateway = NPSGateway()
+        self.assertEqual(gateway.create_secure_hash_for(built[1]),
+                         expected.hexdigest())
+
+        hashes = [gateway.create_secure_hash_for(t) for t in built]
+        self.assertEqual(gateway.create_secure_hashes(built), hashes)
+        self.assertEqual(hashing.secure_hashes(built, hashing.MD5(),
+                                               workers=2, chunksize=2),
+                         hashes)
+
 
 if __name__ == '__main__':
     unittest.main()
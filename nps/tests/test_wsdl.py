@@ -0,0 +1,108 @@
+# -*- coding: utf-8 *-*
+
+import contextlib
+import io
+import os
+import pathlib
+import pickle
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from nps import wsdl
+from nps.gateway import NPSGateway
+from nps.simulator import WSDL
+
+
+class TestWSDLArtifact(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wsdl = os.path.join(self.directory, 'nps.wsdl')
+        shutil.copy(WSDL, self.wsdl)
+        self.url = pathlib.Path(self.wsdl).as_uri()
+        self.path = os.path.join(self.directory, 'nps.wsdlc')
+        self.artifact = wsdl.compile_wsdl(self.url)
+        self.artifact.save(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        artifact = wsdl.WSDLArtifact.load(self.path)
+        self.assertEqual(artifact.url, self.url)
+        self.assertEqual(artifact.sha256, self.artifact.sha256)
+        with open(self.wsdl, 'rb') as fh:
+            self.assertTrue(artifact.matches(fh.read()))
+        self.assertFalse(artifact.matches(b'<definitions/>'))
+        self.assertEqual(set(artifact.description.operations),
+                         set(self.artifact.description.operations))
+
+        with open(self.path, 'wb') as fh:
+            pickle.dump({'url': self.url}, fh)
+        self.assertRaises(ValueError, wsdl.WSDLArtifact.load, self.path)
+        self.assertIsNone(NPSGateway().load_artifact(self.path))
+
+    def test_artifact_cache(self):
+        """Los clientes se arman con las definiciones del artefacto, sin
+        volver a leer el WSDL."""
+        gateway = NPSGateway(artifacts=[self.path])
+        self.assertIn(self.url, gateway.artifacts)
+        os.remove(self.wsdl)
+
+        client = gateway.create_client(self.url)
+        self.assertIsInstance(client.options.cache, wsdl.ArtifactCache)
+        self.assertIn('SimpleQueryTx',
+                      [method.name for method in
+                       client.wsdl.services[0].ports[0].methods.values()])
+        self.assertIs(gateway.describe(self.url),
+                      gateway.artifacts[self.url].description)
+
+    def test_fallback(self):
+        """Si el WSDL publicado cambio, el artefacto se ignora."""
+        with open(self.wsdl, 'ab') as fh:
+            fh.write(b'\n<!-- changed -->\n')
+        gateway = NPSGateway(artifacts=[self.path])
+        self.assertNotIn(self.url, gateway.artifacts)
+        client = gateway.create_client(self.url)
+        self.assertNotIsInstance(client.options.cache, wsdl.ArtifactCache)
+
+        self.assertIsNotNone(gateway.load_artifact(self.path, verify=False))
+
+        # Sin acceso al WSDL publicado se usa el artefacto.
+        os.remove(self.wsdl)
+        with self.assertLogs('nps.gateway', 'WARNING'):
+            self.assertIsNotNone(NPSGateway().load_artifact(self.path))
+
+    def test_verify_timeout(self):
+        """Un servidor que no contesta no traba la construccion del
+        gateway: pasado el timeout se usa el artefacto."""
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+        self.artifact.url = 'http://127.0.0.1:%s/ws.php?wsdl' % (
+            server.getsockname()[1])
+        self.artifact.save(self.path)
+
+        started = time.monotonic()
+        with self.assertLogs('nps.gateway', 'WARNING'):
+            gateway = NPSGateway(timeout=0.2, artifacts=[self.path])
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIn(self.artifact.url, gateway.artifacts)
+
+    def test_main(self):
+        path = os.path.join(self.directory, 'cli.wsdlc')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(wsdl.main([self.url, '-o', path]), 0)
+        self.assertEqual(out.getvalue(),
+                         '%s %s\n' % (self.artifact.sha256, path))
+        self.assertEqual(wsdl.WSDLArtifact.load(path).sha256,
+                         self.artifact.sha256)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,79 @@
 # -*- coding: utf-8 *-*
 
+from datetime import datetime
 
+from nps import config
 from nps import fields
-from nps.config import settings
 
 
-class BaseRequestResponse(object):
+class Schema(object):
+    """Campos psp_* de una clase de request/response, calculados una sola
+    vez al definir la clase.
+
+    Atributos:
+        names: Nombres de los campos en orden de definicion.
+        descriptors: Los fields correspondientes a `names`.
+        hash_order: Nombres ordenados alfabeticamente, sin psp_SecureHash,
+                    tal como los necesita el calculo del secure hash.
+        hash_indexes: Posiciones en `names` de los campos de `hash_order`.
+        name_set: frozenset de `names`.
+        defaults: Valores iniciales de los campos, en el orden de `names`.
+                  Se validan recien al crear la primera instancia, de modo
+                  que definir la clase no lea la configuracion.
+        computed: True si algun campo calcula su valor al leerlo.
+    """
+
+    __slots__ = ('names', 'descriptors', 'hash_order', 'hash_indexes',
+                 'name_set', '_defaults', 'computed')
+
+    def __init__(self, fields):
+        self.names = tuple(name for name, _ in fields)
+        self.descriptors = tuple(descriptor for _, descriptor in fields)
+        self._defaults = None
+        self.computed = any(getattr(descriptor, 'computed', False)
+                            for descriptor in self.descriptors)
+        self.hash_order = tuple(sorted(name for name in self.names
+                                       if name != 'psp_SecureHash'))
+        self.hash_indexes = tuple(self.names.index(name)
+                                  for name in self.hash_order)
+        self.name_set = frozenset(self.names)
+
+    @property
+    def defaults(self):
+        if self._defaults is None:
+            self._defaults = tuple(
+                descriptor.initial() if hasattr(descriptor, 'initial')
+                else None for descriptor in self.descriptors)
+        return self._defaults
+
+
+class SchemaMeta(type):
+    """Arma el Schema de cada clase de request/response.
+
+    Las clases se crean con __slots__ y cada field recibe su posicion en
+    la lista `_values` de la instancia, donde guarda su valor.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        namespace.setdefault('__slots__', ())
+        cls = super(SchemaMeta, mcs).__new__(mcs, name, bases, namespace)
+        fields = dict()
+        for klass in reversed(cls.__mro__):
+            for key, value in vars(klass).items():
+                if key.startswith('psp'):
+                    fields[key] = value
+        cls.schema = Schema(list(fields.items()))
+        for index, descriptor in enumerate(cls.schema.descriptors):
+            descriptor.index = index
+        return cls
+
+
+class BaseRequestResponse(object, metaclass=SchemaMeta):
+
+    __slots__ = ('_values', 'user_data')
+
+    def __init__(self):
+        self._values = list(self.schema.defaults)
 
     def __getitem__(self, key):
         return getattr(self, key)
@@ -15,18 +83,66 @@ class BaseRequestResponse(object):
 
     @property
     def items(self):
-        data = dict()
-        for k in [k for k in self.__class__.__dict__ if
-            k.startswith('psp')]:
-            data[k] = getattr(self, k)
-        return data
+        return self.to_dict()
+
+    def reset(self):
+        """Vuelve todos los campos a sus valores por defecto, reusando la
+        lista de valores (ver pool.TransactionPool)."""
+        self._values[:] = self.schema.defaults
+        self.user_data = None
+
+    def values_tuple(self):
+        """Valores de los campos, en el orden de `schema.names`."""
+        if not self.schema.computed:
+            return tuple(self._values)
+        return tuple([getattr(self, name) for name in self.schema.names])
+
+    def to_dict(self):
+        return dict(zip(self.schema.names, self.values_tuple()))
+
+
+class Transaction(object):
+    """Base de las transacciones generadas con nps.codegen. Las subclases
+    definen method, factory, request_class y response_class."""
+
+    method = None
+    factory = None
+    request_class = None
+    response_class = None
+
+    def __init__(self, url, merchant_id, secret):
+        """ Parametros del constructor:
+                url: Url del servicio de NPS.
+                merchant_id: Usuario dado por NPS
+                secret: El password utilizado con merchant_id.
+        """
+        self.url = url
+        self.merchant_id = merchant_id
+        self.secret = secret
+        self.request = self.request_class()
+        self.response = self.response_class()
+        if merchant_id is not None and \
+                'psp_MerchantId' in self.request.schema.name_set:
+            self.request.psp_MerchantId = merchant_id
+
+    def reset(self, url, merchant_id, secret):
+        """Deja la transaccion como recien creada con estos parametros,
+        sin crear un request y una respuesta nuevos."""
+        self.url = url
+        self.merchant_id = merchant_id
+        self.secret = secret
+        self.request.reset()
+        self.response.reset()
+        if merchant_id is not None and \
+                'psp_MerchantId' in self.request.schema.name_set:
+            self.request.psp_MerchantId = merchant_id
 
 
 class PayOnlineTransactionThreeStepsRequest(BaseRequestResponse):
     """Camos utilizados en un request de tres pasos."""
 
     psp_ReturnURL = fields.Url()
-    psp_SecureHash = fields.MD5()
+    psp_SecureHash = fields.SecureHash()
     psp_CustomerMail = fields.Email()
     psp_MerchantMail = fields.Email()
     psp_FrmBackButtonURL = fields.Url()
@@ -43,9 +159,9 @@ class PayOnlineTransactionThreeStepsRequest(BaseRequestResponse):
     psp_Version = fields.Version()
 
     psp_Country = fields.Country(length=3,
-        in_=settings.ALLOWED_COUNTRIES, default='ARG')
+        in_=config.Setting('ALLOWED_COUNTRIES'), default='ARG')
     psp_TxSource = fields.Alfa(max_length=13,
-        in_=settings.ALLOWED_TX_SOURCES, default='WEB')
+        in_=config.Setting('ALLOWED_TX_SOURCES'), default='WEB')
 
 
 class PayOnlineTransactionThreeStepsResponse(BaseRequestResponse):
@@ -87,6 +203,15 @@ class PayOnlineTransactionThreeSteps(object):
         self.request = PayOnlineTransactionThreeStepsRequest()
         self.response = PayOnlineTransactionThreeStepsResponse()
 
+    def reset(self, url, merchant_id, secret):
+        """Deja la transaccion como recien creada con estos parametros,
+        sin crear un request y una respuesta nuevos."""
+        self.url = url
+        self.merchant_id = merchant_id
+        self.secret = secret
+        self.request.reset()
+        self.response.reset()
+
     @property
     def success(self):
         return len(self.errors) == 0
@@ -115,9 +240,9 @@ class SimpleQueryTxRquest(BaseRequestResponse):
     psp_Version = fields.Order(max_length=12, default='2.2')
     psp_MerchantId = fields.MerchantId(max_length=14)
     psp_QueryCriteria = fields.Alfanumeric(length=1)
-    psp_QueryCriteriaId = fields.Alfanumeric(max_length=64)
+    psp_QueryCriteriaId = fields.Order(max_length=64)
     psp_PosDateTime = fields.DateTime()
-    psp_SecureHash = fields.MD5()
+    psp_SecureHash = fields.SecureHash()
 
 
 class SimpleQueryTxResponse(BaseRequestResponse):
@@ -128,7 +253,7 @@ class SimpleQueryTxResponse(BaseRequestResponse):
     psp_ResponseExtended = fields.Text(max_length=255)
     psp_MerchantId = fields.MerchantId(max_length=14)
     psp_QueryCriteria = fields.Alfanumeric(length=1)
-    psp_QueryCriteriaId = fields.Alfanumeric(max_length=64)
+    psp_QueryCriteriaId = fields.Order(max_length=64)
     psp_PosDateTime = fields.Text(max_length=255)
 
 
@@ -137,17 +262,46 @@ class SimpleQueryTx(object):
 
     method = 'SimpleQueryTx'
     factory = u'RequerimientoStruct_SimpleQueryTx'
+    # consultar dos veces retorna lo mismo: la respuesta se puede cachear
+    # y el request se puede repetir.
+    idempotent = True
 
     def __init__(self, url, merchant_id, secret,  psp_TransactionId, psp_MerchTxRef):
         """ Parametros del constructor:
                 url: Url del servicio de NPS.
                 merchant_id: Usuario dado por NPS
                 secret: El password utilizado con merchant_id.
+                psp_TransactionId: Id de la transaccion en NPS. Si se
+                                   indica, se consulta por este id
+                                   (psp_QueryCriteria 'T').
+                psp_MerchTxRef: Referencia del comercio, usada cuando no
+                                se indica psp_TransactionId
+                                (psp_QueryCriteria 'M').
         """
         self.url = url
         self.merchant_id = merchant_id
         self.secret = secret
         self.request = SimpleQueryTxRquest()
-        self.request.psp_MerchantId = merchant_id
-        self.request.psp_QueryCriteriaId = psp_MerchTxRef
+        self._set_request(merchant_id, psp_TransactionId, psp_MerchTxRef)
         self.response = SimpleQueryTxResponse()
+
+    def _set_request(self, merchant_id, psp_TransactionId, psp_MerchTxRef):
+        request = self.request
+        request.psp_MerchantId = merchant_id
+        if psp_TransactionId is not None:
+            request.psp_QueryCriteria = 'T'
+            request.psp_QueryCriteriaId = str(psp_TransactionId)
+        else:
+            request.psp_QueryCriteria = 'M'
+            request.psp_QueryCriteriaId = psp_MerchTxRef
+        request.psp_PosDateTime = datetime.now()
+
+    def reset(self, url, merchant_id, secret, psp_TransactionId,
+              psp_MerchTxRef):
+        """Como __init__, reusando el request y la respuesta."""
+        self.url = url
+        self.merchant_id = merchant_id
+        self.secret = secret
+        self.request.reset()
+        self._set_request(merchant_id, psp_TransactionId, psp_MerchTxRef)
+        self.response.reset()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 *-*
+
+"""Compilacion offline del WSDL de NPS.
+
+El WSDL (y los XSD que incluye) se descargan y se parsean una unica vez,
+y el resultado se serializa en un artefacto local que `NPSGateway` carga
+en milisegundos al arrancar. Uso desde la linea de comandos:
+
+    nps-compile-wsdl https://sandbox.nps.com.ar/ws.php?wsdl -o nps.wsdlc
+"""
+
+import argparse
+import hashlib
+import pickle
+import sys
+
+from urllib.request import urlopen
+from xml.etree import ElementTree
+
+from suds.cache import Cache
+from suds.cache import NoCache
+from suds.client import Client
+
+
+WSDL_NS = 'http://schemas.xmlsoap.org/wsdl/'
+SOAP_NS = 'http://schemas.xmlsoap.org/wsdl/soap/'
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+
+
+def _local(qname):
+    """'tns:Foo' -> 'Foo'."""
+    return qname.rsplit(':', 1)[-1] if qname else qname
+
+
+def _tag(ns, name):
+    return '{%s}%s' % (ns, name)
+
+
+class Operation(object):
+    """Descripcion de una operacion del servicio."""
+
+    def __init__(self, name, soap_action='', style='rpc', use='literal',
+                 namespace=None, input_part=None, input_type=None,
+                 output_part=None, output_type=None):
+        self.name = name
+        self.soap_action = soap_action
+        self.style = style
+        self.use = use
+        self.namespace = namespace
+        self.input_part = input_part
+        self.input_type = input_type
+        self.output_part = output_part
+        self.output_type = output_type
+
+
+class ServiceDescription(object):
+    """Lo que hace falta saber del WSDL para armar y leer mensajes SOAP
+    sin recorrer el schema en cada llamada.
+
+    Atributos:
+        namespace: targetNamespace del WSDL.
+        location: Url del endpoint SOAP.
+        operations: dict nombre -> Operation.
+        types: dict nombre de tipo -> tupla con los nombres de sus campos.
+        nested: dict nombre de tipo -> frozenset de los campos que son a
+                su vez de un tipo complejo (psp_Transaction).
+    """
+
+    def __init__(self, namespace, location, operations, types, nested=None):
+        self.namespace = namespace
+        self.location = location
+        self.operations = operations
+        self.types = types
+        self.nested = nested or {}
+
+
+def parse_wsdl(data):
+    """Parsea el contenido de un WSDL y retorna un ServiceDescription."""
+
+    root = ElementTree.fromstring(data)
+    namespace = root.get('targetNamespace')
+
+    types = dict()
+    element_types = dict()
+    for schema in root.iter(_tag(XSD_NS, 'schema')):
+        for node in schema:
+            name = node.get('name')
+            if node.tag == _tag(XSD_NS, 'element'):
+                node = node.find(_tag(XSD_NS, 'complexType'))
+            if name and node is not None and \
+                    node.tag == _tag(XSD_NS, 'complexType'):
+                elements = [e for e in node.iter(_tag(XSD_NS, 'element'))
+                            if e.get('name')]
+                types[name] = tuple(e.get('name') for e in elements)
+                element_types[name] = [(e.get('name'), _local(e.get('type')))
+                                       for e in elements]
+    nested = dict((name, frozenset(field for field, type_ in elements
+                                   if type_ in types))
+                  for name, elements in element_types.items())
+
+    messages = dict()
+    for message in root.findall(_tag(WSDL_NS, 'message')):
+        part = message.find(_tag(WSDL_NS, 'part'))
+        if part is None:
+            continue
+        messages[message.get('name')] = (
+            part.get('name'), _local(part.get('type') or part.get('element')))
+
+    operations = dict()
+    for port_type in root.findall(_tag(WSDL_NS, 'portType')):
+        for node in port_type.findall(_tag(WSDL_NS, 'operation')):
+            input_ = node.find(_tag(WSDL_NS, 'input'))
+            output = node.find(_tag(WSDL_NS, 'output'))
+            operation = Operation(node.get('name'))
+            if input_ is not None:
+                operation.input_part, operation.input_type = messages.get(
+                    _local(input_.get('message')), (None, None))
+            if output is not None:
+                operation.output_part, operation.output_type = messages.get(
+                    _local(output.get('message')), (None, None))
+            operations[operation.name] = operation
+
+    for binding in root.findall(_tag(WSDL_NS, 'binding')):
+        soap_binding = binding.find(_tag(SOAP_NS, 'binding'))
+        style = 'document'
+        if soap_binding is not None:
+            style = soap_binding.get('style', style)
+        for node in binding.findall(_tag(WSDL_NS, 'operation')):
+            operation = operations.get(node.get('name'))
+            if operation is None:
+                continue
+            soap_operation = node.find(_tag(SOAP_NS, 'operation'))
+            operation.style = style
+            if soap_operation is not None:
+                operation.soap_action = soap_operation.get('soapAction', '')
+                operation.style = soap_operation.get('style', style)
+            body = node.find('%s/%s' % (_tag(WSDL_NS, 'input'),
+                                        _tag(SOAP_NS, 'body')))
+            if body is not None:
+                operation.use = body.get('use', 'literal')
+                operation.namespace = body.get('namespace')
+            operation.namespace = operation.namespace or namespace
+
+    location = None
+    address = root.find('.//%s/%s/%s' % (_tag(WSDL_NS, 'service'),
+                                         _tag(WSDL_NS, 'port'),
+                                         _tag(SOAP_NS, 'address')))
+    if address is not None:
+        location = address.get('location')
+
+    return ServiceDescription(namespace, location, operations, types, nested)
+
+
+def fetch(url, timeout=None):
+    """Descarga el WSDL sin parsearlo, esperando a lo sumo `timeout`
+    segundos por la conexion y por cada lectura."""
+    with urlopen(url, timeout=timeout) as fh:
+        return fh.read()
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class WSDLArtifact(object):
+    """WSDL compilado: hash del documento original, la descripcion del
+    servicio y las definiciones ya parseadas por suds."""
+
+    FORMAT = 1
+
+    def __init__(self, url, sha256, description, definitions=None):
+        self.format = self.FORMAT
+        self.url = url
+        self.sha256 = sha256
+        self.description = description
+        self.definitions = definitions
+
+    def matches(self, data):
+        """True si `data` es el mismo WSDL que se compilo."""
+        return digest(data) == self.sha256
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            pickle.dump(self, fh, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Carga un artefacto. Solo deben cargarse artefactos propios: el
+        formato es pickle."""
+        with open(path, 'rb') as fh:
+            artifact = pickle.load(fh)
+        if not isinstance(artifact, cls) or artifact.format != cls.FORMAT:
+            raise ValueError('%s is not a compatible WSDL artifact' % path)
+        return artifact
+
+    def cache(self):
+        """Cache de suds que entrega las definiciones ya parseadas."""
+        return ArtifactCache(self.definitions)
+
+
+class ArtifactCache(Cache):
+    """Cache de objetos de suds (cachingpolicy=1) que solo contiene las
+    definiciones del artefacto."""
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+
+    def get(self, id):
+        return self.definitions
+
+    def put(self, id, object):
+        pass
+
+    def purge(self, id):
+        pass
+
+    def clear(self):
+        pass
+
+
+def compile_wsdl(url):
+    """Descarga y parsea el WSDL de `url` y retorna un WSDLArtifact."""
+    data = fetch(url)
+    client = Client(url, cache=NoCache())
+    return WSDLArtifact(url, digest(data), parse_wsdl(data), client.wsdl)
+
+
+def create_client(url, artifact=None):
+    """Construye un cliente suds, usando el artefacto si lo hay."""
+    if artifact is None or artifact.definitions is None:
+        return Client(url)
+    return Client(url, cache=artifact.cache(), cachingpolicy=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compile the NPS WSDL into a local artifact.')
+    parser.add_argument('url', help='WSDL url')
+    parser.add_argument('-o', '--output', default='nps.wsdlc',
+                        help='artifact path (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    artifact = compile_wsdl(args.url)
+    artifact.save(args.output)
+    sys.stdout.write('%s %s\n' % (artifact.sha256, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -44,9 +44,12 @@ setup(
     url=url,
     license=license,
     packages=find_packages(library_name),
+    package_data={'nps': ['simulator.wsdl']},
     install_requires=['suds-jurko',],
     entry_points={
         'console_scripts':
-            []
+            ['nps-compile-wsdl = nps.wsdl:main',
+             'nps-generate-transactions = nps.codegen:main',
+             'nps-simulator = nps.simulator:main']
             },
     )